@@ -0,0 +1,50 @@
+"""add player_stats leaderboard aggregate
+
+Revision ID: 5b7e2c9a1d4f
+Revises: 3aa44cd1c307
+Create Date: 2025-08-04 10:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e2c9a1d4f'
+down_revision: Union[str, Sequence[str], None] = '3aa44cd1c307'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'player_stats',
+        sa.Column('player_id', sa.Integer(), nullable=False),
+        sa.Column('total_score', sa.Float(), nullable=False),
+        sa.Column('total_profit', sa.Float(), nullable=False),
+        sa.Column('total_trades', sa.Integer(), nullable=False),
+        sa.Column('score_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['player_id'], ['players.id'], ),
+        sa.PrimaryKeyConstraint('player_id')
+    )
+    op.create_index(op.f('ix_player_stats_total_score'), 'player_stats', ['total_score'], unique=False)
+    op.create_index(op.f('ix_player_stats_total_profit'), 'player_stats', ['total_profit'], unique=False)
+
+    # Backfill from existing scores so the leaderboard is correct straight after the upgrade
+    op.execute("""
+        INSERT INTO player_stats (player_id, total_score, total_profit, total_trades, score_count, updated_at)
+        SELECT player_id, SUM(total_score), SUM(total_profit), SUM(total_trades), COUNT(*), NOW() AT TIME ZONE 'utc'
+        FROM scores
+        GROUP BY player_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_player_stats_total_profit'), table_name='player_stats')
+    op.drop_index(op.f('ix_player_stats_total_score'), table_name='player_stats')
+    op.drop_table('player_stats')
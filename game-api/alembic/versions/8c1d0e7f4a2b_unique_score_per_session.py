@@ -0,0 +1,54 @@
+"""unique score per session
+
+Revision ID: 8c1d0e7f4a2b
+Revises: 5b7e2c9a1d4f
+Create Date: 2025-08-06 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1d0e7f4a2b'
+down_revision: Union[str, Sequence[str], None] = '5b7e2c9a1d4f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Each end call inserted its Score row and then its UnsoldShare rows, so the unsold
+    # positions of the surviving (latest) score are those created at or after it
+    op.execute("""
+        DELETE FROM unsold_shares
+        WHERE session_id IN (SELECT session_id FROM scores GROUP BY session_id HAVING COUNT(*) > 1)
+          AND created_at < (
+              SELECT latest.created_at FROM scores latest
+              WHERE latest.id = (SELECT MAX(s.id) FROM scores s WHERE s.session_id = unsold_shares.session_id)
+          )
+    """)
+
+    # Keep only the latest score of each session
+    op.execute("""
+        DELETE FROM scores
+        WHERE id NOT IN (SELECT MAX(id) FROM scores GROUP BY session_id)
+    """)
+
+    # Rebuild the leaderboard aggregate from the deduplicated scores
+    op.execute("DELETE FROM player_stats")
+    op.execute("""
+        INSERT INTO player_stats (player_id, total_score, total_profit, total_trades, score_count, updated_at)
+        SELECT player_id, SUM(total_score), SUM(total_profit), SUM(total_trades), COUNT(*), NOW() AT TIME ZONE 'utc'
+        FROM scores
+        GROUP BY player_id
+    """)
+
+    op.create_index(op.f('ix_scores_session_id'), 'scores', ['session_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_scores_session_id'), table_name='scores')
@@ -0,0 +1,43 @@
+"""add lookup indexes
+
+Revision ID: c7e9a2f1b3d5
+Revises: 8c1d0e7f4a2b
+Create Date: 2025-08-07 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e9a2f1b3d5'
+down_revision: Union[str, Sequence[str], None] = '8c1d0e7f4a2b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, table, columns), matched to the filters and sort orders used in crud.py
+INDEXES = [
+    ('ix_trades_session_id_timestamp', 'trades', ['session_id', 'timestamp', 'trade_id']),
+    ('ix_session_selections_session_id', 'session_selections', ['session_id']),
+    ('ix_scores_player_id', 'scores', ['player_id']),
+    ('ix_unsold_shares_session_id', 'unsold_shares', ['session_id']),
+    ('ix_sessions_started_at_session_id', 'sessions', ['started_at', 'session_id']),
+    ('ix_sessions_player_id_started_at', 'sessions', ['player_id', 'started_at', 'session_id']),
+    ('ix_sessions_status_started_at', 'sessions', ['status', 'started_at', 'session_id']),
+    ('ix_agent_interactions_session_id_timestamp', 'agent_interactions', ['session_id', 'timestamp']),
+    ('ix_admin_audit_log_timestamp_id', 'admin_audit_log', ['timestamp', 'id']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
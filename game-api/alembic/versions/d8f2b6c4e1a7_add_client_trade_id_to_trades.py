@@ -0,0 +1,31 @@
+"""add client trade id to trades
+
+Revision ID: d8f2b6c4e1a7
+Revises: c7e9a2f1b3d5
+Create Date: 2025-08-08 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8f2b6c4e1a7'
+down_revision: Union[str, Sequence[str], None] = 'c7e9a2f1b3d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing trades keep a NULL key; NULLs never conflict in the unique index
+    op.add_column('trades', sa.Column('client_trade_id', sa.String(length=64), nullable=True))
+    op.create_index('ix_trades_session_id_client_trade_id', 'trades', ['session_id', 'client_trade_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_trades_session_id_client_trade_id', table_name='trades')
+    op.drop_column('trades', 'client_trade_id')
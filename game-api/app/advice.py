@@ -0,0 +1,446 @@
+"""
+LLM trading advice with a response cache and request coalescing.
+
+``sessions.advise_player`` used to build a ``ChatOllama`` client and prompt
+chain on every call and wait up to 13 s for it, once per request. The client
+and chain are now built once, by the startup hook in ``app.main``, and
+``AdviceCache`` sits in front of them:
+
+* Advice is cached by a digest of everything the prompt is built from: the
+  symbols, their indicators (see ``app.indicators``) and the player's
+  trades. Entries expire after ``ADVICE_CACHE_TTL_SECONDS`` and the cache is
+  an LRU of at most ``ADVICE_CACHE_MAX_ENTRIES`` entries.
+* Concurrent requests for the same digest share one generation. Generations
+  run in their own task, so a client that disconnects does not cancel the
+  answer other requests are waiting for.
+* Fallback advice (after a timeout or a failed generation) is returned but not
+  cached, so the next request tries the model again. Callers pass the
+  rule-based advice of ``app.rule_advisor`` as the fallback.
+* ``prefetch`` answers from the cache or starts a generation in the background
+  without waiting for it, for ``mode=fast`` requests.
+* Generations that do reach the model take a slot of ``AdviceScheduler``
+  (see ``app.advice_scheduler``), which caps concurrency and rejects requests
+  early, with their fallback, when they could not finish in time.
+
+Hit rate and generation latency are reported by ``stats()`` under
+``/api/admin/metrics``.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from langchain.prompts import PromptTemplate
+from langchain_ollama import ChatOllama
+from pydantic import ValidationError
+
+from app import schemas
+from app.advice_scheduler import BACKGROUND, INTERACTIVE, AdviceRejected, AdviceScheduler, advice_scheduler
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PROMPT = PromptTemplate(
+    input_variables=["symbols", "cutoff_date", "stock_data", "trades_data"],
+    template="""You are a financial trading assistant in a stock simulation game, and your cutoff date is one day before of {cutoff_date}.
+Your task: For each of these 3 stocks ({symbols}), choose one action (BUY, SELL, HOLD) and give a short reason.
+Plan ahead for the next trading day, considering the current market conditions and the player's trades history.
+Base your advice on the player's trade history, recent price movements, and day trading strategy, with the goal to maximize profit. Do not include disclaimers.
+Technical indicators of each stock over the game month (returns, volatility and drawdown in percent):
+{stock_data}
+Player's trade history:
+{trades_data}"""
+)
+
+
+def _client(base_url: str) -> ChatOllama:
+    return ChatOllama(
+        model="qwen3:latest",
+        base_url=base_url,
+        temperature=0,
+        top_p=0.9,
+        num_ctx=2048,
+        num_predict=256,
+        format="json"
+    )
+
+
+def build_chain(base_url: str):
+    """Build the Ollama client and the structured advice chain."""
+    return PROMPT | _client(base_url).with_structured_output(schemas.TradingAdviceResponse)
+
+
+def build_stream_chain(base_url: str):
+    """Build a chain streaming the raw JSON tokens of the advice, constrained to the response schema."""
+    return PROMPT | _client(base_url).bind(format=schemas.TradingAdviceResponse.model_json_schema())
+
+
+def prompt_input(symbols: List[str], indicators: Dict[str, dict], trades: List[dict]) -> dict:
+    """
+    Build the prompt variables. They depend only on the symbols, indicators and trades, so equal inputs
+    give equal prompts and can share cached advice; the cutoff is the last trading day the indicators cover.
+    """
+    stock_data = {
+        symbol: {name: value for name, value in values.items() if name not in ("symbol", "year", "month")}
+        for symbol, values in indicators.items()
+    }
+    dates = [values["last_date"] for values in indicators.values() if values["last_date"]]
+    return {
+        "symbols": ", ".join(symbols),
+        "cutoff_date": max(dates).isoformat() if dates else "",
+        "stock_data": json.dumps(stock_data, separators=(",", ":"), default=str),
+        "trades_data": json.dumps(trades, separators=(",", ":")),
+    }
+
+
+def advice_key(variables: dict) -> str:
+    """Digest of the prompt variables, used as the cache key."""
+    return hashlib.sha256(json.dumps(variables, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def complete_advice(result: schemas.TradingAdviceResponse, symbols: List[str]) -> schemas.TradingAdviceResponse:
+    """Keep one item per selected symbol, in the model's order, and add HOLD for symbols it left out."""
+    selected = set(symbols)
+    advice, seen = [], set()
+    for item in result.advice:
+        if item.symbol in selected and item.symbol not in seen:
+            advice.append(item)
+            seen.add(item.symbol)
+    for symbol in symbols:
+        if symbol not in seen:
+            advice.append(schemas.TradingAdviceItem(
+                symbol=symbol,
+                action="HOLD",
+                reason="No specific advice generated for this symbol. Consider holding."
+            ))
+    return schemas.TradingAdviceResponse(advice=advice)
+
+
+def fallback_advice(symbols: List[str], reason: str) -> schemas.TradingAdviceResponse:
+    return schemas.TradingAdviceResponse(advice=[
+        schemas.TradingAdviceItem(symbol=symbol, action="HOLD", reason=reason) for symbol in symbols
+    ])
+
+
+class AdviceItemParser:
+    """
+    Incremental parser for a streamed advice document.
+    Feed it token text as it arrives; it returns every object inside a JSON array as soon as the object is
+    complete, so ``{"advice": [{...}, {...}`` yields the first items before the document ends.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._item_start: Optional[int] = None
+        self._item_depth = 0
+
+    def feed(self, text: str) -> List[dict]:
+        items = []
+        start = len(self._text)
+        self._text += text
+        for i in range(start, len(self._text)):
+            ch = self._text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if ch == "{" and self._item_start is None and self._stack and self._stack[-1] == "[":
+                    self._item_start, self._item_depth = i, len(self._stack)
+                self._stack.append(ch)
+            elif ch in "}]" and self._stack:
+                self._stack.pop()
+                if ch == "}" and self._item_start is not None and len(self._stack) == self._item_depth:
+                    try:
+                        item = json.loads(self._text[self._item_start:i + 1])
+                    except ValueError:
+                        item = None
+                    if isinstance(item, dict):
+                        items.append(item)
+                    self._item_start = None
+        return items
+
+
+@asynccontextmanager
+async def _unlimited():
+    yield
+
+
+def _percentiles(values: Deque[float]) -> Optional[dict]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "p50": round(ordered[len(ordered) // 2] * 1000, 1),
+        "p95": round(ordered[int(len(ordered) * 0.95)] * 1000, 1),
+        "max": round(ordered[-1] * 1000, 1),
+    }
+
+
+class AdviceCache:
+    """TTL-bounded LRU of generated advice keyed by prompt digest, with single-flight generation."""
+
+    # Number of recent generation latencies kept for the percentiles in stats()
+    LATENCY_WINDOW = 256
+
+    def __init__(self, build_chain: Callable[[], Any], ttl_seconds: float = 300.0, max_entries: int = 1024,
+                 timeout_seconds: float = 13.0, build_stream_chain: Optional[Callable[[], Any]] = None,
+                 scheduler: Optional[AdviceScheduler] = None):
+        self.build_chain = build_chain
+        self.build_stream_chain = build_stream_chain
+        self.scheduler = scheduler
+        self.chain: Optional[Any] = None
+        self.stream_chain: Optional[Any] = None
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.timeout_seconds = timeout_seconds
+        self._entries: "OrderedDict[str, Tuple[float, schemas.TradingAdviceResponse]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._latencies: Deque[float] = deque(maxlen=self.LATENCY_WINDOW)
+        self._first_item_latencies: Deque[float] = deque(maxlen=self.LATENCY_WINDOW)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.generations = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.streams = 0
+        self.rejected = 0
+
+    async def advise(self, symbols: List[str], variables: dict,
+                     fallback: Optional[schemas.TradingAdviceResponse] = None,
+                     owner: Optional[Hashable] = None) -> schemas.TradingAdviceResponse:
+        """
+        Return advice for the prompt variables, from the cache, a running generation or a new one.
+        ``fallback`` is returned if the generation is rejected, times out or fails; by default every symbol
+        gets HOLD. ``owner`` (the session) has at most one generation queued for the model.
+        """
+        key = advice_key(variables)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        return await asyncio.shield(self._generation(key, symbols, variables, fallback, owner, INTERACTIVE))
+
+    def prefetch(self, symbols: List[str], variables: dict,
+                 fallback: Optional[schemas.TradingAdviceResponse] = None,
+                 owner: Optional[Hashable] = None) -> Optional[schemas.TradingAdviceResponse]:
+        """
+        Return cached advice for the prompt variables, or start generating it in the background and return None.
+        Background generations queue behind interactive ones.
+        """
+        key = advice_key(variables)
+        cached = self._lookup(key)
+        if cached is None:
+            self._generation(key, symbols, variables, fallback, owner, BACKGROUND)
+        return cached
+
+    async def stream(self, symbols: List[str], variables: dict,
+                     fallback: Optional[schemas.TradingAdviceResponse] = None,
+                     owner: Optional[Hashable] = None) -> AsyncIterator[schemas.TradingAdviceItem]:
+        """
+        Yield advice items for the prompt variables as soon as each is parsed from the model's token stream.
+        Items for other or repeated symbols are dropped; symbols the model left out get HOLD at the end, or
+        their ``fallback`` item if the stream was rejected, timed out or failed. Complete streams are cached
+        like ``advise``.
+        """
+        key = advice_key(variables)
+        cached = self._lookup(key)
+        if cached is not None:
+            for item in cached.advice:
+                yield item
+            return
+
+        self.streams += 1
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout_seconds
+        parser = AdviceItemParser()
+        selected = set(symbols)
+        advice: Dict[str, schemas.TradingAdviceItem] = {}
+        failed = False
+        chunks = None
+        generating = None
+        try:
+            self.start()
+            async with self._slot(deadline, owner, INTERACTIVE):
+                generating = time.perf_counter()
+                chunks = self.stream_chain.astream(variables).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline - loop.time(), 0))
+                    except StopAsyncIteration:
+                        break
+                    for value in parser.feed(chunk.content):
+                        try:
+                            item = schemas.TradingAdviceItem(**value)
+                        except (TypeError, ValidationError):
+                            continue
+                        if item.symbol in selected and item.symbol not in advice:
+                            if not advice:
+                                self._first_item_latencies.append(time.perf_counter() - started)
+                            advice[item.symbol] = item
+                            yield item
+        except AdviceRejected as e:
+            failed = True
+            self.rejected += 1
+            logger.warning("Streamed LLM advice not generated: %s", e)
+        except asyncio.TimeoutError:
+            failed = True
+            self.timeouts += 1
+            logger.error("Streamed LLM advice timed out after %.0f s", self.timeout_seconds)
+        except Exception as e:
+            failed = True
+            self.failures += 1
+            logger.error("Streamed LLM advice failed: %s", e)
+            logger.debug("Streamed LLM advice failure", exc_info=True)
+        finally:
+            if generating is not None:
+                # As in _generate, only generations that got a slot count; rejections never reached the model
+                self._latencies.append(time.perf_counter() - generating)
+            if chunks is not None and hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+        fallback_items = {item.symbol: item for item in fallback.advice} if fallback else {}
+        for symbol in symbols:
+            if symbol in advice:
+                continue
+            if failed:
+                item = fallback_items.get(symbol) or schemas.TradingAdviceItem(
+                    symbol=symbol, action="HOLD",
+                    reason="Unable to generate AI advice at this time. Consider holding your position.")
+            else:
+                item = schemas.TradingAdviceItem(
+                    symbol=symbol, action="HOLD",
+                    reason="No specific advice generated for this symbol. Consider holding.")
+            advice[symbol] = item
+            yield item
+        if not failed:
+            self._store(key, schemas.TradingAdviceResponse(advice=list(advice.values())))
+
+    def start(self):
+        """Build the LLM clients and chains, if not built yet."""
+        if self.chain is None:
+            self.chain = self.build_chain()
+        if self.stream_chain is None and self.build_stream_chain is not None:
+            self.stream_chain = self.build_stream_chain()
+
+    def invalidate(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "expired": self.expired,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+            "generations": self.generations,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "streams": self.streams,
+            "rejected": self.rejected,
+            "latency_ms": _percentiles(self._latencies),
+            "stream_first_item_ms": _percentiles(self._first_item_latencies),
+        }
+
+    def _lookup(self, key: str) -> Optional[schemas.TradingAdviceResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self.expired += 1
+            del self._entries[key]
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _slot(self, deadline: float, owner: Optional[Hashable], priority: int):
+        if self.scheduler is None:
+            return _unlimited()
+        return self.scheduler.slot(deadline, owner=owner, priority=priority)
+
+    def _generation(self, key: str, symbols: List[str], variables: dict,
+                    fallback: Optional[schemas.TradingAdviceResponse], owner: Optional[Hashable],
+                    priority: int) -> asyncio.Task:
+        """Return the running generation for a key, starting one if there is none."""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        self.misses += 1
+        task = self._inflight[key] = asyncio.create_task(
+            self._generate(key, symbols, variables, fallback, owner, priority))
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _generate(self, key: str, symbols: List[str], variables: dict,
+                        fallback: Optional[schemas.TradingAdviceResponse], owner: Optional[Hashable],
+                        priority: int) -> schemas.TradingAdviceResponse:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout_seconds
+        try:
+            self.start()
+            async with self._slot(deadline, owner, priority):
+                self.generations += 1
+                started = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(self.chain.ainvoke(variables),
+                                                    timeout=max(deadline - loop.time(), 0))
+                finally:
+                    self._latencies.append(time.perf_counter() - started)
+        except AdviceRejected as e:
+            self.rejected += 1
+            logger.warning("LLM advice not generated: %s", e)
+            return fallback or fallback_advice(
+                symbols, "The AI advisor is busy right now. Consider holding your position."
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.error("LLM advice timed out after %.0f s", self.timeout_seconds)
+            return fallback or fallback_advice(
+                symbols, "Unable to generate AI advice at this time (timeout). Consider holding your position."
+            )
+        except Exception as e:
+            self.failures += 1
+            logger.error("LLM advice generation or parsing failed: %s", e)
+            logger.debug("LLM advice failure", exc_info=True)
+            return fallback or fallback_advice(
+                symbols, "Unable to generate AI advice at this time. Consider holding your position."
+            )
+
+        advice = complete_advice(result, symbols)
+        self._store(key, advice)
+        return advice
+
+    def _store(self, key: str, advice: schemas.TradingAdviceResponse):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, advice)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+advice_cache = AdviceCache(
+    lambda: build_chain(settings.OLLAMA_BASE_URL),
+    build_stream_chain=lambda: build_stream_chain(settings.OLLAMA_BASE_URL),
+    ttl_seconds=settings.ADVICE_CACHE_TTL_SECONDS,
+    max_entries=settings.ADVICE_CACHE_MAX_ENTRIES,
+    timeout_seconds=settings.ADVICE_TIMEOUT_SECONDS,
+    scheduler=advice_scheduler
+)
@@ -0,0 +1,172 @@
+"""
+Bounded scheduling of LLM advice generations.
+
+There is one local Ollama model behind the advice endpoints. Without a limit,
+a burst of players starts a generation each, the model slows down for all of
+them and every request times out together. ``AdviceScheduler`` hands out at
+most ``ADVICE_MAX_CONCURRENCY`` slots; other generations wait in a priority
+queue (interactive requests before background prefetches, then first come
+first served) of at most ``ADVICE_MAX_QUEUE`` entries.
+
+Admission is deadline-aware: every generation has a deadline (the advice
+timeout), and a request is rejected up front when the queue is full or when
+the predicted wait plus one generation would pass the deadline. The
+prediction uses a moving average of how long generations hold a slot.
+Rejected requests get their fallback advice immediately instead of after a
+timeout. Each session has at most one queued generation; a newer request
+from the same session takes its place and the older one is rejected as
+superseded.
+
+Queue depth, running generations, wait times and rejections are reported by
+``stats()`` under ``/api/admin/metrics``.
+"""
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Hashable, List, Optional
+
+from app.core.config import settings
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class AdviceRejected(Exception):
+    """Raised when a generation is not admitted, or is superseded while queued."""
+
+
+class AdviceScheduler:
+    """Concurrency-capped, priority-ordered slots for LLM generations."""
+
+    # Weight of the latest generation in the moving average of slot hold times
+    SERVICE_TIME_ALPHA = 0.2
+    # Number of recent queue waits kept for the percentiles in stats()
+    WAIT_WINDOW = 256
+
+    def __init__(self, max_concurrency: int = 1, max_queue: int = 32):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._running = 0
+        # Heap of [priority, sequence, owner, future]; superseded or abandoned entries have future None
+        self._queue: List[list] = []
+        self._queued_by_owner: Dict[Hashable, list] = {}
+        self._sequence = itertools.count()
+        self._service_time: Optional[float] = None
+        self._waits: Deque[float] = deque(maxlen=self.WAIT_WINDOW)
+        self.admitted = 0
+        self.rejected = 0
+        self.superseded = 0
+        self.expired = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for entry in self._queue if entry[3] is not None)
+
+    def predicted_wait(self, priority: int = INTERACTIVE) -> float:
+        """Seconds a new generation of this priority is expected to wait for a slot."""
+        if self._running < self.max_concurrency or self._service_time is None:
+            return 0.0
+        ahead = sum(1 for entry in self._queue if entry[3] is not None and entry[0] <= priority)
+        return (ahead // self.max_concurrency + 1) * self._service_time
+
+    @asynccontextmanager
+    async def slot(self, deadline: float, owner: Optional[Hashable] = None, priority: int = INTERACTIVE):
+        """
+        Hold one generation slot for the duration of the block.
+        ``deadline`` is in event loop time; raises AdviceRejected if the generation is not admitted or is
+        superseded, and asyncio.TimeoutError if the deadline passes while it is queued.
+        """
+        loop = asyncio.get_running_loop()
+        queued_at = loop.time()
+        if self._running < self.max_concurrency and not self.queued:
+            self._running += 1
+        else:
+            await self._wait_turn(deadline, owner, priority)
+        self.admitted += 1
+        started = loop.time()
+        self._waits.append(started - queued_at)
+        try:
+            yield
+        finally:
+            held = loop.time() - started
+            self._service_time = held if self._service_time is None else (
+                self._service_time + self.SERVICE_TIME_ALPHA * (held - self._service_time))
+            self._running -= 1
+            self._wake()
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "superseded": self.superseded,
+            "expired": self.expired,
+            "service_time_ms": round(self._service_time * 1000, 1) if self._service_time is not None else None,
+            "predicted_wait_ms": round(self.predicted_wait() * 1000, 1),
+            "wait_ms": {
+                "p50": round(waits[len(waits) // 2] * 1000, 1),
+                "p95": round(waits[int(len(waits) * 0.95)] * 1000, 1),
+                "max": round(waits[-1] * 1000, 1),
+            } if waits else None,
+        }
+
+    async def _wait_turn(self, deadline: float, owner: Optional[Hashable], priority: int):
+        loop = asyncio.get_running_loop()
+        budget = deadline - loop.time()
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise AdviceRejected("advice queue is full")
+        predicted = self.predicted_wait(priority)
+        if self._service_time is not None and predicted + self._service_time > budget:
+            self.rejected += 1
+            raise AdviceRejected(f"predicted wait of {predicted:.1f} s would pass the deadline")
+
+        previous = self._queued_by_owner.get(owner) if owner is not None else None
+        if previous is not None and previous[3] is not None:
+            self.superseded += 1
+            previous[3].set_exception(AdviceRejected("superseded by a newer request from the same session"))
+            previous[3] = None
+
+        future = loop.create_future()
+        entry = [priority, next(self._sequence), owner, future]
+        heapq.heappush(self._queue, entry)
+        if owner is not None:
+            self._queued_by_owner[owner] = entry
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(budget, 0))
+        except BaseException as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # The slot was granted as the wait ended; hand it on
+                self._running -= 1
+                self._wake()
+            elif not future.done():
+                future.cancel()
+            entry[3] = None
+            if isinstance(e, asyncio.TimeoutError):
+                self.expired += 1
+            raise
+        finally:
+            if owner is not None and self._queued_by_owner.get(owner) is entry:
+                del self._queued_by_owner[owner]
+
+    def _wake(self):
+        while self._running < self.max_concurrency and self._queue:
+            entry = heapq.heappop(self._queue)
+            future = entry[3]
+            if future is None or future.done():
+                continue
+            entry[3] = None
+            self._running += 1
+            future.set_result(None)
+
+
+# Shared instance gating every LLM call of this worker
+advice_scheduler = AdviceScheduler(
+    max_concurrency=settings.ADVICE_MAX_CONCURRENCY,
+    max_queue=settings.ADVICE_MAX_QUEUE
+)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from pydantic import PostgresDsn
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -11,6 +11,23 @@ class Settings(BaseSettings):
     ALLOWED_ORIGINS: List[str] = ["*"]
     SECRET_KEY: str
     OLLAMA_BASE_URL: str = "http://host.docker.internal:11434"
+    PRICE_CACHE_MAX_ENTRIES: int = 1024
+    INDICATOR_CACHE_MAX_ENTRIES: int = 1024
+    STOCK_CATALOG_TTL_SECONDS: float = 300.0
+    PRICE_STREAM_TICK_SECONDS: float = 10.0
+    PRICE_STREAM_SLOTS_PER_TICK: int = 10  # subscribers joining within one slot share frames
+    STREAM_CURSOR_FLUSH_SECONDS: float = 5.0
+    TRADE_INGEST_WINDOW_SECONDS: float = 0.005  # how long a trade batch stays open for more trades
+    TRADE_INGEST_MAX_BATCH: int = 500
+    PORTFOLIO_MAX_SESSIONS: int = 4096  # in-memory portfolios of recently trading sessions
+    TRADE_BULK_MAX_TRADES: int = 50000
+    ADVICE_CACHE_TTL_SECONDS: float = 300.0
+    ADVICE_CACHE_MAX_ENTRIES: int = 1024
+    ADVICE_TIMEOUT_SECONDS: float = 13.0
+    ADVICE_MAX_CONCURRENCY: int = 1  # concurrent generations sent to the Ollama model
+    ADVICE_MAX_QUEUE: int = 32
+    RESCORE_CHUNK_SIZE: int = 5000
+    RESCORE_WORKERS: Optional[int] = None  # None uses one process per CPU
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -1,14 +1,23 @@
+import base64
 import datetime
+import json
 from datetime import timezone
-from decimal import Decimal
 import uuid
 import logging
+from typing import Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text, func, desc, extract, select
+from sqlalchemy import text, func, select, tuple_, delete, insert, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from . import models, schemas
+from app import models, schemas, scoring
+from app.stock_catalog import stock_catalog
+
+# Set up logger for this module
+logger = logging.getLogger(__name__)
 
 
 def normalize_datetime_for_db(dt):
@@ -23,21 +32,44 @@ def normalize_data_for_db(data):
     if isinstance(data, dict):
         return {key: normalize_datetime_for_db(value) for key, value in data.items()}
     return data
-from datetime import timezone
-from decimal import Decimal
-import uuid
-import logging
 
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text, func, desc, extract, select
-from sqlalchemy.orm import Session
 
-from app import models, schemas
-from collections import defaultdict
-from datetime import date
+def dialect_insert(db: AsyncSession, model):
+    """INSERT construct supporting ON CONFLICT for the bound dialect (PostgreSQL, or SQLite in tests)"""
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite_insert(model)
+    return pg_insert(model)
+
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of the last row of a page into an opaque keyset cursor"""
+    payload = [
+        value.isoformat() if isinstance(value, datetime.datetime)
+        else str(value) if isinstance(value, uuid.UUID)
+        else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    """
+    Decode a keyset cursor produced by encode_cursor, converting each value to the given type.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError
+        return [
+            datetime.datetime.fromisoformat(value) if kind is datetime.datetime
+            else uuid.UUID(value) if kind is uuid.UUID
+            else kind(value)
+            for kind, value in zip(types, payload)
+        ]
+    except (ValueError, TypeError, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid pagination cursor")
 
-# Set up logger for this module
-logger = logging.getLogger(__name__)
 
 # Players
 
@@ -54,15 +86,18 @@ async def create_player(db: AsyncSession, player: schemas.PlayerCreate):
     return db_player
 
 
-async def get_players(db: AsyncSession, nickname: str = None, limit: int = None, offset: int = 0):
-    query = select(models.Player)
+async def get_players(db: AsyncSession, nickname: str = None, limit: int = None, offset: int = 0, cursor: str = None):
+    query = select(models.Player).order_by(models.Player.id)
     
     # Apply nickname filter if provided
     if nickname:
         query = query.filter(models.Player.nickname.ilike(f"%{nickname}%"))
     
-    # Apply pagination
-    if offset:
+    # Apply pagination: keyset on id when a cursor is given, OFFSET kept for backward compatibility
+    if cursor:
+        (after_id,) = decode_cursor(cursor, int)
+        query = query.filter(models.Player.id > after_id)
+    elif offset:
         query = query.offset(offset)
     if limit:
         query = query.limit(limit)
@@ -83,11 +118,13 @@ async def create_stock(db: AsyncSession, stock: schemas.StockCreate):
     db.add(db_stock)
     await db.commit()
     await db.refresh(db_stock)
+    stock_catalog.invalidate()
     return db_stock
 
 
-async def get_stocks(db: AsyncSession, category: str = None, sector: str = None, limit: int = None, offset: int = 0):
-    query = select(models.Stock)
+async def get_stocks(db: AsyncSession, category: str = None, sector: str = None, limit: int = None, offset: int = 0,
+                     cursor: str = None):
+    query = select(models.Stock).order_by(models.Stock.symbol)
     
     # Apply filters if provided
     if category:
@@ -95,8 +132,11 @@ async def get_stocks(db: AsyncSession, category: str = None, sector: str = None,
     if sector:
         query = query.filter(models.Stock.sector == sector)
     
-    # Apply pagination
-    if offset:
+    # Apply pagination: keyset on symbol when a cursor is given, OFFSET kept for backward compatibility
+    if cursor:
+        (after_symbol,) = decode_cursor(cursor, str)
+        query = query.filter(models.Stock.symbol > after_symbol)
+    elif offset:
         query = query.offset(offset)
     if limit:
         query = query.limit(limit)
@@ -115,10 +155,26 @@ async def get_admin_user(db: AsyncSession, login: str):
 # Admin-specific functions for management
 
 async def get_sessions_with_filters(db: AsyncSession, player_id: int = None, status: str = None, 
-                            start_date = None, end_date = None, limit: int = 100, offset: int = 0):
-    """Get sessions with optional filters for admin dashboard"""
-    logger.info("Fetching sessions with filters: player_id=%s, status=%s, start_date=%s, end_date=%s, limit=%s, offset=%s", player_id, status, start_date, end_date, limit, offset)
-    query = select(models.Session)
+                            start_date = None, end_date = None, limit: int = 100, offset: int = 0,
+                            cursor: str = None):
+    """
+    Get sessions with optional filters for admin dashboard.
+    The player nickname and score (unique per session) are joined in, so a page costs a single query.
+    Pages are keyed on (started_at, session_id) when a cursor is given.
+    """
+    logger.info("Fetching sessions with filters: player_id=%s, status=%s, start_date=%s, end_date=%s, limit=%s, offset=%s, cursor=%s", player_id, status, start_date, end_date, limit, offset, cursor)
+
+    query = select(
+        models.Session,
+        models.Player.nickname,
+        models.Score.total_score,
+        models.Score.total_profit,
+        models.Score.total_trades
+    ).outerjoin(
+        models.Player, models.Player.id == models.Session.player_id
+    ).outerjoin(
+        models.Score, models.Score.session_id == models.Session.session_id
+    )
 
     if player_id:
         logger.debug("Applying player_id filter: %s", player_id)
@@ -134,13 +190,19 @@ async def get_sessions_with_filters(db: AsyncSession, player_id: int = None, sta
 
     if end_date:
         from datetime import timedelta
-        end_datetime = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+        end_datetime = datetime.datetime.combine(end_date, datetime.time.min) + timedelta(days=1)
         logger.debug("Applying end_date filter: %s (exclusive)", end_datetime)
         query = query.filter(models.Session.started_at < end_datetime)
 
-    query = query.order_by(models.Session.started_at.desc())
+    query = query.order_by(models.Session.started_at.desc(), models.Session.session_id.desc())
 
-    if offset:
+    if cursor:
+        after_started_at, after_session_id = decode_cursor(cursor, datetime.datetime, uuid.UUID)
+        logger.debug("Applying cursor: started_at=%s, session_id=%s", after_started_at, after_session_id)
+        query = query.filter(
+            tuple_(models.Session.started_at, models.Session.session_id) < tuple_(after_started_at, after_session_id)
+        )
+    elif offset:
         logger.debug("Applying offset: %s", offset)
         query = query.offset(offset)
 
@@ -150,76 +212,53 @@ async def get_sessions_with_filters(db: AsyncSession, player_id: int = None, sta
 
     try:
         result = await db.execute(query)
-        sessions = result.scalars().all()
-        logger.info("Found %d sessions", len(sessions))
+        rows = result.all()
+        logger.info("Found %d sessions", len(rows))
     except Exception as e:
         logger.error("Error executing session query: %s", e, exc_info=True)
         raise
 
     result_list = []
-    for session in sessions:
-        try:
-            logger.debug("Processing session_id=%s", session.session_id)
-            player_result = await db.execute(select(models.Player).filter(models.Player.id == session.player_id))
-            player = player_result.scalar_one_or_none()
-            if not player:
-                logger.warning("Player not found for player_id=%s in session_id=%s", session.player_id, session.session_id)
-
-            # Fetch only the latest score for this session (by id descending)
-            score_result = await db.execute(
-                select(models.Score)
-                .filter(models.Score.session_id == session.session_id)
-                .order_by(models.Score.id.desc())
-                .limit(1)
-            )
-            score = score_result.scalar_one_or_none()
-            if not score:
-                logger.info("No score found for session_id=%s", session.session_id)
-
-            session_data = {
-                "session_id": str(session.session_id),
-                "player_id": session.player_id,
-                "player_nickname": player.nickname if player else "Unknown",
-                "started_at": session.started_at,
-                "ended_at": session.ended_at,
-                "status": session.status,
-                "balance": session.balance,
-                "total_score": score.total_score if score else 0,
-                "total_profit": float(score.total_profit) if score else 0.0,
-                "total_trades": score.total_trades if score else 0
-            }
-            result_list.append(session_data)
-        except Exception as e:
-            logger.error("Error processing session_id=%s: %s", getattr(session, 'session_id', 'unknown'), e, exc_info=True)
-            continue
+    for session, nickname, total_score, total_profit, total_trades in rows:
+        if nickname is None:
+            logger.warning("Player not found for player_id=%s in session_id=%s", session.player_id, session.session_id)
+        result_list.append({
+            "session_id": str(session.session_id),
+            "player_id": session.player_id,
+            "player_nickname": nickname if nickname is not None else "Unknown",
+            "started_at": session.started_at,
+            "ended_at": session.ended_at,
+            "status": session.status,
+            "balance": session.balance,
+            "total_score": total_score if total_score is not None else 0,
+            "total_profit": float(total_profit) if total_profit is not None else 0.0,
+            "total_trades": total_trades if total_trades is not None else 0
+        })
 
     logger.info("Returning %d session results", len(result_list))
     return result_list
 
 
 async def get_leaderboard(db: AsyncSession, top_n: int = 10, sort_by: str = "total_score"):
-    """Get top N players sorted by specified metric"""
+    """Get top N players sorted by specified metric, read from the maintained player_stats aggregate"""
+    
+    # Apply sorting
+    if sort_by == "total_profit":
+        sort_column = models.PlayerStats.total_profit
+    else:
+        sort_column = models.PlayerStats.total_score  # Default fallback
     
-    # Build query to aggregate player statistics
     query = select(
         models.Player.id.label("player_id"),
         models.Player.nickname,
-        func.sum(models.Score.total_score).label("total_score"),
-        func.sum(models.Score.total_profit).label("total_profit"),
-        func.sum(models.Score.total_trades).label("total_trades")
+        models.PlayerStats.total_score,
+        models.PlayerStats.total_profit,
+        models.PlayerStats.total_trades
     ).join(
-        models.Score, models.Player.id == models.Score.player_id
-    ).group_by(
-        models.Player.id, models.Player.nickname
-    )
-    
-    # Apply sorting
-    if sort_by == "total_score":
-        query = query.order_by(desc("total_score"))
-    elif sort_by == "total_profit":
-        query = query.order_by(desc("total_profit"))
-    else:
-        query = query.order_by(desc("total_score"))  # Default fallback
+        models.Player, models.Player.id == models.PlayerStats.player_id
+    ).filter(
+        models.PlayerStats.score_count > 0
+    ).order_by(sort_column.desc())
     
     result = await db.execute(query.limit(top_n))
     players = result.fetchall()
@@ -238,6 +277,75 @@ async def get_leaderboard(db: AsyncSession, top_n: int = 10, sort_by: str = "tot
     return formatted_result
 
 
+async def apply_player_stats_delta(db: AsyncSession, player_id: int, total_score: float = 0.0,
+                                   total_profit: float = 0.0, total_trades: int = 0, score_count: int = 0):
+    """
+    Add a delta to a player's leaderboard aggregate in the current transaction.
+    Called whenever Score rows are inserted or removed; the caller commits.
+    """
+    stmt = dialect_insert(db, models.PlayerStats).values(
+        player_id=player_id,
+        total_score=float(total_score),
+        total_profit=float(total_profit),
+        total_trades=total_trades,
+        score_count=score_count,
+        updated_at=models.utc_now()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.PlayerStats.player_id],
+        set_={
+            "total_score": models.PlayerStats.total_score + stmt.excluded.total_score,
+            "total_profit": models.PlayerStats.total_profit + stmt.excluded.total_profit,
+            "total_trades": models.PlayerStats.total_trades + stmt.excluded.total_trades,
+            "score_count": models.PlayerStats.score_count + stmt.excluded.score_count,
+            "updated_at": stmt.excluded.updated_at,
+        }
+    )
+    await db.execute(stmt)
+
+
+async def rebuild_player_stats(db: AsyncSession):
+    """Recompute every player's leaderboard aggregate from the scores table and commit"""
+    await db.execute(delete(models.PlayerStats))
+    await db.execute(insert(models.PlayerStats).from_select(
+        ["player_id", "total_score", "total_profit", "total_trades", "score_count", "updated_at"],
+        select(
+            models.Score.player_id,
+            func.coalesce(func.sum(models.Score.total_score), 0.0),
+            func.coalesce(func.sum(models.Score.total_profit), 0.0),
+            func.coalesce(func.sum(models.Score.total_trades), 0),
+            func.count(models.Score.id),
+            func.max(models.Score.created_at)
+        ).group_by(models.Score.player_id)
+    ))
+    await db.commit()
+
+
+async def delete_session(db: AsyncSession, session_id: uuid.UUID) -> bool:
+    """Delete a session and all related data, removing its scores from the leaderboard aggregate"""
+    session = await get_session(db, session_id)
+    if not session:
+        return False
+
+    result = await db.execute(select(
+        models.Score.player_id,
+        func.count(models.Score.id),
+        func.sum(models.Score.total_score),
+        func.sum(models.Score.total_profit),
+        func.sum(models.Score.total_trades)
+    ).filter(models.Score.session_id == session_id).group_by(models.Score.player_id))
+    for player_id, score_count, total_score, total_profit, total_trades in result.all():
+        await apply_player_stats_delta(db, player_id, -(total_score or 0.0), -(total_profit or 0.0),
+                                       -(total_trades or 0), -score_count)
+
+    # Delete in correct order to handle foreign key constraints
+    for model in (models.UnsoldShare, models.Score, models.Trade, models.SessionSelection, models.AgentInteraction):
+        await db.execute(delete(model).where(model.session_id == session_id))
+    await db.delete(session)
+    await db.commit()
+    return True
+
+
 def get_player_statistics(db: Session):
     """Get comprehensive player statistics"""
     
@@ -269,35 +377,6 @@ def get_player_statistics(db: Session):
     }
 
 
-def delete_session_data(db: Session, session_id: uuid.UUID):
-    """Delete a session and all related data"""
-    try:
-        # Delete in correct order to handle foreign key constraints
-        
-        # 1. Delete unsold shares
-        db.query(models.UnsoldShare).filter(models.UnsoldShare.session_id == session_id).delete()
-        
-        # 2. Delete scores
-        db.query(models.Score).filter(models.Score.session_id == session_id).delete()
-        
-        # 3. Delete trades
-        db.query(models.Trade).filter(models.Trade.session_id == session_id).delete()
-        
-        # 4. Delete session selections
-        db.query(models.SessionSelection).filter(models.SessionSelection.session_id == session_id).delete()
-        
-        # 5. Finally delete the session
-        session_deleted = db.query(models.Session).filter(models.Session.session_id == session_id).delete()
-        
-        db.commit()
-        return session_deleted > 0
-        
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error deleting session {session_id}: {e}")
-        raise
-
-
 def archive_session(db: Session, session_id: uuid.UUID):
     """Archive a session by updating its status"""
     try:
@@ -318,9 +397,10 @@ def archive_session(db: Session, session_id: uuid.UUID):
 def reset_all_session_data(db: Session):
     """Reset all session-related data - DANGEROUS OPERATION"""
     try:
-        # Delete in correct order
+        # Delete in correct order; the leaderboard aggregate goes with the scores
         db.query(models.UnsoldShare).delete()
-        db.query(models.Score).delete() 
+        db.query(models.PlayerStats).delete()
+        db.query(models.Score).delete()
         db.query(models.Trade).delete()
         db.query(models.SessionSelection).delete()
         db.query(models.Session).delete()
@@ -423,11 +503,11 @@ async def create_audit_log(db: AsyncSession, admin_login: str, action: str, targ
     return db_log
 
 
-def get_audit_logs(db: Session, admin_login: str = None, action: str = None, 
-                  start_date: datetime = None, end_date: datetime = None, 
-                  limit: int = 100, offset: int = 0):
-    """Get audit logs with optional filters"""
-    query = db.query(models.AdminAuditLog)
+async def get_audit_logs(db: AsyncSession, admin_login: str = None, action: str = None, 
+                  start_date: datetime.datetime = None, end_date: datetime.datetime = None, 
+                  limit: int = 100, offset: int = 0, cursor: str = None):
+    """Get audit logs with optional filters, newest first, keyed on (timestamp, id) when a cursor is given"""
+    query = select(models.AdminAuditLog)
     
     if admin_login:
         query = query.filter(models.AdminAuditLog.admin_login == admin_login)
@@ -441,15 +521,21 @@ def get_audit_logs(db: Session, admin_login: str = None, action: str = None,
     if end_date:
         query = query.filter(models.AdminAuditLog.timestamp <= end_date)
     
-    query = query.order_by(models.AdminAuditLog.timestamp.desc())
+    query = query.order_by(models.AdminAuditLog.timestamp.desc(), models.AdminAuditLog.id.desc())
     
-    if offset:
+    if cursor:
+        after_timestamp, after_id = decode_cursor(cursor, datetime.datetime, int)
+        query = query.filter(
+            tuple_(models.AdminAuditLog.timestamp, models.AdminAuditLog.id) < tuple_(after_timestamp, after_id)
+        )
+    elif offset:
         query = query.offset(offset)
     
     if limit:
         query = query.limit(limit)
     
-    return query.all()
+    result = await db.execute(query)
+    return result.scalars().all()
 
 
 # Sessions
@@ -512,54 +598,38 @@ async def update_selection(db: AsyncSession, session_id: uuid.UUID, session_upda
     db.refresh(db_session)
     return db_session
 
+async def update_selection_cursors(db: AsyncSession, cursors: dict):
+    """Store the last streamed date of several sessions in one batched UPDATE."""
+    table = models.SessionSelection.__table__
+    await db.execute(
+        table.update()
+        .where(table.c.session_id == bindparam("cursor_session_id"))
+        .values(current_date=bindparam("cursor_date")),
+        [
+            {"cursor_session_id": session_id, "cursor_date": datetime.datetime.combine(day, datetime.time.min)}
+            for session_id, day in cursors.items()
+        ]
+    )
+    await db.commit()
+
 async def get_roulette_selection(db: AsyncSession, month: int, year: int):
     """Get the roulette selection for a specific month and year."""
-    from datetime import date
-    import calendar
-    
-    # Get the first and last day of the specified month
-    month_start = date(year, month, 1)
-    last_day = calendar.monthrange(year, month)[1]
-    month_end = date(year, month, last_day)
-    
-    # Get stocks available within the given month
-    # A stock is available in the month if:
-    # - It starts before or at the beginning of the month AND
-    # - It ends after the month or has no end date
-    result = await db.execute(select(models.Stock).filter(
-        (models.Stock.available_from <= month_start) &
-        ((models.Stock.available_to >= month_end) | (models.Stock.available_to.is_(None)))
-    ))
-    available_stocks = result.scalars().all()
-    
-    if not available_stocks:
-        return None
-    
-    # Filter by categories
-    popular_stocks = [s for s in available_stocks if s.category == "popular"]
-    volatile_stocks = [s for s in available_stocks if s.category == "volatile"]
-    sector_stocks = [s for s in available_stocks if s.category == "sector"]
-    
-    if not (popular_stocks and volatile_stocks and sector_stocks):
-        return None
-    
-    # Randomly select one stock from each category
     import random
-    
-    # For sector_symbol: first get a random sector, then get a random stock from that sector
-    available_sectors = list(set(s.sector for s in sector_stocks if s.sector))
-    if not available_sectors:
+
+    # Stocks available for the whole month, served from the in-memory catalog
+    availability = await stock_catalog.month(db, month, year)
+    if not availability.playable:
         return None
-    
-    selected_sector = random.choice(available_sectors)
-    sector_stocks_in_selected_sector = [s for s in sector_stocks if s.sector == selected_sector]
-    
+
+    # For sector_symbol: first get a random sector, then get a random stock from that sector
+    selected_sector = random.choice(list(availability.sectors))
+
     return schemas.Selection(
         id=0,  # This is a virtual selection
         session_id=uuid.uuid4(),  # This is a virtual session_id
-        popular_symbol=random.choice(popular_stocks).symbol,
-        volatile_symbol=random.choice(volatile_stocks).symbol,
-        sector_symbol=random.choice(sector_stocks_in_selected_sector).symbol,
+        popular_symbol=random.choice(availability.popular),
+        volatile_symbol=random.choice(availability.volatile),
+        sector_symbol=random.choice(availability.sectors[selected_sector]),
         month=month,
         year=year
     )
@@ -575,6 +645,70 @@ async def record_trade(db: AsyncSession, trade: schemas.TradeCreate):
     return db_trade
 
 
+async def insert_trades(db: AsyncSession, trades: list) -> list:
+    """
+    Record a batch of trades with one multi-row INSERT and one commit.
+    Every trade must carry a client_trade_id. A trade whose key is already recorded for its session
+    is not inserted again and the stored row is returned instead, so retried posts are idempotent.
+    Returns the stored rows as dicts, in the order of trades.
+    """
+    table = models.Trade.__table__
+    rows = [normalize_data_for_db(trade) for trade in trades]
+    keys = [(row["session_id"], row["client_trade_id"]) for row in rows]
+    result = await db.execute(
+        dialect_insert(db, models.Trade)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["session_id", "client_trade_id"])
+        .returning(*table.c)
+    )
+    stored = {(row.session_id, row.client_trade_id): dict(row._mapping) for row in result}
+
+    duplicates = [key for key in keys if key not in stored]
+    if duplicates:
+        result = await db.execute(
+            select(*table.c).where(tuple_(table.c.session_id, table.c.client_trade_id).in_(duplicates))
+        )
+        stored.update({(row.session_id, row.client_trade_id): dict(row._mapping) for row in result})
+
+    await db.commit()
+    return [stored[key] for key in keys]
+
+
+TRADE_COPY_COLUMNS = ("session_id", "timestamp", "symbol", "action", "qty", "price", "client_trade_id")
+
+
+async def copy_trades(db: AsyncSession, trades: list) -> str:
+    """
+    Insert many trades in one transaction and commit. On asyncpg the rows are streamed with COPY
+    (copy_records_to_table), a single statement run inside an asyncpg transaction, since the driver
+    connection does not join the session's transaction until SQLAlchemy executes a statement on it (if
+    it already has, the COPY runs in a savepoint of it). Other drivers get multi-row INSERTs in the
+    session's transaction. Returns the method used, "copy" or "insert".
+    """
+    rows = [normalize_data_for_db(trade) for trade in trades]
+    connection = await db.connection()
+    if connection.dialect.driver == "asyncpg":
+        raw = await connection.get_raw_connection()
+        try:
+            async with raw.driver_connection.transaction():
+                await raw.driver_connection.copy_records_to_table(
+                    models.Trade.__tablename__,
+                    records=[tuple(row[column] for column in TRADE_COPY_COLUMNS) for row in rows],
+                    columns=TRADE_COPY_COLUMNS
+                )
+        except Exception as e:
+            # asyncpg raises its own errors here; report constraint violations as SQLAlchemy does
+            if str(getattr(e, "sqlstate", "")).startswith("23"):
+                raise IntegrityError("COPY trades", None, e) from e
+            raise
+        method = "copy"
+    else:
+        await db.execute(insert(models.Trade), [{column: row[column] for column in TRADE_COPY_COLUMNS} for row in rows])
+        method = "insert"
+    await db.commit()
+    return method
+
+
 async def get_trades(db: AsyncSession, session_id: uuid.UUID):
     result = await db.execute(select(models.Trade).filter(models.Trade.session_id == session_id))
     return result.scalars().all()
@@ -586,57 +720,12 @@ async def get_eligible_dates(db: AsyncSession):
     return [(date.available_from.month, date.available_from.year) for date in eligible_dates]
 
 async def get_eligible_dates_roulette(db: AsyncSession):
-    """Get a random eligible month and year for roulette selections."""
-    import random
-    from datetime import date
-    import calendar
-    
-    # Get all stocks with available_from dates
-    result = await db.execute(select(models.Stock).filter(
-        models.Stock.available_from.isnot(None),
-        models.Stock.available_from <= datetime.date.today()
-    ))
-    stocks = result.scalars().all()
-    
-    if not stocks:
-        return None
-    
-    # Get unique month/year combinations
-    unique_dates = set()
-    for stock in stocks:
-        if stock.available_from:
-            unique_dates.add((stock.available_from.month, stock.available_from.year))
-    
-    if not unique_dates:
-        return None
-    
-    # Filter to only include dates where we have stocks from all three categories
-    valid_dates = []
-    for month, year in unique_dates:
-        # Get the first and last day of the month
-        month_start = date(year, month, 1)
-        last_day = calendar.monthrange(year, month)[1]
-        month_end = date(year, month, last_day)
-        
-        # Check if stocks from all categories are available in this month
-        result = await db.execute(select(models.Stock).filter(
-            (models.Stock.available_from <= month_start) &
-            ((models.Stock.available_to >= month_end) | (models.Stock.available_to.is_(None)))
-        ))
-        available_stocks = result.scalars().all()
-        
-        categories = set(s.category for s in available_stocks if s.category)
-        sectors = set(s.sector for s in available_stocks if s.sector and s.category == "sector")
-        
-        # Valid if we have all three categories and at least one sector
-        if "popular" in categories and "volatile" in categories and "sector" in categories and sectors:
-            valid_dates.append({"month": month, "year": year})
-
-    if not valid_dates:
-        return None
-    
-    # Return a random valid date
-    return random.choice(valid_dates)
+    """
+    Get a random eligible month and year for roulette selections.
+    A month is eligible when a popular, a volatile and a sector stock are all available for the
+    whole month; the list is precomputed by the stock catalog, so this is a random draw.
+    """
+    return await stock_catalog.random_eligible_month(db)
 
 async def get_stock_prices(db: AsyncSession, symbol: str, start_date: datetime.date, end_date: datetime.date):
     """Get stock prices for a given symbol within a date range."""
@@ -648,9 +737,37 @@ async def get_stock_prices(db: AsyncSession, symbol: str, start_date: datetime.d
         models.StockPrice.symbol == symbol,
         models.StockPrice.date >= start_datetime,
         models.StockPrice.date <= end_datetime
-    ))
+    ).order_by(models.StockPrice.date))
     return result.scalars().all()
 
+async def get_stock_prices_many(db: AsyncSession, symbols: list, start_date: datetime.date, end_date: datetime.date):
+    """
+    Get stock prices for several symbols within a date range in a single query.
+    Returns a dict of symbol -> {"dates": [...], "prices": [...]} ordered by date.
+    """
+    series = {symbol: {"dates": [], "prices": []} for symbol in symbols}
+    if not series:
+        return series
+
+    start_datetime = datetime.datetime.combine(start_date, datetime.time.min)
+    end_datetime = datetime.datetime.combine(end_date, datetime.time.max)
+
+    result = await db.execute(select(
+        models.StockPrice.symbol,
+        models.StockPrice.date,
+        models.StockPrice.price
+    ).filter(
+        models.StockPrice.symbol.in_(list(series)),
+        models.StockPrice.date >= start_datetime,
+        models.StockPrice.date <= end_datetime
+    ).order_by(models.StockPrice.symbol, models.StockPrice.date))
+
+    for symbol, price_date, price in result.all():
+        columns = series[symbol]
+        columns["dates"].append(price_date)
+        columns["prices"].append(price)
+    return series
+
 async def get_stock_sectors(db: AsyncSession):
     """Get a list of unique stock sectors from the stock_sectors view."""
     try:
@@ -662,182 +779,139 @@ async def get_stock_sectors(db: AsyncSession):
         result = await db.execute(text("SELECT DISTINCT sector FROM stocks WHERE sector IS NOT NULL ORDER BY sector"))
         return [row[0] for row in result.fetchall()]
 
-async def get_latest_stock_prices(db: AsyncSession, symbols: list):
-    """Get the latest stock prices for given symbols."""
-    if not symbols:
-        return []
-    
-    # Get the latest price for each symbol
-    latest_prices = []
-    for symbol in symbols:
-        result = await db.execute(select(models.StockPrice).filter(
-            models.StockPrice.symbol == symbol
-        ).order_by(models.StockPrice.date.desc()).limit(1))
-        latest_price = result.scalar_one_or_none()
-        
-        if latest_price:
-            latest_prices.append(latest_price)
-    
-    return latest_prices
-
-async def calculate_score(db: AsyncSession, session_id: uuid.UUID):
-    """Calculate the score for a session based on trades."""
-    logger.info(f"Starting score calculation for session {session_id}")
-    
-    result = await db.execute(select(models.Trade).filter(models.Trade.session_id == session_id).order_by(models.Trade.timestamp))
-    trades = result.scalars().all()
-    logger.info(f"Found {len(trades)} trades for session {session_id}")
-
-    # Get session to access player_id
-    result = await db.execute(select(models.Session).filter(models.Session.session_id == session_id))
+async def calculate_score(db: AsyncSession, session_id: uuid.UUID, mark_ended: bool = False,
+                          running: Optional[scoring.ScoreResult] = None):
+    """
+    Calculate the score for a session based on trades.
+    Idempotent: the session's single Score row is upserted and its unsold shares replaced in one
+    transaction, and the leaderboard aggregate moves by the difference from any previous score.
+    With mark_ended, the session is also marked ended in that transaction (keeping an existing ended_at).
+    `running` is a live score kept as the trades were recorded; it is stored as is when it has seen
+    every recorded trade of the session, instead of scoring the trades again.
+    """
+    logger.info("Starting score calculation for session %s", session_id)
+
+    # Lock the session row so concurrent end calls for the same session serialize
+    result = await db.execute(
+        select(models.Session).filter(models.Session.session_id == session_id).with_for_update()
+    )
     session = result.scalar_one_or_none()
     if not session:
-        logger.error(f"Session {session_id} not found")
+        logger.error("Session %s not found", session_id)
         raise ValueError(f"Session {session_id} not found")
-    
-    logger.info(f"Session belongs to player_id: {session.player_id}")
-    
-    if not trades:
-        logger.info("No trades found, creating score record with zero values")
-        # Create score record with zero values if no trades
-        db_score = models.Score(
-            session_id=session_id,
-            player_id=session.player_id, 
-            total_trades=0,
-            total_profit=0.0,
-            total_score=0.0
-        )
-        db.add(db_score)
-        await db.commit()
-        await db.refresh(db_score)
-        logger.info("Created zero-value score record")
-        return db_score
-    
-    # Organize by ticker: stack buys until we find sells
-    buy_stack = defaultdict(list)
-    total_score = 0
-    total_profit = 0.0
-    trade_count = len(trades)
-    
-    logger.info(f"Processing {trade_count} trades")
-    
-    for i, trade in enumerate(trades):
-        symbol = trade.symbol
-        action = trade.action.lower()
-        qty = trade.qty
-        price = trade.price
-
-        logger.debug(f"Trade {i+1}/{trade_count}: {action.upper()} {qty} {symbol} @ {price}")
-
-        # +1 for each action
-        total_score += 1
-        logger.debug(f"Score increased by 1 for trade action. Total score: {total_score}")
-
-        if action == 'buy':
-            buy_stack[symbol].append({'qty': qty, 'price': price})
-            logger.debug(f"Added to buy stack for {symbol}. Stack size: {len(buy_stack[symbol])}")
-            
-        elif action == 'sell':
-            qty_left = qty
-            initial_qty = qty
-            trade_profit = 0.0
-            
-            logger.debug(f"Processing sell of {qty} shares of {symbol}")
-            
-            while qty_left > 0 and buy_stack[symbol]:
-                buy = buy_stack[symbol][0]
-                matched_qty = min(qty_left, buy['qty'])
-                profit_per_share = price - buy['price']
-                profit_amount = profit_per_share * matched_qty
-                profit_pct = (profit_per_share / buy['price']) * 100
-
-                logger.debug(f"Matching {matched_qty} shares: bought at {buy['price']}, sold at {price}")
-                logger.debug(f"Profit per share: {profit_per_share:.4f}, Profit %: {profit_pct:.2f}%")
-
-                # Add to total profit
-                total_profit += profit_amount
-                trade_profit += profit_amount
-                
-                logger.debug(f"Profit amount: {profit_amount:.4f}, Total profit: {total_profit:.4f}")
-
-                # Add profit bonus if positive
-                if profit_pct > 0:
-                    bonus_points = 0
-                    if profit_pct <= 5:
-                        bonus_points = 1
-                    elif profit_pct <= 10:
-                        bonus_points = 2
-                    elif profit_pct <= 20:
-                        bonus_points = 3
-                    else:
-                        bonus_points = 5
-                    
-                    total_score += bonus_points
-                    logger.debug(f"Added {bonus_points} bonus points for {profit_pct:.2f}% profit. Total score: {total_score}")
-
-                # Adjust buy stack
-                buy['qty'] -= matched_qty
-                if buy['qty'] == 0:
-                    buy_stack[symbol].pop(0)
-                    logger.debug(f"Removed exhausted buy order from stack for {symbol}")
-                qty_left -= matched_qty
-
-            if qty_left > 0:
-                logger.warning(f"Could not match {qty_left} shares of {symbol} - insufficient buy orders")
-            
-            logger.debug(f"Completed sell trade. Matched {initial_qty - qty_left}/{initial_qty} shares. Trade profit: {trade_profit:.4f}")
-
-    # Log and store unsold positions
+
+    if mark_ended:
+        session.status = "ended"
+        if session.ended_at is None:
+            session.ended_at = models.utc_now()
+
+    outcome = None
+    if running is not None:
+        recorded = await count_trades(db, session_id)
+        if recorded == running.total_trades:
+            outcome = running
+        else:
+            logger.info("Live score of session %s has seen %d of %d trades, rescoring",
+                        session_id, running.total_trades, recorded)
+    if outcome is None:
+        columns = await get_trade_columns(db, session_id)
+        logger.info("Found %d trades for session %s (player_id: %s)", len(columns[0]), session_id, session.player_id)
+        outcome = scoring.score_trades(*columns)
+
+    result = await db.execute(select(
+        models.Score.total_score,
+        models.Score.total_profit,
+        models.Score.total_trades
+    ).filter(models.Score.session_id == session_id))
+    previous = result.one_or_none()
+
+    # Replace unsold positions
+    await db.execute(delete(models.UnsoldShare).where(models.UnsoldShare.session_id == session_id))
     unsold_value = 0.0
-    unsold_shares_list = []
-    
-    for symbol, buys in buy_stack.items():
-        if buys:
-            for buy_order in buys:
-                if buy_order['qty'] > 0:
-                    unsold_qty = buy_order['qty']
-                    purchase_price = buy_order['price']
-                    total_cost = unsold_qty * purchase_price
-                    
-                    # Create unsold share record
-                    unsold_share = models.UnsoldShare(
-                        session_id=session_id,
-                        symbol=symbol,
-                        quantity=unsold_qty,
-                        purchase_price=purchase_price,
-                        total_cost=total_cost
-                    )
-                    db.add(unsold_share)
-                    unsold_shares_list.append(unsold_share)
-                    
-                    logger.info(f"Storing unsold position: {symbol} - {unsold_qty} shares at ${purchase_price:.2f}, total cost: ${total_cost:.2f}")
-                    unsold_value += total_cost
-    
-    if unsold_value > 0:
-        logger.info(f"Total unsold positions value: ${unsold_value:.2f} across {len(unsold_shares_list)} positions")
-        logger.info("Recommendation: Complete trade cycles (buy → sell) for maximum scoring potential")
-    else:
-        logger.info("No unsold positions - excellent complete trading strategy!")
+    for symbol, unsold_qty, purchase_price in outcome.unsold:
+        total_cost = unsold_qty * purchase_price
+        db.add(models.UnsoldShare(
+            session_id=session_id,
+            symbol=symbol,
+            quantity=unsold_qty,
+            purchase_price=purchase_price,
+            total_cost=total_cost
+        ))
+        unsold_value += total_cost
 
-    logger.info(f"Final calculation results:")
-    logger.info(f"  Total trades: {trade_count}")
-    logger.info(f"  Total profit: ${total_profit:.2f}")
-    logger.info(f"  Total score: {total_score}")
-    logger.info(f"  Unsold positions value: ${unsold_value:.2f}")
+    logger.info(
+        "Score for session %s: trades=%d, profit=%.2f, score=%s, unsold positions=%d (value %.2f)",
+        session_id, outcome.total_trades, outcome.total_profit, outcome.total_score, len(outcome.unsold), unsold_value
+    )
 
-    db_score = models.Score(
+    stmt = dialect_insert(db, models.Score).values(
         session_id=session_id,
         player_id=session.player_id,
-        total_trades=trade_count,
-        total_profit=Decimal(total_profit),
-        total_score=total_score
+        total_trades=outcome.total_trades,
+        total_profit=outcome.total_profit,
+        total_score=outcome.total_score,
+        created_at=models.utc_now()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Score.session_id],
+        set_={
+            "total_trades": stmt.excluded.total_trades,
+            "total_profit": stmt.excluded.total_profit,
+            "total_score": stmt.excluded.total_score,
+            "created_at": stmt.excluded.created_at,
+        }
     )
-    db.add(db_score)
+    await db.execute(stmt)
+
+    if previous is None:
+        await apply_player_stats_delta(db, session.player_id, outcome.total_score, outcome.total_profit,
+                                       outcome.total_trades, score_count=1)
+    else:
+        await apply_player_stats_delta(db, session.player_id,
+                                       outcome.total_score - previous.total_score,
+                                       outcome.total_profit - previous.total_profit,
+                                       outcome.total_trades - previous.total_trades)
     await db.commit()
-    await db.refresh(db_score)
-    
-    logger.info(f"Score calculation completed for session {session_id}")
-    return db_score
+
+    result = await db.execute(
+        select(models.Score).filter(models.Score.session_id == session_id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalar_one()
+
+
+async def get_trade_columns(db: AsyncSession, session_id: uuid.UUID):
+    """Get a session's trades in time order as (symbols, actions, qtys, prices) columns for scoring."""
+    result = await db.execute(select(
+        models.Trade.symbol,
+        models.Trade.action,
+        models.Trade.qty,
+        models.Trade.price
+    ).filter(models.Trade.session_id == session_id).order_by(models.Trade.timestamp, models.Trade.trade_id))
+    rows = result.all()
+    if not rows:
+        return [], [], [], []
+    symbols, actions, qtys, prices = zip(*rows)
+    return list(symbols), list(actions), list(qtys), list(prices)
+
+
+async def count_trades(db: AsyncSession, session_id: uuid.UUID) -> int:
+    """Count a session's recorded trades."""
+    result = await db.execute(select(func.count()).select_from(models.Trade).filter(models.Trade.session_id == session_id))
+    return result.scalar_one()
+
+
+async def get_trade_history(db: AsyncSession, session_id: uuid.UUID):
+    """Get a session's trades in scoring order as (symbol, action, qty, price, timestamp, client_trade_id) rows."""
+    result = await db.execute(select(
+        models.Trade.symbol,
+        models.Trade.action,
+        models.Trade.qty,
+        models.Trade.price,
+        models.Trade.timestamp,
+        models.Trade.client_trade_id
+    ).filter(models.Trade.session_id == session_id).order_by(models.Trade.timestamp, models.Trade.trade_id))
+    return result.all()
 
 
 # Unsold Shares
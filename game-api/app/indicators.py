@@ -0,0 +1,177 @@
+"""
+Technical indicators over a symbol's month of prices.
+
+The advice prompt used to carry the last five raw prices of each symbol as
+JSON, which spends context on numbers the model has to interpret itself. It
+now carries a handful of precomputed indicators per symbol instead: returns,
+SMA/EMA, RSI, volatility and maximum drawdown over the session month.
+
+``compute`` stacks the requested series into one right-aligned NumPy matrix
+(shorter months are padded with NaN on the left, so every row ends in the same
+column) and computes every indicator for all symbols at once. The recursive
+EMA and RSI smoothing walk the time axis once, vectorized across symbols.
+
+Prices never change once loaded, so ``IndicatorCache`` keeps the results per
+(symbol, year, month) in an LRU, next to the price series they come from. The
+same values back ``/api/stocks/indicators/{symbol}``.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.price_cache import PriceSeries, price_cache
+
+SMA_WINDOWS = (5, 10)
+EMA_SPAN = 10
+RSI_PERIOD = 14
+
+
+def _value(x) -> Optional[float]:
+    return None if np.isnan(x) else round(float(x), 4)
+
+
+def _smooth(values: np.ndarray, alpha: float) -> np.ndarray:
+    """Exponential smoothing along the time axis, seeded by each row's first value and skipping NaN padding."""
+    smoothed = np.full(values.shape[0], np.nan)
+    for column in values.T:
+        present = ~np.isnan(column)
+        seeded = present & np.isnan(smoothed)
+        smoothed = np.where(seeded, column, smoothed)
+        update = present & ~seeded
+        smoothed[update] += alpha * (column[update] - smoothed[update])
+    return smoothed
+
+
+def compute(series: List[PriceSeries]) -> Dict[str, dict]:
+    """
+    Compute the indicators of several price series in one pass.
+    Indicators that need more trading days than a series has are None.
+    """
+    lengths = np.array([len(s) for s in series], dtype=int)
+    # At least two columns, so there is always a last price and a last return, NaN for short series
+    width = max(int(lengths.max(initial=0)), 2)
+    prices = np.full((len(series), width), np.nan)
+    for row, s in enumerate(series):
+        if len(s):
+            prices[row, width - len(s):] = np.frombuffer(s.prices, dtype=float)
+
+    rows = np.arange(len(series))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        changes = np.diff(prices, axis=1)
+        returns = changes / prices[:, :-1]
+        counts = np.sum(~np.isnan(returns), axis=1)
+        mean_return = np.nansum(returns, axis=1) / counts
+        variance = np.nansum((returns - mean_return[:, None]) ** 2, axis=1) / (counts - 1)
+        volatility = np.where(counts >= 2, np.sqrt(variance), np.nan)
+
+        first = prices[rows, np.minimum(width - lengths, width - 1)]
+        last = prices[:, -1]
+        month_return = last / first - 1
+        last_return = returns[:, -1]
+
+        sma = {window: np.where(lengths >= window, np.sum(prices[:, -window:], axis=1) / window, np.nan)
+               for window in SMA_WINDOWS}
+        ema = _smooth(prices, 2 / (EMA_SPAN + 1))
+
+        # Wilder's RSI: gains and losses smoothed with alpha = 1 / period
+        gains = np.where(np.isnan(changes), np.nan, np.maximum(changes, 0))
+        losses = np.where(np.isnan(changes), np.nan, np.maximum(-changes, 0))
+        average_gain = _smooth(gains, 1 / RSI_PERIOD)
+        average_loss = _smooth(losses, 1 / RSI_PERIOD)
+        rsi = np.where(average_gain + average_loss == 0, 50.0, 100 * average_gain / (average_gain + average_loss))
+        rsi = np.where(counts >= RSI_PERIOD, rsi, np.nan)
+
+        peaks = np.fmax.accumulate(prices, axis=1)
+        drawdown = np.where(lengths > 0, np.min(np.nan_to_num(prices / peaks - 1, nan=0.0), axis=1, initial=0.0),
+                            np.nan)
+
+    results = {}
+    for row, s in enumerate(series):
+        results[s.symbol] = {
+            "symbol": s.symbol,
+            "days": len(s),
+            "first_date": s.dates[0] if len(s) else None,
+            "last_date": s.dates[-1] if len(s) else None,
+            "last_price": _value(last[row]),
+            "return_pct": _value(month_return[row] * 100),
+            "last_return_pct": _value(last_return[row] * 100),
+            **{f"sma_{window}": _value(values[row]) for window, values in sma.items()},
+            f"ema_{EMA_SPAN}": _value(ema[row]),
+            f"rsi_{RSI_PERIOD}": _value(rsi[row]),
+            "volatility_pct": _value(volatility[row] * 100),
+            "max_drawdown_pct": _value(drawdown[row] * 100),
+        }
+    return results
+
+
+class IndicatorCache:
+    """LRU cache of computed indicators keyed by (symbol, year, month)."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int, int], dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.computations = 0
+
+    async def get_month(self, db: AsyncSession, symbol: str, year: int, month: int) -> dict:
+        """Return the indicators of a symbol's month, computing them on a miss."""
+        return (await self.get_months(db, [symbol], year, month))[symbol]
+
+    async def get_months(self, db: AsyncSession, symbols: List[str], year: int, month: int) -> Dict[str, dict]:
+        """Return the indicators of several symbols for a month; missing symbols are computed together."""
+        found: Dict[str, dict] = {}
+        missing: List[str] = []
+        for symbol in dict.fromkeys(symbols):
+            key = (symbol, year, month)
+            indicators = self._entries.get(key)
+            if indicators is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                found[symbol] = indicators
+            else:
+                self.misses += 1
+                missing.append(symbol)
+
+        if missing:
+            series = await price_cache.get_months(db, missing, year, month)
+            self.computations += 1
+            for symbol, indicators in compute(list(series.values())).items():
+                indicators = {**indicators, "year": year, "month": month}
+                if indicators["days"]:
+                    # A month without prices is not kept; its prices may not have been loaded yet
+                    self._store((symbol, year, month), indicators)
+                found[symbol] = indicators
+        return {symbol: found[symbol] for symbol in symbols}
+
+    def invalidate(self, symbol: str = None):
+        """Drop cached entries, either all of them or only those for one symbol."""
+        if symbol is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if k[0] == symbol]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "computations": self.computations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _store(self, key: Tuple[str, int, int], indicators: dict):
+        self._entries[key] = indicators
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# Shared instance used by the stocks router and the advice endpoint
+indicator_cache = IndicatorCache(max_entries=settings.INDICATOR_CACHE_MAX_ENTRIES)
@@ -32,6 +32,9 @@ app.add_middleware(
 
 # Include routers
 from app.routers import admin, players, sessions, selections, stocks, trades, ws
+from app.advice import advice_cache
+from app.price_stream import stream_cursors
+from app.trade_ingest import trade_ingestor
 
 app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 app.include_router(players.router, prefix="/api", tags=["players"])
@@ -41,6 +44,17 @@ app.include_router(stocks.router, prefix="/api/stocks", tags=["stocks"])
 app.include_router(trades.router, prefix="/api", tags=["trades"])
 app.include_router(ws.router, prefix="/ws", tags=["ws"])
 
+@app.on_event("startup")
+async def build_advice_chain():
+    """Build the LLM client and chain once, instead of on every advice request"""
+    advice_cache.start()
+
+@app.on_event("shutdown")
+async def flush_write_behind_state():
+    """Write queued trades and buffered stream cursors before the worker exits"""
+    await trade_ingestor.close()
+    await stream_cursors.close()
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
@@ -1,7 +1,7 @@
 from datetime import datetime, timezone
 import uuid
 
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, JSON, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
@@ -38,6 +38,12 @@ class Session(Base):
     balance = Column(Float, nullable=False, default=0.0)
     unsold_stocks = Column(JSON, nullable=False, default=list)
 
+    __table_args__ = (
+        Index('ix_sessions_started_at_session_id', 'started_at', 'session_id'),  # Admin listing keyset order
+        Index('ix_sessions_player_id_started_at', 'player_id', 'started_at', 'session_id'),
+        Index('ix_sessions_status_started_at', 'status', 'started_at', 'session_id'),
+    )
+
 
 class Stock(Base):
     __tablename__ = 'stocks'
@@ -65,6 +71,10 @@ class SessionSelection(Base):
     year = Column(Integer, nullable=False)
     current_date = Column(DateTime, nullable=True)
 
+    __table_args__ = (
+        Index('ix_session_selections_session_id', 'session_id'),
+    )
+
 
 class Trade(Base):
     __tablename__ = 'trades'
@@ -75,22 +85,39 @@ class Trade(Base):
     action = Column(String, nullable=False)
     qty = Column(Integer, nullable=False)
     price = Column(Float, nullable=False)
+    client_trade_id = Column(String(64), nullable=True)  # Idempotency key; NULL for trades recorded before it
+
+    __table_args__ = (
+        Index('ix_trades_session_id_timestamp', 'session_id', 'timestamp', 'trade_id'),  # Scoring replay order
+        Index('ix_trades_session_id_client_trade_id', 'session_id', 'client_trade_id', unique=True),
+    )
 
 class Score(Base):
     __tablename__ = 'scores'
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(UUID(as_uuid=True), ForeignKey('sessions.session_id'), nullable=False)
-    player_id = Column(Integer, ForeignKey('players.id'), nullable=False)
+    session_id = Column(UUID(as_uuid=True), ForeignKey('sessions.session_id'), nullable=False, unique=True, index=True)  # One score per session
+    player_id = Column(Integer, ForeignKey('players.id'), nullable=False, index=True)
     total_trades = Column(Integer, nullable=False)
     total_profit = Column(Float, nullable=False)
     total_score = Column(Float, nullable=False)
     created_at = Column(DateTime, nullable=False, default=utc_now)
 
 
+class PlayerStats(Base):
+    """Per-player leaderboard aggregate, maintained incrementally as scores are written or removed"""
+    __tablename__ = 'player_stats'
+    player_id = Column(Integer, ForeignKey('players.id'), primary_key=True)
+    total_score = Column(Float, nullable=False, default=0.0, index=True)
+    total_profit = Column(Float, nullable=False, default=0.0, index=True)
+    total_trades = Column(Integer, nullable=False, default=0)
+    score_count = Column(Integer, nullable=False, default=0)  # Number of Score rows aggregated
+    updated_at = Column(DateTime, nullable=False, default=utc_now, onupdate=utc_now)
+
+
 class UnsoldShare(Base):
     __tablename__ = 'unsold_shares'
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(UUID(as_uuid=True), ForeignKey('sessions.session_id'), nullable=False)
+    session_id = Column(UUID(as_uuid=True), ForeignKey('sessions.session_id'), nullable=False, index=True)
     symbol = Column(String, ForeignKey('stocks.symbol'), nullable=False)
     quantity = Column(Integer, nullable=False)
     purchase_price = Column(Float, nullable=False)
@@ -107,6 +134,10 @@ class AgentInteraction(Base):
     content = Column(String, nullable=False)
     interaction_metadata = Column(JSON, nullable=True)  # Additional context like suggested stocks, reasoning, etc.
 
+    __table_args__ = (
+        Index('ix_agent_interactions_session_id_timestamp', 'session_id', 'timestamp'),
+    )
+
 
 class AdminAuditLog(Base):
     __tablename__ = 'admin_audit_log'
@@ -116,4 +147,8 @@ class AdminAuditLog(Base):
     target_id = Column(String, nullable=True)  # ID of affected resource (session_id, player_id, etc.)
     details = Column(JSON, nullable=True)  # Additional details about the action
     timestamp = Column(DateTime, nullable=False, default=utc_now)
-    ip_address = Column(String, nullable=True)
\ No newline at end of file
+    ip_address = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index('ix_admin_audit_log_timestamp_id', 'timestamp', 'id'),  # Newest-first keyset order
+    )
\ No newline at end of file
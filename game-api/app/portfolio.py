@@ -0,0 +1,362 @@
+"""
+In-memory portfolios used to validate and price trades as they are posted.
+
+Oversells used to be accepted by ``POST /api/trades/`` and only surfaced at the
+end of a game, when ``calculate_score`` skipped them. ``PortfolioBook`` keeps a
+``Portfolio`` per active session instead: its cash and FIFO lots per symbol,
+hydrated once from the session's recorded trades and then updated by each
+trade it accepts, so checking a trade never re-reads the trade history. The
+lots live in a ``scoring.RunningScore``, so the portfolio also carries the
+session's live score, and ending the session only finalizes it.
+
+Trades are priced by the server at the close of the session's current market
+date, the last date its price stream delivered, read from the cached month
+series in O(1). The client's price is only a display value: a trade is
+recorded at the server's price. Trades of one session are checked and
+recorded one at a time so two concurrent sells cannot both spend the same
+shares.
+
+Bulk imports (``record_bulk``) check thousands of trades at once with NumPy:
+per-session and per-symbol running totals of cash and shares, started from
+each portfolio's current state, must never go negative. Like single trades,
+they are recorded at the server's price, not the price in the request.
+
+Portfolios are per worker. A session whose trades are posted to several
+workers is still validated against the trades each worker has seen since it
+hydrated the session; ending a session drops its portfolio.
+"""
+import asyncio
+import datetime
+import logging
+import uuid
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+from app import crud, schemas, scoring
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+from app.price_cache import PriceSeries, price_cache
+from app.price_stream import stream_cursors
+
+logger = logging.getLogger(__name__)
+
+# Clients show prices rounded to cents, so a buy of everything the client thinks it can afford may
+# cost up to half a cent per share more at the exact price
+CASH_TOLERANCE_PER_SHARE = 0.005
+
+
+class TradeRejected(ValueError):
+    """The trade is not allowed in the session's current portfolio."""
+
+
+class Portfolio:
+    """Cash and FIFO lots of one session, kept in step with the trades recorded for it."""
+
+    def __init__(self, session_id: uuid.UUID, cash: float, status: str,
+                 series: Dict[str, PriceSeries], market_date: Optional[datetime.date]):
+        self.session_id = session_id
+        self.cash = cash
+        self.status = status
+        self.series = series
+        self.market_date = market_date
+        self.score = scoring.RunningScore()
+        self.holdings: Dict[str, int] = dict.fromkeys(series, 0)
+        self.trade_ids: Set[str] = set()
+        self.last_timestamp: Optional[datetime.datetime] = None
+        self.lock = asyncio.Lock()
+
+    def quote(self, symbol: str) -> float:
+        """Return the symbol's close on the current market date (the first trading day before streaming)."""
+        series = self.series.get(symbol)
+        if series is None:
+            raise TradeRejected(f"{symbol} is not one of this session's stocks")
+        if self.market_date is None:
+            index = 0 if len(series) else None
+        else:
+            index = series.position(self.market_date)
+            if index is None:
+                # Not a trading day for this symbol; use its last close before it
+                before = series.between(datetime.date.min, self.market_date)
+                index = before[-1] if before else None
+        if index is None:
+            raise TradeRejected(f"No price for {symbol} on {self.market_date or 'the first trading day'}")
+        return series.prices[index]
+
+    def check(self, action: str, symbol: str, qty: int, price: float):
+        """Raise TradeRejected if the portfolio cannot make the trade."""
+        if self.status == "ended":
+            raise TradeRejected("Session has ended")
+        if action == "sell" and qty > self.holdings.get(symbol, 0):
+            raise TradeRejected(f"Cannot sell {qty} {symbol}: only {self.holdings.get(symbol, 0)} held")
+        if action == "buy" and qty * price > self.cash + qty * CASH_TOLERANCE_PER_SHARE:
+            raise TradeRejected(f"Insufficient cash: {qty} {symbol} costs {qty * price:.2f}, "
+                                f"cash is {self.cash:.2f}")
+
+    def apply(self, action: str, symbol: str, qty: int, price: float, client_trade_id: Optional[str] = None,
+              timestamp: Optional[datetime.datetime] = None):
+        """
+        Update cash, lots and score for a recorded trade. Sells are matched to buys FIFO; as in scoring,
+        quantity beyond the open lots (only possible in trades recorded before validation) is ignored.
+        """
+        if client_trade_id is not None:
+            self.trade_ids.add(client_trade_id)
+        if timestamp is not None and (self.last_timestamp is None or timestamp > self.last_timestamp):
+            self.last_timestamp = timestamp
+        sold = self.score.add(symbol, action, qty, price)
+        if action == "buy":
+            self.holdings[symbol] = self.holdings.get(symbol, 0) + qty
+            self.cash -= qty * price
+        elif sold:
+            self.holdings[symbol] -= sold
+            self.cash += sold * price
+
+    def live_score(self) -> dict:
+        """Return the session's score so far, with its cash and open positions."""
+        return {
+            "session_id": self.session_id,
+            "total_trades": self.score.total_trades,
+            "total_profit": self.score.total_profit,
+            "total_score": self.score.total_score,
+            "cash": self.cash,
+            "holdings": {symbol: qty for symbol, qty in self.holdings.items() if qty},
+            "market_date": self.market_date,
+        }
+
+
+def running_totals(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    """Cumulative sums of values within each group, returned in the original order."""
+    order = np.argsort(groups, kind="stable")
+    ordered = values[order]
+    totals = np.cumsum(ordered)
+    ordered_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, ordered_groups[1:] != ordered_groups[:-1]])
+    lengths = np.diff(np.r_[starts, len(values)])
+    totals -= np.repeat(totals[starts] - ordered[starts], lengths)
+    result = np.empty_like(totals)
+    result[order] = totals
+    return result
+
+
+def check_trades(rows: List[dict], portfolios: Dict[uuid.UUID, Portfolio], positions: List[int]):
+    """
+    Raise TradeRejected, naming the trade's position in `positions`, for the first trade in `rows` (in
+    time order per session) that its session's portfolio could not make after the trades before it.
+    """
+    if not rows:
+        return
+    session_ids = list(portfolios)
+    codes = {session_id: code for code, session_id in enumerate(session_ids)}
+    sessions = np.fromiter((codes[row["session_id"]] for row in rows), dtype=np.int64, count=len(rows))
+    symbols = np.array([row["symbol"] for row in rows])
+    buys = np.array([row["action"] == "buy" for row in rows])
+    qtys = np.fromiter((row["qty"] for row in rows), dtype=np.int64, count=len(rows))
+    prices = np.fromiter((row["price"] for row in rows), dtype=np.float64, count=len(rows))
+
+    def reject(mask: np.ndarray, message: Callable[[int], str]):
+        if mask.any():
+            row = int(np.argmax(mask))
+            raise TradeRejected(f"Trade {positions[row]}: {message(row)}")
+
+    ended = np.array([portfolios[session_id].status == "ended" for session_id in session_ids])
+    reject(ended[sessions], lambda row: "Session has ended")
+
+    # Replayed trades cannot go before recorded ones, or the portfolio would apply them out of scoring order
+    last = np.array([np.datetime64(portfolios[session_id].last_timestamp or "NaT", "us")
+                     for session_id in session_ids])
+    timestamps = np.array([row["timestamp"] for row in rows], dtype="datetime64[us]")
+    reject(timestamps < last[sessions], lambda row: "Timestamp is before the session's last recorded trade")
+
+    keys = np.char.add(np.char.add(sessions.astype(str), ":"), symbols)
+    allowed = [f"{code}:{symbol}" for code, session_id in enumerate(session_ids)
+               for symbol in portfolios[session_id].series]
+    reject(~np.isin(keys, allowed), lambda row: f"{symbols[row]} is not one of this session's stocks")
+
+    # Shares held of each (session, symbol) after every trade
+    pairs, groups = np.unique(keys, return_inverse=True)
+    held = np.array([portfolios[session_ids[int(pair.split(":", 1)[0])]].holdings.get(pair.split(":", 1)[1], 0)
+                     for pair in pairs], dtype=np.int64)
+    holding = held[groups] + running_totals(np.where(buys, qtys, -qtys), groups)
+    reject(holding < 0, lambda row: f"Cannot sell {qtys[row]} {symbols[row]}: "
+                                    f"only {holding[row] + qtys[row]} held")
+
+    # Cash of each session after every trade, with the same rounding slack as single trades
+    cash = np.array([portfolios[session_id].cash for session_id in session_ids])[sessions]
+    cash = cash + running_totals(np.where(buys, -1.0, 1.0) * qtys * prices, sessions)
+    slack = CASH_TOLERANCE_PER_SHARE * running_totals(np.where(buys, qtys, 0), sessions)
+    reject(cash < -slack, lambda row: f"Insufficient cash: {qtys[row]} {symbols[row]} costs "
+                                      f"{qtys[row] * prices[row]:.2f}, cash is {cash[row] + qtys[row] * prices[row]:.2f}")
+
+
+class PortfolioBook:
+    """LRU of the portfolios of recently trading sessions, hydrated on first use."""
+
+    def __init__(self, session_factory, max_sessions: int = 4096):
+        self.session_factory = session_factory
+        self.max_sessions = max_sessions
+        self._portfolios: "OrderedDict[uuid.UUID, Portfolio]" = OrderedDict()
+        self._loading: Dict[uuid.UUID, asyncio.Future] = {}
+        self.hydrations = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    async def get(self, session_id: uuid.UUID) -> Portfolio:
+        """Return the session's portfolio, hydrating it from its trades on a miss."""
+        portfolio = self._portfolios.get(session_id)
+        if portfolio is not None:
+            self._portfolios.move_to_end(session_id)
+            return portfolio
+        pending = self._loading.get(session_id)
+        if pending is not None:
+            # Concurrent first trades of a session share one hydration
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The request that owned the hydration was cancelled; hydrate ourselves
+                return await self.get(session_id)
+
+        pending = self._loading[session_id] = asyncio.get_running_loop().create_future()
+        try:
+            portfolio = await self._hydrate(session_id)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                pending.cancel()
+            else:
+                pending.set_exception(e)
+                pending.exception()  # Retrieved, even if nobody else was waiting
+            raise
+        finally:
+            del self._loading[session_id]
+        pending.set_result(portfolio)
+        self._portfolios[session_id] = portfolio
+        if len(self._portfolios) > self.max_sessions:
+            self._portfolios.popitem(last=False)
+        return portfolio
+
+    async def record(self, trade: schemas.TradeCreate,
+                     submit: Callable[[schemas.TradeCreate], Awaitable[dict]]) -> dict:
+        """
+        Check and price a trade against the session's portfolio, record it with `submit` and update the
+        portfolio with the stored row. Raises LookupError for an unknown session and TradeRejected for
+        a trade the portfolio cannot make.
+        """
+        portfolio = await self.get(trade.session_id)
+        async with portfolio.lock:
+            if trade.client_trade_id is not None and trade.client_trade_id in portfolio.trade_ids:
+                # A retry of a recorded trade; the ingestor returns the stored row
+                return await submit(trade)
+            try:
+                price = portfolio.quote(trade.symbol)
+                portfolio.check(trade.action, trade.symbol, trade.qty, price)
+            except TradeRejected:
+                self.rejected += 1
+                raise
+            stored = await submit(trade.model_copy(update={"price": price}))
+            portfolio.apply(stored["action"], stored["symbol"], stored["qty"], stored["price"],
+                            stored["client_trade_id"], stored["timestamp"])
+            self.accepted += 1
+            return stored
+
+    async def record_bulk(self, trades: List[schemas.TradeCreate],
+                          insert: Callable[[List[dict]], Awaitable[str]]) -> dict:
+        """
+        Price many trades as `record` does, check them against their sessions' portfolios in one
+        vectorized pass, record them with `insert` and apply them to the portfolios. Trades whose client_trade_id is already recorded (or
+        repeated in the batch) are skipped. Nothing is recorded if any trade is rejected. Returns the
+        inserted and skipped counts and the method `insert` reports.
+        """
+        # Trades are checked, stored and scored in time order; the sort is stable for equal timestamps
+        rows = sorted((crud.normalize_data_for_db(trade.model_dump()) for trade in trades),
+                      key=lambda row: row["timestamp"])
+        book = {session_id: await self.get(session_id) for session_id in dict.fromkeys(row["session_id"] for row in rows)}
+
+        async with AsyncExitStack() as stack:
+            # Sessions are locked in a fixed order so concurrent bulk imports cannot deadlock
+            for session_id in sorted(book, key=str):
+                await stack.enter_async_context(book[session_id].lock)
+
+            seen = {session_id: set(portfolio.trade_ids) for session_id, portfolio in book.items()}
+            accepted, positions = [], []
+            for position, row in enumerate(rows):
+                key = row["client_trade_id"]
+                if key is None:
+                    row["client_trade_id"] = uuid.uuid4().hex
+                elif key in seen[row["session_id"]]:
+                    continue
+                else:
+                    seen[row["session_id"]].add(key)
+                accepted.append(row)
+                positions.append(position)
+
+            try:
+                for position, row in zip(positions, accepted):
+                    portfolio = book[row["session_id"]]
+                    # Foreign symbols are rejected by check_trades
+                    if row["symbol"] in portfolio.series:
+                        try:
+                            row["price"] = portfolio.quote(row["symbol"])
+                        except TradeRejected as e:
+                            raise TradeRejected(f"Trade {position}: {e}") from None
+                check_trades(accepted, book, positions)
+            except TradeRejected:
+                self.rejected += 1
+                raise
+            method = await insert(accepted) if accepted else None
+            for row in accepted:
+                book[row["session_id"]].apply(row["action"], row["symbol"], row["qty"], row["price"],
+                                              row["client_trade_id"], row["timestamp"])
+
+        self.accepted += len(accepted)
+        return {"inserted": len(accepted), "duplicates": len(rows) - len(accepted), "method": method}
+
+    def peek(self, session_id: uuid.UUID) -> Optional[Portfolio]:
+        """Return the session's portfolio if it is loaded, without hydrating it."""
+        return self._portfolios.get(session_id)
+
+    def advance(self, session_id: uuid.UUID, day: datetime.date):
+        """Move a loaded portfolio's market date, as its price stream delivers a date."""
+        portfolio = self._portfolios.get(session_id)
+        if portfolio is not None:
+            portfolio.market_date = day
+
+    def discard(self, session_id: uuid.UUID):
+        """Drop a session's portfolio, e.g. when the session ends."""
+        self._portfolios.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._portfolios),
+            "hydrations": self.hydrations,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+        }
+
+    async def _hydrate(self, session_id: uuid.UUID) -> Portfolio:
+        async with self.session_factory() as db:
+            session = await crud.get_session(db, session_id)
+            if session is None:
+                raise LookupError(f"Session {session_id} not found")
+            selection = await crud.get_selection(db, session_id)
+            if selection is None:
+                raise TradeRejected("No stocks selected yet.")
+            symbols = [selection.popular_symbol, selection.volatile_symbol, selection.sector_symbol]
+            series = await price_cache.get_months(db, symbols, selection.year, selection.month)
+            history = await crud.get_trade_history(db, session_id)
+
+        market_date = stream_cursors.cursor(session_id) or (
+            selection.current_date.date() if selection.current_date else None
+        )
+        portfolio = Portfolio(session_id, session.balance, session.status, series, market_date)
+        for symbol, action, qty, price, timestamp, client_trade_id in history:
+            portfolio.apply(action.lower(), symbol, qty, price, client_trade_id, timestamp)
+        self.hydrations += 1
+        logger.debug("Hydrated portfolio of session %s from %d trades", session_id, len(history))
+        return portfolio
+
+
+# Shared instance used by the trades router
+portfolios = PortfolioBook(AsyncSessionLocal, max_sessions=settings.PORTFOLIO_MAX_SESSIONS)
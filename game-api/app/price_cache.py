@@ -0,0 +1,196 @@
+"""
+Process-wide cache of monthly stock price series.
+
+Historical prices never change once loaded, so every consumer that needs a
+symbol's prices for a month (the WebSocket stream, the advice endpoint and the
+price history API) reads from one shared, size-bounded LRU keyed by
+(symbol, year, month) instead of querying Postgres on every request.
+"""
+import asyncio
+import calendar
+import datetime
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PriceSeries:
+    """Compact, immutable price series for one symbol and month."""
+
+    __slots__ = ("symbol", "dates", "timestamps", "prices", "_positions")
+
+    def __init__(self, symbol: str, timestamps: List[datetime.datetime], prices: List[float]):
+        self.symbol = symbol
+        self.timestamps: Tuple[datetime.datetime, ...] = tuple(timestamps)
+        self.dates: Tuple[datetime.date, ...] = tuple(ts.date() for ts in self.timestamps)
+        self.prices = array("d", prices)
+        self._positions: Dict[datetime.date, int] = {d: i for i, d in enumerate(self.dates)}
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def position(self, day: datetime.date) -> Optional[int]:
+        """Return the index of ``day`` in the series, or None if it was not a trading day."""
+        return self._positions.get(day)
+
+    def between(self, start_date: datetime.date, end_date: datetime.date) -> range:
+        """Return the index range of entries whose date falls within [start_date, end_date]."""
+        return range(bisect_left(self.dates, start_date), bisect_right(self.dates, end_date))
+
+
+def month_bounds(year: int, month: int) -> Tuple[datetime.date, datetime.date]:
+    """Return the first and last calendar day of a month."""
+    last_day = calendar.monthrange(year, month)[1]
+    return datetime.date(year, month, 1), datetime.date(year, month, last_day)
+
+
+class PriceCache:
+    """LRU cache of ``PriceSeries`` keyed by (symbol, year, month)."""
+
+    # Widest range (in calendar months) that get_range serves through the cache
+    MAX_CACHED_RANGE_MONTHS = 1
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int, int], PriceSeries]" = OrderedDict()
+        self._loading: Dict[Tuple[str, int, int], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_month(self, db: AsyncSession, symbol: str, year: int, month: int) -> PriceSeries:
+        """Return the price series for a symbol and month, loading it on a miss."""
+        return (await self.get_months(db, [symbol], year, month))[symbol]
+
+    async def get_months(self, db: AsyncSession, symbols: List[str], year: int, month: int) -> Dict[str, PriceSeries]:
+        """
+        Return the month's price series for several symbols.
+        All missing symbols are loaded together in a single query.
+        """
+        found: Dict[str, PriceSeries] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        missing: List[str] = []
+        for symbol in dict.fromkeys(symbols):
+            key = (symbol, year, month)
+            series = self._entries.get(key)
+            if series is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                found[symbol] = series
+            elif key in self._loading:
+                # Concurrent misses for the same key share a single query
+                self.hits += 1
+                waiting[symbol] = self._loading[key]
+            else:
+                self.misses += 1
+                missing.append(symbol)
+
+        if missing:
+            found.update(await self._load_many(db, missing, year, month))
+        for symbol, pending in waiting.items():
+            try:
+                found[symbol] = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The request that owned the load was cancelled; load the series ourselves
+                found[symbol] = await self.get_month(db, symbol, year, month)
+        return {symbol: found[symbol] for symbol in symbols}
+
+    async def get_range(self, db: AsyncSession, symbol: str,
+                        start_date: datetime.date, end_date: datetime.date) -> List[dict]:
+        """
+        Return a symbol's prices within a date range.
+        Ranges touching at most MAX_CACHED_RANGE_MONTHS calendar months are assembled from cached
+        months; wider ranges are read with one uncached query so they cannot flood the LRU.
+        """
+        months = (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+        if months > self.MAX_CACHED_RANGE_MONTHS:
+            rows = await crud.get_stock_prices(db, symbol, start_date, end_date)
+            return [{"symbol": row.symbol, "price": row.price, "date": row.date} for row in rows]
+
+        results = []
+        year, month = start_date.year, start_date.month
+        while (year, month) <= (end_date.year, end_date.month):
+            series = await self.get_month(db, symbol, year, month)
+            for i in series.between(start_date, end_date):
+                results.append({"symbol": symbol, "price": series.prices[i], "date": series.timestamps[i]})
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return results
+
+    def invalidate(self, symbol: str = None):
+        """Drop cached entries, either all of them or only those for one symbol."""
+        if symbol is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if k[0] == symbol]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def _load_many(self, db: AsyncSession, symbols: List[str], year: int, month: int) -> Dict[str, PriceSeries]:
+        loop = asyncio.get_running_loop()
+        futures = {symbol: loop.create_future() for symbol in symbols}
+        for symbol, future in futures.items():
+            self._loading[(symbol, year, month)] = future
+
+        try:
+            first_day, last_day = month_bounds(year, month)
+            columns = await crud.get_stock_prices_many(db, symbols, first_day, last_day)
+        except asyncio.CancelledError:
+            # Waiters see the cancelled future and retry the load themselves
+            for future in futures.values():
+                future.cancel()
+            raise
+        except BaseException as e:
+            for future in futures.values():
+                future.set_exception(e)
+                # Nobody may be waiting on the future; mark the exception as retrieved
+                future.exception()
+            raise
+        finally:
+            for symbol in symbols:
+                self._loading.pop((symbol, year, month), None)
+
+        loaded = {}
+        for symbol in symbols:
+            series = PriceSeries(symbol, columns[symbol]["dates"], columns[symbol]["prices"])
+            futures[symbol].set_result(series)
+            if len(series):
+                # Empty months (unknown symbols, months not loaded yet) are not kept, so they cannot fill the LRU
+                self._store((symbol, year, month), series)
+            loaded[symbol] = series
+        return loaded
+
+    def _store(self, key: Tuple[str, int, int], series: PriceSeries):
+        self._entries[key] = series
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            logger.debug("Evicted price series %s from cache", evicted_key)
+
+
+# Shared instance used by all routers
+price_cache = PriceCache(max_entries=settings.PRICE_CACHE_MAX_ENTRIES)
@@ -0,0 +1,606 @@
+"""
+Broadcast hub for the historical price WebSocket stream.
+
+A stream used to be one task per socket sleeping between ticks while holding a
+database session. The hub instead drives every stream from a single timer
+wheel: the WebSocket handler loads the month from the price cache, releases its
+database session and subscribes. Subscribers watching the same month and
+symbols that join within the same wheel slot (the tick phase) share a group,
+and each tick of a group fans one frame out to all of its sockets.
+
+Frames are serialized once per timeline, not per tick: every date's static
+fields are encoded when the timeline is first streamed in an encoding, and
+timelines are shared between streams of the same month and symbols. A tick only
+encodes its wall-clock timestamp, and each subscriber's session id is spliced
+in as a prefix. JSON frames go out as text (with orjson when installed);
+``msgpack`` frames, available with the ``stream`` extra, go out as binary.
+
+Each group's position and pace live in a ``ReplayClock``. Clients can pause,
+resume, change speed, seek to a date or burst the rest of the month with
+control messages on the socket; a subscriber that does so moves to a private
+group so the others keep their schedule. All clocks are driven by the same
+wheel, so a faster stream just gets scheduled fewer slots ahead.
+
+With ``?protocol=delta`` the per-tick frames drop everything static: a header
+message carries the session, month, symbol and date dictionaries once, and each
+tick is just the date index and the scaled integer price change of every
+symbol. A stream falls back to a key frame of absolute prices whenever it does
+not continue from the previous date (start, resume, seek).
+
+The last date delivered to each session is checkpointed to
+``SessionSelection.current_date`` by ``CursorCheckpointer``: sockets record it
+in memory and a background task writes all changed cursors in one batched
+UPDATE every few seconds, so a reconnect can resume where the stream stopped.
+"""
+import asyncio
+import calendar
+import datetime
+import json
+import logging
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket
+
+from app import crud
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+from app.price_cache import PriceSeries
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: ?encoding=msgpack is rejected without it
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+Frame = Union[str, bytes]
+
+
+def dumps(obj) -> str:
+    """Compact JSON text, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+class JsonEncoding:
+    """Frames as JSON text messages."""
+
+    name = "json"
+    binary = False
+
+    def message(self, obj: dict) -> str:
+        return dumps(obj)
+
+    def prefix(self, session_id: str) -> str:
+        return '{"session_id":%s,' % dumps(session_id)
+
+    def body(self, fields: dict) -> str:
+        # The members of the object without its braces, ready to sit between prefix and suffix
+        return dumps(fields)[1:-1] + ","
+
+    def suffix(self, timestamp: str) -> str:
+        return '"timestamp":%s}' % dumps(timestamp)
+
+
+class MsgpackEncoding:
+    """Frames as binary MessagePack maps with the same keys as the JSON frames."""
+
+    name = "msgpack"
+    binary = True
+
+    def message(self, obj: dict) -> bytes:
+        return msgpack.packb(obj)
+
+    def prefix(self, session_id: str) -> bytes:
+        # A frame is a five-entry map: session_id, three body fields and timestamp
+        return b"\x85" + msgpack.packb("session_id") + msgpack.packb(session_id)
+
+    def body(self, fields: dict) -> bytes:
+        return b"".join(msgpack.packb(key) + msgpack.packb(value) for key, value in fields.items())
+
+    def suffix(self, timestamp: str) -> bytes:
+        return msgpack.packb("timestamp") + msgpack.packb(timestamp)
+
+
+ENCODINGS = {"json": JsonEncoding()}
+if msgpack is not None:
+    ENCODINGS["msgpack"] = MsgpackEncoding()
+
+# Delta frames carry prices as integers in units of 1/DELTA_SCALE
+DELTA_SCALE = 10000
+
+
+class FullFrames:
+    """Self-describing frames: session, date, every price with its date and stream progress."""
+
+    name = "full"
+
+    def prefix(self, encoding, session_id: str) -> Frame:
+        return encoding.prefix(session_id)
+
+    def frame(self, timeline: "PriceTimeline", encoding, index: int, sent: Optional[int]) -> Frame:
+        return timeline.bodies(encoding)[index] + encoding.suffix(datetime.datetime.now().isoformat())
+
+
+class DeltaFrames:
+    """Compact frames of price changes against a header sent once per stream."""
+
+    name = "delta"
+
+    def prefix(self, encoding, session_id: str) -> Frame:
+        return b"" if encoding.binary else ""
+
+    def frame(self, timeline: "PriceTimeline", encoding, index: int, sent: Optional[int]) -> Frame:
+        # Only a stream that just sent the previous date can apply changes; anything else gets a key frame
+        return timeline.delta_bodies(encoding, key=sent != index - 1)[index]
+
+    def header(self, timeline: "PriceTimeline", session_id: str) -> dict:
+        return {
+            "type": "header",
+            "session_id": session_id,
+            "month": calendar.month_name[timeline.month],
+            "year": timeline.year,
+            "total_dates": len(timeline),
+            "symbols": list(timeline.symbols),
+            "dates": [day.isoformat() for day in timeline.dates],
+            "scale": DELTA_SCALE,
+        }
+
+
+PROTOCOLS = {"full": FullFrames(), "delta": DeltaFrames()}
+
+
+class PriceTimeline:
+    """The trading days of one month and the prices of each selected symbol on them."""
+
+    __slots__ = ("month", "year", "symbols", "series", "dates", "prices", "_bodies")
+
+    def __init__(self, month: int, year: int, symbols: Tuple[str, ...], series: Dict[str, PriceSeries]):
+        self.month = month
+        self.year = year
+        self.symbols = symbols
+        self.series = series
+        self._bodies: Dict[object, List[Frame]] = {}
+        available = {symbol: s for symbol, s in series.items() if len(s)}
+        self.dates: List[datetime.date] = sorted(set().union(*(s.dates for s in available.values())))
+        self.prices: List[List[dict]] = []
+        for day in self.dates:
+            day_prices = []
+            for symbol in symbols:
+                s = available.get(symbol)
+                position = s.position(day) if s else None
+                if position is not None:
+                    day_prices.append({
+                        "symbol": symbol,
+                        "price": s.prices[position],
+                        "date": day.isoformat(),
+                        "timestamp": s.timestamps[position].isoformat()
+                    })
+            self.prices.append(day_prices)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def scaled(self) -> List[List[Optional[int]]]:
+        """Prices per date as integers in 1/DELTA_SCALE units, one column per symbol (None without a price)."""
+        rows = []
+        for day_prices in self.prices:
+            by_symbol = {entry["symbol"]: entry["price"] for entry in day_prices}
+            rows.append([
+                round(by_symbol[symbol] * DELTA_SCALE) if symbol in by_symbol else None
+                for symbol in self.symbols
+            ])
+        return rows
+
+    def delta_bodies(self, encoding, key: bool) -> List[Frame]:
+        """
+        Return compact per-date frames, rendering them on first use.
+        Key frames {"i": index, "p": [price, ...]} carry absolute scaled prices; delta frames
+        {"i": index, "d": [change, ...]} carry the change from the previous date, or the absolute
+        price for a symbol that had none on the previous date.
+        """
+        cache_key = (encoding.name, "key" if key else "delta")
+        bodies = self._bodies.get(cache_key)
+        if bodies is None:
+            rows = self.scaled()
+            if key:
+                bodies = [encoding.message({"i": index, "p": row}) for index, row in enumerate(rows)]
+            else:
+                bodies = []
+                previous = [None] * len(self.symbols)
+                for index, row in enumerate(rows):
+                    changes = [
+                        value if value is None or before is None else value - before
+                        for value, before in zip(row, previous)
+                    ]
+                    bodies.append(encoding.message({"i": index, "d": changes}))
+                    previous = row
+            self._bodies[cache_key] = bodies
+        return bodies
+
+    def bodies(self, encoding) -> List[Frame]:
+        """Return the encoded static part of every date's frame, rendering them on first use."""
+        bodies = self._bodies.get(encoding.name)
+        if bodies is None:
+            month_name = calendar.month_name[self.month]
+            bodies = self._bodies[encoding.name] = [
+                encoding.body({
+                    "current_date": day.isoformat(),
+                    "prices": day_prices,
+                    "stream_info": {
+                        "date_index": index + 1,
+                        "total_dates": len(self.dates),
+                        "month": month_name,
+                        "year": self.year
+                    }
+                })
+                for index, (day, day_prices) in enumerate(zip(self.dates, self.prices))
+            ]
+        return bodies
+
+
+class Subscription:
+    """
+    One socket receiving a stream. The hub queues (date index, frame tail) pairs; the socket's
+    own handler drains ``frames`` whenever ``ready`` resolves and stops once ``complete`` is set.
+    """
+
+    __slots__ = ("websocket", "send", "prefix", "group", "frames", "ready", "complete", "error")
+
+    def __init__(self, websocket: WebSocket, session_id: str, encoding, protocol):
+        self.websocket = websocket
+        self.send = websocket.send_bytes if encoding.binary else websocket.send_text
+        self.prefix = protocol.prefix(encoding, session_id)
+        self.group: Optional["StreamGroup"] = None
+        self.frames: Deque[Tuple[int, Frame]] = deque()
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.complete = False
+        self.error: Optional[BaseException] = None
+
+    def push(self, index: int, tail: Frame):
+        self.frames.append((index, tail))
+        self._wake()
+
+    def finish(self, error: Optional[BaseException] = None):
+        if not self.complete:
+            self.complete = True
+            self.error = error
+            self._wake()
+
+    def rearm(self):
+        """Replace a resolved ``ready`` future before waiting again."""
+        if self.ready.done():
+            self.ready = asyncio.get_running_loop().create_future()
+
+    def _wake(self):
+        if not self.ready.done():
+            self.ready.set_result(None)
+
+
+class ReplayClock:
+    """
+    Replay position and pace of a group: next date index, speed multiplier, pause flag, due slot
+    and the index of the last frame sent (so delta frames know whether they continue from it).
+    """
+
+    __slots__ = ("index", "speed", "paused", "due", "sent")
+
+    def __init__(self, index: int = 0, speed: float = 1.0, paused: bool = False, sent: Optional[int] = None):
+        self.index = index
+        self.speed = speed
+        self.paused = paused
+        self.due: Optional[int] = None
+        self.sent = sent
+
+    def interval(self, slots_per_tick: int) -> int:
+        """Wheel slots between frames at the current speed."""
+        return max(1, round(slots_per_tick / self.speed))
+
+    def state(self) -> dict:
+        return {"date_index": self.index + 1, "speed": self.speed, "paused": self.paused}
+
+
+class StreamGroup:
+    """Subscribers that receive the same frames at the same ticks."""
+
+    __slots__ = ("key", "timeline", "encoding", "protocol", "subscribers", "clock")
+
+    def __init__(self, key: tuple, timeline: PriceTimeline, encoding, protocol,
+                 clock: Optional[ReplayClock] = None):
+        self.key = key
+        self.timeline = timeline
+        self.encoding = encoding
+        self.protocol = protocol
+        self.subscribers: Set[Subscription] = set()
+        self.clock = clock or ReplayClock()
+
+
+class PriceStreamHub:
+    """Timer wheel that ticks every active price stream group."""
+
+    # Accepted replay speed multipliers; the fastest pace is one frame per wheel slot
+    MIN_SPEED = 0.1
+    CONTROL_ACTIONS = ("pause", "resume", "speed", "seek", "burst")
+
+    def __init__(self, tick_seconds: float = 10.0, slots_per_tick: int = 10, max_timelines: int = 256,
+                 max_backlog: int = 4):
+        self.tick_seconds = tick_seconds
+        self.max_backlog = max_backlog
+        self.slots_per_tick = slots_per_tick
+        self.max_timelines = max_timelines
+        self._timelines: "OrderedDict[tuple, PriceTimeline]" = OrderedDict()
+        self._wheel: Dict[int, List[StreamGroup]] = defaultdict(list)
+        self._joinable: Dict[tuple, StreamGroup] = {}
+        self._groups: Set[StreamGroup] = set()
+        self._slot = 0
+        self._task: Optional[asyncio.Task] = None
+        self.timelines_built = 0
+        self.frames_queued = 0
+        self.bytes_queued = 0
+        self.dropped_subscribers = 0
+        self.controls = 0
+
+    def timeline(self, month: int, year: int, symbols: Tuple[str, ...],
+                 series: Dict[str, PriceSeries]) -> PriceTimeline:
+        """Return the shared timeline for a month, rebuilding it if the cached price series changed."""
+        key = (year, month, symbols)
+        timeline = self._timelines.get(key)
+        if timeline is None or any(timeline.series.get(symbol) is not s for symbol, s in series.items()):
+            timeline = self._timelines[key] = PriceTimeline(month, year, symbols, series)
+            self.timelines_built += 1
+            while len(self._timelines) > self.max_timelines:
+                self._timelines.popitem(last=False)
+        self._timelines.move_to_end(key)
+        return timeline
+
+    def subscribe(self, websocket: WebSocket, session_id: str, timeline: PriceTimeline,
+                  encoding=ENCODINGS["json"], start_index: int = 0, protocol=PROTOCOLS["full"]) -> Subscription:
+        """Add a socket to the group that starts streaming from `start_index` at the next wheel slot."""
+        start = self._slot + 1
+        key = (timeline.year, timeline.month, timeline.symbols, encoding.name, protocol.name, start_index, start)
+        group = self._joinable.get(key)
+        if group is None:
+            group = self._joinable[key] = StreamGroup(key, timeline, encoding, protocol, ReplayClock(start_index))
+            self._groups.add(group)
+            self._schedule(group, start)
+
+        subscription = Subscription(websocket, session_id, encoding, protocol)
+        subscription.group = group
+        group.subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        group = subscription.group
+        if group is None:
+            return
+        subscription.group = None
+        group.subscribers.discard(subscription)
+        if not group.subscribers:
+            self._drop(group)
+
+    def control(self, subscription: Subscription, message: dict) -> dict:
+        """
+        Apply a client control message to a subscriber's replay clock and return the new clock state.
+        Messages are {"action": "pause" | "resume" | "burst"}, {"action": "speed", "speed": 4}
+        or {"action": "seek", "date": "2025-07-15"}. Raises ValueError for invalid messages.
+        """
+        action = message.get("action")
+        if action not in self.CONTROL_ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+        if subscription.group is None or subscription.complete:
+            raise ValueError("The stream has ended")
+
+        timeline = subscription.group.timeline
+        if action == "speed":
+            speed = message.get("speed")
+            max_speed = float(self.slots_per_tick)
+            if isinstance(speed, bool) or not isinstance(speed, (int, float)) \
+                    or not self.MIN_SPEED <= speed <= max_speed:
+                raise ValueError(f"speed must be a number between {self.MIN_SPEED} and {max_speed:g}")
+        elif action == "seek":
+            try:
+                day = datetime.date.fromisoformat(message.get("date"))
+            except (TypeError, ValueError):
+                raise ValueError("date must be an ISO date")
+            index = bisect_left(timeline.dates, day)
+            if index >= len(timeline):
+                raise ValueError("date is after the last trading day of the stream")
+
+        # A subscriber that steers its replay leaves any shared group
+        group = self._detach(subscription)
+        clock = group.clock
+        self.controls += 1
+        if action == "pause":
+            clock.paused = True
+            clock.due = None
+        elif action == "resume":
+            clock.paused = False
+            self._schedule(group, self._slot + 1)
+        elif action == "speed":
+            clock.speed = float(speed)
+            if not clock.paused:
+                self._schedule(group, self._slot + clock.interval(self.slots_per_tick))
+        elif action == "seek":
+            clock.index = index
+            if not clock.paused:
+                self._schedule(group, self._slot + 1)
+        else:
+            self._burst(group)
+        return {"action": action, **clock.state()}
+
+    def stats(self) -> dict:
+        return {
+            "groups": len(self._groups),
+            "subscribers": sum(len(group.subscribers) for group in self._groups),
+            "timelines_cached": len(self._timelines),
+            "timelines_built": self.timelines_built,
+            "frames_queued": self.frames_queued,
+            "bytes_queued": self.bytes_queued,
+            "dropped_subscribers": self.dropped_subscribers,
+            "controls": self.controls,
+        }
+
+    def _drop(self, group: StreamGroup):
+        self._groups.discard(group)
+        if self._joinable.get(group.key) is group:
+            del self._joinable[group.key]
+
+    def _schedule(self, group: StreamGroup, slot: int):
+        # Earlier wheel entries for the group are skipped because their slot no longer matches `due`
+        group.clock.due = slot
+        self._wheel[slot].append(group)
+
+    def _detach(self, subscription: Subscription) -> StreamGroup:
+        group = subscription.group
+        if len(group.subscribers) == 1 and self._joinable.get(group.key) is not group:
+            return group
+        old = group.clock
+        private = StreamGroup(("private", id(subscription)), group.timeline, group.encoding, group.protocol,
+                              ReplayClock(old.index, old.speed, old.paused, old.sent))
+        self.unsubscribe(subscription)
+        subscription.group = private
+        private.subscribers.add(subscription)
+        self._groups.add(private)
+        if old.due is not None:
+            self._schedule(private, old.due)
+        return private
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        slot_seconds = self.tick_seconds / self.slots_per_tick
+        origin = loop.time() - self._slot * slot_seconds
+        while self._groups:
+            self._slot += 1
+            delay = origin + self._slot * slot_seconds - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            for group in self._wheel.pop(self._slot, ()):
+                if group in self._groups and group.clock.due == self._slot:
+                    self._tick(group)
+        self._wheel.clear()
+
+    def _tick(self, group: StreamGroup):
+        # The group has started, so later subscribers form a new one
+        if self._joinable.get(group.key) is group:
+            del self._joinable[group.key]
+
+        clock = group.clock
+        clock.due = None
+        if not self._emit(group, check_backlog=True):
+            self._schedule(group, self._slot + clock.interval(self.slots_per_tick))
+
+    def _burst(self, group: StreamGroup):
+        # Queue every remaining frame at once; the socket drains them as fast as it can
+        group.clock.due = None
+        while not self._emit(group, check_backlog=False):
+            pass
+
+    def _emit(self, group: StreamGroup, check_backlog: bool) -> bool:
+        """Queue the frame at the group's clock position; returns True once the stream is complete."""
+        clock = group.clock
+        index = clock.index
+        tail = group.protocol.frame(group.timeline, group.encoding, index, clock.sent)
+        clock.sent = index
+        clock.index += 1
+        last = clock.index >= len(group.timeline)
+        if last:
+            self._groups.discard(group)
+        for subscription in list(group.subscribers):
+            if check_backlog and len(subscription.frames) >= self.max_backlog:
+                # The socket has not drained its recent frames; drop it rather than buffer the month
+                self.dropped_subscribers += 1
+                self.unsubscribe(subscription)
+                subscription.finish(RuntimeError("Subscriber fell behind the price stream"))
+                continue
+            subscription.push(index, tail)
+            self.frames_queued += 1
+            self.bytes_queued += len(subscription.prefix) + len(tail)
+            if last:
+                subscription.finish()
+        return last
+
+
+class CursorCheckpointer:
+    """Write-behind store of the last date streamed to each session (SessionSelection.current_date)."""
+
+    def __init__(self, session_factory, flush_seconds: float = 5.0):
+        self.session_factory = session_factory
+        self.flush_seconds = flush_seconds
+        self._pending: Dict[uuid.UUID, datetime.date] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_errors = 0
+
+    def record(self, session_id: uuid.UUID, day: datetime.date):
+        """Remember a session's cursor; only the latest one per session is written."""
+        self._pending[session_id] = day
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def cursor(self, session_id: uuid.UUID) -> Optional[datetime.date]:
+        """Return a cursor recorded in this worker that has not been written yet."""
+        return self._pending.get(session_id)
+
+    async def flush(self):
+        """Write every pending cursor in one batched UPDATE."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            async with self.session_factory() as db:
+                await crud.update_selection_cursors(db, batch)
+        except BaseException as e:
+            # Retry on the next flush unless the session has moved on since
+            for session_id, day in batch.items():
+                self._pending.setdefault(session_id, day)
+            if not isinstance(e, Exception):
+                raise
+            self.flush_errors += 1
+            logger.warning("Failed to write %d stream cursors: %s", len(batch), e)
+            return
+        self.flushes += 1
+        self.rows_written += len(batch)
+
+    async def close(self):
+        """Stop the background writer and write what is left, e.g. on shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "flush_errors": self.flush_errors,
+        }
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+
+# Shared instances used by the WebSocket router
+price_stream_hub = PriceStreamHub(
+    tick_seconds=settings.PRICE_STREAM_TICK_SECONDS,
+    slots_per_tick=settings.PRICE_STREAM_SLOTS_PER_TICK
+)
+stream_cursors = CursorCheckpointer(AsyncSessionLocal, flush_seconds=settings.STREAM_CURSOR_FLUSH_SECONDS)
@@ -0,0 +1,209 @@
+"""
+Batch rescoring of ended sessions.
+
+After a change to the scoring rules, an admin can start a rescoring job. The job
+streams trades for every ended session through a server-side cursor in chunks,
+scores complete sessions in a process pool with the columnar scoring engine,
+and writes the scores and unsold shares back with multi-row statements. Progress
+and throughput can be polled while it runs.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import crud, models, scoring
+
+logger = logging.getLogger(__name__)
+
+
+class RescoreJob:
+    """State and progress of one rescoring run"""
+
+    def __init__(self, admin_login: str = None):
+        self.job_id = str(uuid.uuid4())
+        self.admin_login = admin_login
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.sessions_total = 0
+        self.sessions_done = 0
+        self.trades_processed = 0
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._started_clock: Optional[float] = None
+        self._finished_clock: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None  # Keeps the background task referenced
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def progress(self) -> dict:
+        elapsed = 0.0
+        if self._started_clock is not None:
+            elapsed = (self._finished_clock or time.monotonic()) - self._started_clock
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "admin_login": self.admin_login,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "sessions_total": self.sessions_total,
+            "sessions_done": self.sessions_done,
+            "trades_processed": self.trades_processed,
+            "percent_complete": round(100.0 * self.sessions_done / self.sessions_total, 1) if self.sessions_total else 0.0,
+            "elapsed_seconds": round(elapsed, 3),
+            "sessions_per_second": round(self.sessions_done / elapsed, 1) if elapsed else 0.0,
+            "trades_per_second": round(self.trades_processed / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+# Jobs started in this worker, by job_id
+jobs: Dict[str, RescoreJob] = {}
+
+
+def active_job() -> Optional[RescoreJob]:
+    return next((job for job in jobs.values() if job.running), None)
+
+
+async def run_rescore_job(job: RescoreJob, session_factory: async_sessionmaker,
+                          chunk_size: int = 5000, max_workers: Optional[int] = None):
+    """
+    Rescore every ended session.
+    max_workers=0 scores in-process instead of in a process pool.
+    """
+    job.status = "running"
+    job.started_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    job._started_clock = time.monotonic()
+    pool = ProcessPoolExecutor(max_workers=max_workers) if max_workers != 0 else None
+    loop = asyncio.get_running_loop()
+
+    async def score(batch):
+        if pool is None:
+            return scoring.score_sessions(batch)
+        return await loop.run_in_executor(pool, scoring.score_sessions, batch)
+
+    try:
+        async with session_factory() as read_db, session_factory() as write_db:
+            result = await read_db.execute(
+                select(models.Session.session_id, models.Session.player_id)
+                .filter(models.Session.status == "ended")
+            )
+            players = dict(result.all())
+            job.sessions_total = len(players)
+            logger.info("Rescore job %s: %d ended sessions", job.job_id, job.sessions_total)
+
+            stream = await read_db.stream(
+                select(models.Trade.session_id, models.Session.player_id, models.Trade.symbol,
+                       models.Trade.action, models.Trade.qty, models.Trade.price)
+                .join(models.Session, models.Session.session_id == models.Trade.session_id)
+                .filter(models.Session.status == "ended")
+                .order_by(models.Trade.session_id, models.Trade.timestamp, models.Trade.trade_id)
+                .execution_options(yield_per=chunk_size)
+            )
+
+            # Sessions are contiguous in the stream; the last one of a chunk may continue in the next
+            pending: Dict[uuid.UUID, tuple] = {}
+            unseen = set(players)
+            try:
+                async for rows in stream.partitions(chunk_size):
+                    for session_id, player_id, symbol, action, qty, price in rows:
+                        columns = pending.get(session_id)
+                        if columns is None:
+                            columns = pending[session_id] = ([], [], [], [])
+                            # Sessions that ended after the snapshot query are scored too
+                            if session_id not in players:
+                                players[session_id] = player_id
+                                job.sessions_total += 1
+                        columns[0].append(symbol)
+                        columns[1].append(action)
+                        columns[2].append(qty)
+                        columns[3].append(price)
+                    job.trades_processed += len(rows)
+                    unseen.difference_update(pending)
+
+                    last_session_id = rows[-1][0]
+                    carry = pending.pop(last_session_id)
+                    if pending:
+                        outcomes = await score(pending)
+                        await _write_scores(write_db, outcomes, players)
+                        job.sessions_done += len(outcomes)
+                    pending = {last_session_id: carry}
+            finally:
+                # Release the cursor even when a chunk fails, so the connection goes back to the pool clean
+                await stream.close()
+
+            if pending:
+                outcomes = await score(pending)
+                await _write_scores(write_db, outcomes, players)
+                job.sessions_done += len(outcomes)
+
+            # Ended sessions without any trades score zero
+            empty = sorted(unseen)
+            for start in range(0, len(empty), chunk_size):
+                chunk = {session_id: ([], [], [], []) for session_id in empty[start:start + chunk_size]}
+                await _write_scores(write_db, scoring.score_sessions(chunk), players)
+                job.sessions_done += len(chunk)
+
+            await crud.rebuild_player_stats(write_db)
+
+        job.status = "completed"
+    except Exception as e:
+        logger.error("Rescore job %s failed: %s", job.job_id, e, exc_info=True)
+        job.status = "failed"
+        job.error = str(e)
+        # Chunks written before the failure are committed; bring the leaderboard in line with them
+        try:
+            async with session_factory() as db:
+                await crud.rebuild_player_stats(db)
+        except Exception as rebuild_error:
+            logger.error("Rescore job %s could not rebuild player stats: %s", job.job_id, rebuild_error)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        job.finished_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        job._finished_clock = time.monotonic()
+        logger.info("Rescore job %s %s: %s", job.job_id, job.status, job.progress())
+
+
+async def _write_scores(db: AsyncSession, outcomes: Dict[uuid.UUID, scoring.ScoreResult], players: Dict[uuid.UUID, int]):
+    """Replace the scores and unsold shares of a batch of sessions in one transaction"""
+    session_ids = list(outcomes)
+    await db.execute(delete(models.UnsoldShare).where(models.UnsoldShare.session_id.in_(session_ids)))
+    await db.execute(delete(models.Score).where(models.Score.session_id.in_(session_ids)))
+
+    now = models.utc_now()
+    score_rows = [
+        {
+            "session_id": session_id,
+            "player_id": players[session_id],
+            "total_trades": outcome.total_trades,
+            "total_profit": outcome.total_profit,
+            "total_score": outcome.total_score,
+            "created_at": now,
+        }
+        for session_id, outcome in outcomes.items()
+    ]
+    unsold_rows = [
+        {
+            "session_id": session_id,
+            "symbol": symbol,
+            "quantity": quantity,
+            "purchase_price": purchase_price,
+            "total_cost": quantity * purchase_price,
+            "created_at": now,
+        }
+        for session_id, outcome in outcomes.items()
+        for symbol, quantity, purchase_price in outcome.unsold
+    ]
+    await db.execute(insert(models.Score), score_rows)
+    if unsold_rows:
+        await db.execute(insert(models.UnsoldShare), unsold_rows)
+    await db.commit()
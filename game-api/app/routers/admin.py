@@ -4,13 +4,24 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from typing import Optional, List
 from datetime import datetime, date
+import asyncio
 import csv
 import io
 import uuid
 
 from app import crud, schemas, models
 from app.core.auth import verify_password, create_signed_cookie, validate_signed_cookie
-from app.core.db import get_db
+from app.core.config import settings
+from app.core.db import get_db, AsyncSessionLocal
+from app.advice import advice_cache
+from app.advice_scheduler import advice_scheduler
+from app.indicators import indicator_cache
+from app.portfolio import portfolios
+from app.price_cache import price_cache
+from app.price_stream import price_stream_hub, stream_cursors
+from app.stock_catalog import stock_catalog
+from app.trade_ingest import trade_ingestor
+from app import rescoring
 
 router = APIRouter()
 
@@ -113,7 +124,8 @@ async def get_sessions_with_filters(
     start_date: Optional[date] = Query(None, description="Filter sessions started from this date"),
     end_date: Optional[date] = Query(None, description="Filter sessions started until this date"),
     limit: Optional[int] = Query(100, description="Maximum number of sessions to return"),
-    offset: Optional[int] = Query(0, description="Number of sessions to skip")
+    offset: Optional[int] = Query(0, description="Number of sessions to skip (prefer cursor)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
 ):
     """Get all sessions with optional filters for admin dashboard"""
     try:
@@ -124,9 +136,16 @@ async def get_sessions_with_filters(
             start_date=start_date,
             end_date=end_date,
             limit=limit,
-            offset=offset
+            offset=offset,
+            cursor=cursor
         )
-        return {"sessions": sessions, "count": len(sessions)}
+        next_cursor = None
+        if limit and len(sessions) == limit:
+            last = sessions[-1]
+            next_cursor = crud.encode_cursor(last["started_at"], last["session_id"])
+        return {"sessions": sessions, "count": len(sessions), "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to fetch sessions")
 
@@ -223,16 +242,11 @@ async def delete_session(
     try:
         session_uuid = uuid.UUID(session_id)
         
-        # Simple implementation - just delete the session
-        result = await db.execute(select(models.Session).filter(models.Session.session_id == session_uuid))
-        session = result.scalar_one_or_none()
-        
-        if not session:
+        # Delete the session and its related rows, keeping the leaderboard aggregate in step
+        deleted = await crud.delete_session(db, session_uuid)
+        if not deleted:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        await db.delete(session)
-        await db.commit()
-        
         # Log the deletion
         ip_address = request.client.host if request.client else None
         await crud.create_audit_log(
@@ -244,12 +258,105 @@ async def delete_session(
         )
         
         return {"message": f"Session {session_id} deleted successfully"}
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid session ID format")
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to delete session")
 
 
+@router.get("/audit-logs")
+async def get_audit_logs(
+    db: AsyncSession = Depends(get_db),
+    admin_auth = Depends(require_admin_auth),
+    admin_login: Optional[str] = Query(None, description="Filter by admin user"),
+    action: Optional[str] = Query(None, description="Filter by action type"),
+    start_date: Optional[datetime] = Query(None, description="Filter from this date"),
+    end_date: Optional[datetime] = Query(None, description="Filter until this date"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum logs to return"),
+    offset: int = Query(0, ge=0, description="Number of logs to skip (prefer cursor)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """Get admin audit logs, newest first"""
+    try:
+        logs = await crud.get_audit_logs(
+            db=db,
+            admin_login=admin_login,
+            action=action,
+            start_date=start_date,
+            end_date=end_date,
+            limit=limit,
+            offset=offset,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    next_cursor = None
+    if len(logs) == limit:
+        next_cursor = crud.encode_cursor(logs[-1].timestamp, logs[-1].id)
+    return {
+        "audit_logs": [schemas.AdminAuditLog.model_validate(log) for log in logs],
+        "count": len(logs),
+        "next_cursor": next_cursor
+    }
+
+
+@router.get("/metrics")
+async def get_metrics(admin_auth = Depends(require_admin_auth)):
+    """Get in-process cache counters and job progress for this worker"""
+    job = rescoring.active_job()
+    return {
+        "price_cache": price_cache.stats(),
+        "indicators": indicator_cache.stats(),
+        "stock_catalog": stock_catalog.stats(),
+        "price_stream": price_stream_hub.stats(),
+        "stream_cursors": stream_cursors.stats(),
+        "trade_ingest": trade_ingestor.stats(),
+        "portfolios": portfolios.stats(),
+        "advice": advice_cache.stats(),
+        "advice_scheduler": advice_scheduler.stats(),
+        "rescore_job": job.progress() if job else None
+    }
+
+
+@router.post("/rescore", status_code=202)
+async def start_rescore(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    admin_auth = Depends(require_admin_auth)
+):
+    """Start a background job that rescores every ended session with the current scoring rules"""
+    if rescoring.active_job():
+        raise HTTPException(status_code=409, detail="A rescoring job is already running")
+
+    job = rescoring.RescoreJob(admin_login=admin_auth["login"])
+    rescoring.jobs[job.job_id] = job
+    job.task = asyncio.create_task(rescoring.run_rescore_job(
+        job, AsyncSessionLocal, chunk_size=settings.RESCORE_CHUNK_SIZE, max_workers=settings.RESCORE_WORKERS
+    ))
+
+    ip_address = request.client.host if request.client else None
+    await crud.create_audit_log(
+        db=db,
+        admin_login=admin_auth["login"],
+        action="rescore_sessions",
+        target_id=job.job_id,
+        ip_address=ip_address
+    )
+    return job.progress()
+
+
+@router.get("/rescore/{job_id}")
+async def get_rescore_job(job_id: str, admin_auth = Depends(require_admin_auth)):
+    """Get progress and throughput of a rescoring job"""
+    job = rescoring.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Rescoring job not found")
+    return job.progress()
+
+
 @router.post("/logout")
 async def logout(response: Response):
     """Logout admin user by clearing session cookie"""
@@ -1,7 +1,7 @@
 from typing import List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import crud, schemas
@@ -20,19 +20,28 @@ async def post_player(player_in: schemas.PlayerCreate, db: AsyncSession = Depend
 
 @router.get("/players", response_model=List[schemas.Player])
 async def list_players(
+    response: Response,
     db: AsyncSession = Depends(get_db),
     nickname: Optional[str] = Query(None, description="Filter players by nickname (case-insensitive partial match)"),
     limit: Optional[int] = Query(None, ge=1, le=100, description="Maximum number of players to return"),
-    offset: int = Query(0, ge=0, description="Number of players to skip")
+    offset: int = Query(0, ge=0, description="Number of players to skip"),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page")
 ):
     """
     Get all players with optional filtering.
     
     - **nickname**: Filter by nickname (case-insensitive partial match)
     - **limit**: Maximum number of players to return (1-100)
-    - **offset**: Number of players to skip for pagination
+    - **offset**: Number of players to skip for pagination (prefer cursor)
+    - **cursor**: Keyset cursor; the next page's cursor is returned in the `X-Next-Cursor` header
     """
-    return await crud.get_players(db, nickname=nickname, limit=limit, offset=offset)
+    try:
+        players = await crud.get_players(db, nickname=nickname, limit=limit, offset=offset, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if limit and len(players) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_cursor(players[-1].id)
+    return players
 
 
 @router.get("/player/{player_id}", response_model=schemas.Player)
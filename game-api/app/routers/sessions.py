@@ -1,19 +1,15 @@
-from datetime import date
+from typing import AsyncIterator, Literal
 from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, schemas
+from app import advice, crud, rule_advisor, schemas
 from app.core.db import get_db
-from app.core.config import settings
-import json
-import ollama
-from langchain.prompts import PromptTemplate
+from app.indicators import indicator_cache
+from app.portfolio import TradeRejected, portfolios
 import logging
-import traceback
-from langchain_ollama import ChatOllama
-from pydantic import BaseModel
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -44,36 +40,42 @@ async def modify_session(session_id: UUID, session_upd: schemas.SessionUpdate, d
     updated = await crud.update_session(db, session_id, session_upd)
     if not updated:
         raise HTTPException(status_code=404, detail="Session not found")
+    # The balance or status may have changed; hydrate the portfolio again on the next trade
+    portfolios.discard(session_id)
     return updated
 
 @router.post("/sessions/{session_id}/end", response_model=schemas.Score)
 async def end_session(session_id: UUID, db: AsyncSession = Depends(get_db)):
-    """End a session by marking it as ended."""
-    session = await crud.get_session(db, session_id)
-    if not session:
+    """End a session by marking it as ended and scoring it, in one transaction. Repeated calls are idempotent."""
+    portfolio = portfolios.peek(session_id)
+    try:
+        if portfolio is None:
+            score = await crud.calculate_score(db, session_id, mark_ended=True)
+        else:
+            # Finalize the live score; holding the portfolio keeps trades out until the session has ended
+            async with portfolio.lock:
+                score = await crud.calculate_score(db, session_id, mark_ended=True,
+                                                   running=portfolio.score.result())
+    except ValueError:
         raise HTTPException(status_code=404, detail="Session not found")
+    portfolios.discard(session_id)
+    return score
 
-    # Update the session status to ended
-    session.status = "ended"
-    
-    # Set the ended timestamp (timezone-naive for PostgreSQL)
-    from datetime import datetime, timezone
-    session.ended_at = datetime.now(timezone.utc).replace(tzinfo=None)
-    
-    await db.commit()
-    await db.refresh(session)
-    
-    # Calculate and store the score
-    db_score = await crud.calculate_score(db, session_id)
 
-    return db_score
+@router.get("/sessions/{session_id}/score/live", response_model=schemas.LiveScore)
+async def get_live_score(session_id: UUID):
+    """Get the session's score so far, kept up to date as its trades are recorded"""
+    try:
+        portfolio = await portfolios.get(session_id)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    except TradeRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return portfolio.live_score()
 
 
-@router.post("/sessions/{session_id}/advise")
-async def advise_player(session_id: UUID, db: AsyncSession = Depends(get_db)):
-    """
-    Provide buy/sell/hold advice for the current session using stock price history.
-    """
+async def _advice_inputs(db: AsyncSession, session_id: UUID):
+    """Return the selected symbols, their indicators and the session's trades for advice."""
     session = await crud.get_session(db, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found.")
@@ -82,143 +84,69 @@ async def advise_player(session_id: UUID, db: AsyncSession = Depends(get_db)):
     if not selection:
         raise HTTPException(status_code=400, detail="No stocks selected yet.")
 
-    first_day = date(selection.year, selection.month, 1)
-    # We need to get data for all selected stocks
+    # We need indicators for all selected stocks, computed together from the cached price series
     symbols = [selection.popular_symbol, selection.volatile_symbol, selection.sector_symbol]
-    game_data = {}
-    
-    import calendar
-    last_day_of_month = calendar.monthrange(selection.year, selection.month)[1]
-    last_day = date(selection.year, selection.month, last_day_of_month)
-    
-    N = 5
-    for symbol in symbols:
-        prices = await crud.get_stock_prices(db, symbol, first_day, last_day)
-        recent_prices = prices[-N:]  # Last N entries only
-        game_data[symbol] = [{"date": p.date.isoformat(), "price": p.price} for p in recent_prices]
+    stock_data = await indicator_cache.get_months(db, symbols, selection.year, selection.month)
 
-    if not game_data:
+    if not any(indicators["days"] for indicators in stock_data.values()):
         raise HTTPException(status_code=500, detail="Price history missing for selected tickers.")
 
-    trades = await crud.get_trades(db, session_id)
-    
-    # Convert Trade objects to dictionaries for JSON serialization
+    # Only what the advice depends on, in time order, so sessions with the same prices and trades share advice
     trades_data = [
-        {
-            "trade_id": trade.trade_id,
-            "session_id": str(trade.session_id),
-            "timestamp": trade.timestamp.isoformat(),
-            "symbol": trade.symbol,
-            "action": trade.action,
-            "qty": trade.qty,
-            "price": trade.price
-        }
-        for trade in trades
+        {"symbol": trade.symbol, "action": trade.action, "qty": trade.qty, "price": trade.price}
+        for trade in await crud.get_trade_history(db, session_id)
     ]
+    return symbols, stock_data, trades_data
 
-    llm = ChatOllama(
-        model="qwen3:latest",
-        base_url=settings.OLLAMA_BASE_URL,
-        temperature=0,
-        top_p=0.9,
-        num_ctx=2048,
-        num_predict=256,
-        format="json"
-    )
-    
-    # Create parser based on the schema
-    structured_llm  = llm.with_structured_output(schemas.TradingAdviceResponse)
-    
-    prompt_template = PromptTemplate(
-        input_variables=["symbols", "cutoff_date", "stock_data", "trades_data"],
-        template="""You are a financial trading assistant in a stock simulation game, and your cutoff date is one day before of {cutoff_date}.
-Your task: For each of these 3 stocks ({symbols}), choose one action (BUY, SELL, HOLD) and give a short reason.
-Plan ahead for the next trading day, considering the current market conditions and the player's trades history.
-Base your advice on the player's trade history, recent price movements, and day trading strategy, with the goal to maximize profit. Do not include disclaimers.
-Stock data for analysis:
-{stock_data}
-Player's trade history:
-{trades_data}"""
-    )
-    
-    # Create the chain
-    chain = prompt_template | structured_llm 
 
-    import asyncio
-    try:
-        # Prepare prompt input
-        prompt_input = {
-            "symbols": ', '.join(symbols),
-            "cutoff_date": session.started_at.isoformat(),
-            "stock_data": json.dumps(game_data, separators=(',', ':')),
-            "trades_data": json.dumps(trades_data, separators=(',', ':')),
-        }
-
-        logger.info("Generated prompt input for LLM:\n%s", prompt_input)
-
-        # Execute the chain with a short timeout (3 seconds)
-        try:
-            result = await asyncio.wait_for(chain.ainvoke(prompt_input, timeout=10), timeout=13)
-        except (asyncio.TimeoutError, asyncio.CancelledError):
-            logger.error("LLM call timed out after 3 seconds.")
-            raise
-
-        # Filter advice to only include selected symbols and ensure all are present
-        selected_set = set(symbols)
-        filtered_advice = []
-        seen = set()
-        for item in result.advice:
-            if item.symbol in selected_set and item.symbol not in seen:
-                filtered_advice.append(item)
-                seen.add(item.symbol)
-
-        # Add missing symbols with HOLD advice
-        for symbol in symbols:
-            if symbol not in seen:
-                filtered_advice.append(
-                    schemas.TradingAdviceItem(
-                        symbol=symbol,
-                        action="HOLD",
-                        reason="No specific advice generated for this symbol. Consider holding."
-                    )
-                )
-        result.advice = filtered_advice
-
-        logger.info("LLM output parsed successfully:\n%s", result)
-
-        # Return the Pydantic model directly (FastAPI will handle serialization)
-        return result
-
-    except (asyncio.TimeoutError, asyncio.CancelledError):
-        logger.error("LLM call timed out or was cancelled. Returning fallback advice immediately.")
-        fallback_advice = [
-            schemas.TradingAdviceItem(
-                symbol=symbol,
-                action="HOLD",
-                reason="Unable to generate AI advice at this time (timeout). Consider holding your position."
-            )
-            for symbol in symbols
-        ]
-        return schemas.TradingAdviceResponse(advice=fallback_advice)
-    except Exception as e:
-        logger.error("LLM generation or parsing failed: %s", str(e))
-        logger.debug("Traceback:\n%s", traceback.format_exc())
-
-        # Try to get raw LLM response (bypassing parser) for inspection
-        try:
-            prompt = await prompt_template.ainvoke(prompt_input)
-            raw_output = await llm.ainvoke(prompt)
-            logger.warning("Raw LLM response (unparsed):\n%s", raw_output)
-        except Exception as raw_err:
-            logger.error("Even raw LLM call failed: %s", raw_err)
-
-        # Fallback response
-        fallback_advice = [
-            schemas.TradingAdviceItem(
-                symbol=symbol,
-                action="HOLD",
-                reason="Unable to generate AI advice at this time. Consider holding your position."
-            )
-            for symbol in symbols
-        ]
-        return schemas.TradingAdviceResponse(advice=fallback_advice)
+@router.post("/sessions/{session_id}/advise", response_model=schemas.TradingAdviceResponse)
+async def advise_player(
+    session_id: UUID,
+    mode: Literal["llm", "rules", "fast"] = "llm",
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Provide buy/sell/hold advice for the current session using stock price history.
+
+    ``llm`` waits for the model (falling back to rule-based advice on timeout or failure), ``rules`` returns
+    rule-based advice only, and ``fast`` returns cached model advice if there is any and rule-based advice
+    otherwise, while the model advice is generated in the background for the next request.
+    """
+    symbols, stock_data, trades_data = await _advice_inputs(db, session_id)
+
+    rule_advice = rule_advisor.advise(symbols, stock_data, trades_data)
+    if mode == "rules":
+        return rule_advice
+
+    prompt_input = advice.prompt_input(symbols, stock_data, trades_data)
+    logger.debug("Generated prompt input for LLM:\n%s", prompt_input)
+    if mode == "fast":
+        cached = advice.advice_cache.prefetch(symbols, prompt_input, fallback=rule_advice, owner=session_id)
+        return cached or rule_advice
+    return await advice.advice_cache.advise(symbols, prompt_input, fallback=rule_advice, owner=session_id)
+
+
+async def _advice_events(items: AsyncIterator[schemas.TradingAdviceItem]):
+    """Server-sent events: one ``advice`` event per item, then ``done`` with the complete advice."""
+    advice_items = []
+    async for item in items:
+        advice_items.append(item)
+        yield f"event: advice\ndata: {item.model_dump_json()}\n\n"
+    yield f"event: done\ndata: {schemas.TradingAdviceResponse(advice=advice_items).model_dump_json()}\n\n"
+
+
+@router.get("/sessions/{session_id}/advise/stream")
+async def stream_advice(session_id: UUID, db: AsyncSession = Depends(get_db)):
+    """
+    Stream advice for the current session as server-sent events, one ``TradingAdviceItem`` per symbol as soon
+    as the model has produced it. Symbols the model leaves out get HOLD at the end, or rule-based advice if the
+    model times out or fails.
+    """
+    symbols, stock_data, trades_data = await _advice_inputs(db, session_id)
+    rule_advice = rule_advisor.advise(symbols, stock_data, trades_data)
+    prompt_input = advice.prompt_input(symbols, stock_data, trades_data)
+    return StreamingResponse(
+        _advice_events(advice.advice_cache.stream(symbols, prompt_input, fallback=rule_advice, owner=session_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,12 +1,15 @@
 import asyncio
-from datetime import datetime
+from datetime import MAXYEAR, datetime
 from typing import List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import crud, schemas
 from app.core.db import get_db
+from app.indicators import indicator_cache
+from app.price_cache import price_cache
+from app.stock_catalog import stock_catalog
 
 router = APIRouter()
 
@@ -24,11 +27,13 @@ async def create_stock(stock_in: schemas.StockCreate, db: AsyncSession = Depends
 
 @router.get("/", response_model=List[schemas.Stock])
 async def list_stocks(
+    response: Response,
     db: AsyncSession = Depends(get_db),
     category: Optional[str] = None,
     sector: Optional[str] = None,
     limit: Optional[int] = None,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None
 ):
     """
     Get all stocks with optional filtering.
@@ -36,9 +41,16 @@ async def list_stocks(
     - **category**: Filter by category (popular, volatile, sector)
     - **sector**: Filter by sector
     - **limit**: Maximum number of stocks to return
-    - **offset**: Number of stocks to skip for pagination
+    - **offset**: Number of stocks to skip for pagination (prefer cursor)
+    - **cursor**: Keyset cursor; the next page's cursor is returned in the `X-Next-Cursor` header
     """
-    return await crud.get_stocks(db, category=category, sector=sector, limit=limit, offset=offset)
+    try:
+        stocks = await crud.get_stocks(db, category=category, sector=sector, limit=limit, offset=offset, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if limit and len(stocks) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_cursor(stocks[-1].symbol)
+    return stocks
 
 
 @router.get("/sectors", response_model=List[str])
@@ -63,7 +75,23 @@ async def get_stock_prices(symbol: str, start_date: str, end_date: str, db: Asyn
     """Get stock prices for a specific symbol within a date range."""
     start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
     end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-    return await crud.get_stock_prices(db, symbol=symbol, start_date=start_date, end_date=end_date)
+    return await price_cache.get_range(db, symbol=symbol, start_date=start_date, end_date=end_date)
+
+
+@router.get("/indicators/{symbol}", response_model=schemas.StockIndicators)
+async def get_stock_indicators(
+    symbol: str,
+    year: int = Query(..., ge=1, le=MAXYEAR),
+    month: int = Query(..., ge=1, le=12),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get technical indicators for a symbol over one month of prices."""
+    if not await stock_catalog.has_symbol(db, symbol):
+        raise HTTPException(status_code=404, detail="Stock not found")
+    indicators = await indicator_cache.get_month(db, symbol, year, month)
+    if not indicators["days"]:
+        raise HTTPException(status_code=404, detail="No prices for this symbol and month")
+    return indicators
 
 
 @router.get("/{symbol}", response_model=schemas.Stock)
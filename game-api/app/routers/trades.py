@@ -1,18 +1,95 @@
+import time
 from typing import List
 from uuid import UUID
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import crud, schemas
+from app.core.config import settings
 from app.core.db import get_db
+from app.portfolio import TradeRejected, portfolios
+from app.trade_ingest import trade_ingestor
 
 router = APIRouter()
 
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+bulk_trades = TypeAdapter(List[schemas.TradeCreate])
+# Generous upper bound on the JSON size of one trade, for rejecting oversized bodies before reading them
+MAX_TRADE_BYTES = 1024
+
 
 @router.post("/trades/", response_model=schemas.Trade)
-async def post_trade(trade_in: schemas.TradeCreate, db: AsyncSession = Depends(get_db)):
-    return await crud.record_trade(db, trade_in)
+async def post_trade(trade_in: schemas.TradeCreate):
+    """
+    Record a trade. The trade is checked against the session's cash and holdings and recorded at the
+    server's price for the session's current market date. Trades are written in batches; the response
+    is sent once the trade's batch has committed. Posting a client_trade_id the session already used
+    returns the recorded trade.
+    """
+    try:
+        return await portfolios.record(trade_in, trade_ingestor.submit)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    except TradeRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Trade references an unknown session or symbol")
+
+
+@router.post("/trades/bulk", response_model=schemas.BulkTradeResult, openapi_extra={"requestBody": {
+    "required": True,
+    "content": {
+        "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/TradeCreate"}}},
+        "application/x-ndjson": {"schema": {"type": "string", "description": "One TradeCreate object per line"}},
+    }
+}})
+async def post_trades_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Record many trades at once, as a JSON array or NDJSON (one trade per line). The whole batch is
+    validated first, in time order against each session's cash and holdings, and recorded in one
+    statement only if every trade is valid. Trades are recorded at the server's price, as single trades
+    are. Trades whose client_trade_id is already recorded are skipped. The response reports how long it took.
+    """
+    started = time.perf_counter()
+    too_large = HTTPException(status_code=413, detail=f"At most {settings.TRADE_BULK_MAX_TRADES} trades per request")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > settings.TRADE_BULK_MAX_TRADES * MAX_TRADE_BYTES:
+        raise too_large
+    body = await request.body()
+    if request.headers.get("content-type", "").split(";")[0].strip() in NDJSON_TYPES:
+        lines = [line for line in body.splitlines() if line.strip()]
+        count = len(lines)
+        body = b"[" + b",".join(lines) + b"]"
+    else:
+        # Trades are flat objects, so the braces bound the number of array elements without parsing
+        count = body.count(b"{")
+    if count > settings.TRADE_BULK_MAX_TRADES:
+        raise too_large
+    try:
+        # One pass in pydantic's core over the whole batch, not a model per trade in Python
+        trades_in = bulk_trades.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+
+    try:
+        result = await portfolios.record_bulk(trades_in, lambda rows: crud.copy_trades(db, rows))
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    except TradeRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Trades conflict with trades recorded meanwhile")
+
+    elapsed = time.perf_counter() - started
+    return {
+        **result,
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "trades_per_second": round(len(trades_in) / elapsed, 1) if elapsed else 0.0
+    }
 
 
 @router.get("/trades/session/{session_id}", response_model=List[schemas.Trade])
@@ -1,10 +1,23 @@
 import asyncio
-from typing import List, Optional
+import json
+from bisect import bisect_right
+from typing import Awaitable, Callable, List, Optional
 import uuid
 from datetime import datetime, date
 import calendar
 
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, schemas
+from app.core.db import AsyncSessionLocal
+from app.portfolio import portfolios
+from app.price_cache import price_cache, month_bounds
+from app.price_stream import ENCODINGS, PROTOCOLS, Subscription, price_stream_hub, stream_cursors
+
+router = APIRouter()
+
+
 async def safe_send_json(websocket: WebSocket, data: dict):
     try:
         await websocket.send_json(data)
@@ -13,23 +26,118 @@ async def safe_send_json(websocket: WebSocket, data: dict):
             pass  # Ignore sending on closed websocket
         else:
             raise
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, schemas
-from app.core.db import AsyncSessionLocal
 
-router = APIRouter()
+async def safe_send_message(websocket: WebSocket, encoding, data: dict):
+    try:
+        if encoding.binary:
+            await websocket.send_bytes(encoding.message(data))
+        else:
+            await websocket.send_text(encoding.message(data))
+    except RuntimeError as e:
+        if 'Cannot call "send" once a close message has been sent.' in str(e):
+            pass  # Ignore sending on closed websocket
+        else:
+            raise
+
+
+async def pump_stream(websocket: WebSocket, subscription: Subscription,
+                      on_message: Optional[Callable[[str], Awaitable[None]]] = None,
+                      on_sent: Optional[Callable[[int], None]] = None):
+    """
+    Send the frames the hub queues for this socket until the stream ends.
+    Client text messages are passed to `on_message`; `on_sent` gets the date index of each sent frame.
+    Returns None when the month is complete or the error that ended it early;
+    raises WebSocketDisconnect when the client goes away first.
+    """
+    receiver = asyncio.ensure_future(websocket.receive_text())
+    try:
+        while True:
+            while subscription.frames:
+                index, tail = subscription.frames.popleft()
+                try:
+                    await subscription.send(subscription.prefix + tail)
+                except Exception as e:
+                    return e
+                if on_sent is not None:
+                    on_sent(index)
+            if subscription.complete:
+                return subscription.error
+            subscription.rearm()
+            await asyncio.wait({receiver, subscription.ready}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                # receive_text raises on disconnect
+                message = receiver.result()
+                receiver = asyncio.ensure_future(websocket.receive_text())
+                if on_message is not None:
+                    await on_message(message)
+    finally:
+        receiver.cancel()
+
+
+async def run_subscription(websocket: WebSocket, encoder, frames, session_uuid: uuid.UUID, session_id: str,
+                           timeline, start_index: int):
+    """Stream a timeline through the hub, answering control messages and checkpointing the cursor."""
+    subscription = price_stream_hub.subscribe(websocket, session_id, timeline, encoder, start_index, frames)
+
+    async def on_control(text: str):
+        # Replay controls: {"action": "pause" | "resume" | "burst" | "speed" | "seek", ...}
+        try:
+            message = json.loads(text)
+            if not isinstance(message, dict):
+                raise ValueError("Control messages must be JSON objects")
+            state = price_stream_hub.control(subscription, message)
+        except ValueError as e:
+            await safe_send_message(websocket, encoder, {"type": "control_error", "error": str(e)})
+            return
+        await safe_send_message(websocket, encoder, {"type": "control", **state})
+
+    def on_sent(index: int):
+        stream_cursors.record(session_uuid, timeline.dates[index])
+        portfolios.advance(session_uuid, timeline.dates[index])
+
+    try:
+        return await pump_stream(websocket, subscription, on_control, on_sent)
+    finally:
+        price_stream_hub.unsubscribe(subscription)
 
 
 @router.websocket("/prices/{session_id}")
-async def stream_prices(websocket: WebSocket, session_id: str):
+async def stream_prices(websocket: WebSocket, session_id: str, encoding: str = "json",
+                        since: Optional[str] = None, protocol: str = "full"):
     """
     Stream historical stock prices for a given session.
     This endpoint provides real-time-like streaming of historical price data
     for the stocks selected in a session.
+    With ?encoding=msgpack every message is a binary MessagePack map instead of JSON text.
+    Clients steer the replay with JSON text control messages, e.g. {"action": "speed", "speed": 5},
+    {"action": "seek", "date": "2025-07-15"}, {"action": "pause"}, {"action": "resume"} or
+    {"action": "burst"} to receive every remaining frame at once.
+    A reconnect resumes after the last date delivered to the session; ?since=YYYY-MM-DD
+    streams the trading days after that date instead.
+    With ?protocol=delta a header message with the static metadata follows the start message,
+    and each tick is a compact {"i": date index, "d": [price changes]} frame (see DeltaFrames).
     """
     await websocket.accept()
-    
+
+    if encoding not in ENCODINGS:
+        await safe_send_json(websocket, {"error": f"Unsupported encoding: {encoding}"})
+        await websocket.close()
+        return
+    encoder = ENCODINGS[encoding]
+    if protocol not in PROTOCOLS:
+        await safe_send_message(websocket, encoder, {"error": f"Unsupported protocol: {protocol}"})
+        await websocket.close()
+        return
+    frames = PROTOCOLS[protocol]
+
+    try:
+        since_date = date.fromisoformat(since) if since is not None else None
+    except ValueError:
+        await safe_send_message(websocket, encoder, {"error": "since must be an ISO date (YYYY-MM-DD)"})
+        await websocket.close()
+        return
+
     try:
         # Convert session_id string to UUID
         session_uuid = uuid.UUID(session_id)
@@ -40,13 +148,13 @@ async def stream_prices(websocket: WebSocket, session_id: str):
                 # Verify the session exists
                 session = await crud.get_session(db, session_uuid)
                 if not session:
-                    await safe_send_json(websocket, {"error": "Session not found"})
+                    await safe_send_message(websocket, encoder, {"error": "Session not found"})
                     return
 
                 # Get the selected stocks for this session
                 selection = await crud.get_selection(db, session_uuid)
                 if not selection:
-                    await safe_send_json(websocket, {"error": "No stock selection found for this session"})
+                    await safe_send_message(websocket, encoder, {"error": "No stock selection found for this session"})
                     return
 
                 # Get the symbols to stream
@@ -59,111 +167,73 @@ async def stream_prices(websocket: WebSocket, session_id: str):
                 # Calculate the date range for the selected month and year
                 month = selection.month
                 year = selection.year
+                first_day, last_day = month_bounds(year, month)
 
-                # Get first and last day of the month
-                first_day = date(year, month, 1)
-                last_day_of_month = calendar.monthrange(year, month)[1]
-                last_day = date(year, month, last_day_of_month)
-
-                # Get all historical prices for the month for all symbols
-                all_historical_data = {}
-                available_dates = set()
-
-                for symbol in symbols:
-                    historical_prices = await crud.get_stock_prices(db, symbol, first_day, last_day)
-                    if historical_prices:
-                        # Convert to dict keyed by date for easy lookup
-                        symbol_data = {}
-                        for price in historical_prices:
-                            price_date = price.date.date()  # Convert datetime to date
-                            symbol_data[price_date] = price
-                            available_dates.add(price_date)
-                        all_historical_data[symbol] = symbol_data
-
-                if not available_dates:
-                    await safe_send_json(websocket, {
-                        "error": f"No historical data available for {calendar.month_name[month]} {year}"
-                    })
-                    return
+                # Get all historical prices for the month for all symbols from the shared cache
+                month_series = await price_cache.get_months(db, symbols, year, month)
+                timeline = price_stream_hub.timeline(month, year, tuple(symbols), month_series)
 
-                # Sort available dates
-                sorted_dates = sorted(available_dates)
-
-                await safe_send_json(websocket, {
-                    "message": f"Starting historical price stream for {calendar.month_name[month]} {year}",
-                    "date_range": {
-                        "start": first_day.isoformat(),
-                        "end": last_day.isoformat()
-                    },
-                    "total_dates": len(sorted_dates),
-                    "symbols": symbols
-                })
-
-                # Stream prices continuously, cycling through historical data
-                for date_index in range(len(sorted_dates)):
-                    try:
-                        current_date = sorted_dates[date_index]
-
-                        # Prepare price data for this date
-                        date_prices = []
-                        for symbol in symbols:
-                            if symbol in all_historical_data and current_date in all_historical_data[symbol]:
-                                price_info = all_historical_data[symbol][current_date]
-                                date_prices.append({
-                                    "symbol": symbol,
-                                    "price": price_info.price,
-                                    "date": current_date.isoformat(),
-                                    "timestamp": price_info.date.isoformat()
-                                })
-
-                        if date_prices:
-                            await safe_send_json(websocket, {
-                                "session_id": session_id,
-                                "current_date": current_date.isoformat(),
-                                "prices": date_prices,
-                                "stream_info": {
-                                    "date_index": date_index + 1,
-                                    "total_dates": len(sorted_dates),
-                                    "month": calendar.month_name[month],
-                                    "year": year
-                                },
-                                "timestamp": datetime.now().isoformat()
-                            })
-
-                        # Small delay to simulate real-time streaming
-                        await asyncio.sleep(10.0)
-
-                    except WebSocketDisconnect:
-                        print(f"WebSocket disconnected during streaming for session {session_id}")
-                        break
-                    except Exception as e:
-                        print(f"Error during streaming: {str(e)}")
-                        await safe_send_json(websocket, {"error": f"Error during streaming: {str(e)}"})
-                        break
-
-                # Send completion message
-                await safe_send_json(websocket, {
-                    "type": "stream_complete",
-                    "message": f"End of historical price stream for {calendar.month_name[month]} {year}",
-                    "date_range": {
-                        "start": first_day.isoformat(),
-                        "end": last_day.isoformat()
-                    },
-                    "total_dates": len(sorted_dates),
-                    "symbols": symbols
-                })
+                # Resume after the checkpointed cursor, preferring one this worker has not written yet
+                if since_date is None:
+                    since_date = stream_cursors.cursor(session_uuid)
+                if since_date is None and selection.current_date is not None:
+                    since_date = selection.current_date.date()
 
             except Exception as e:
                 print(f"Database error: {str(e)}")
-                await safe_send_json(websocket, {"error": f"Database error: {str(e)}"})
-                    
+                await safe_send_message(websocket, encoder, {"error": f"Database error: {str(e)}"})
+                return
+
+        # The database session is released here; the hub streams from the in-memory timeline
+        if not len(timeline):
+            await safe_send_message(websocket, encoder, {
+                "error": f"No historical data available for {calendar.month_name[month]} {year}"
+            })
+            return
+
+        start_index = bisect_right(timeline.dates, since_date) if since_date is not None else 0
+        if start_index < len(timeline):
+            start_message = {
+                "message": f"Starting historical price stream for {calendar.month_name[month]} {year}",
+                "date_range": {
+                    "start": first_day.isoformat(),
+                    "end": last_day.isoformat()
+                },
+                "total_dates": len(timeline),
+                "symbols": symbols
+            }
+            if start_index:
+                start_message["resume_from"] = timeline.dates[start_index].isoformat()
+                start_message["date_index"] = start_index + 1
+            await safe_send_message(websocket, encoder, start_message)
+            if frames.name == "delta":
+                await safe_send_message(websocket, encoder, frames.header(timeline, session_id))
+            error = await run_subscription(websocket, encoder, frames, session_uuid, session_id, timeline,
+                                           start_index)
+            if error is not None:
+                print(f"Error during streaming: {str(error)}")
+                await safe_send_message(websocket, encoder, {"error": f"Error during streaming: {str(error)}"})
+                return
+
+        # Send completion message (also when a resumed stream had nothing left to send)
+        await safe_send_message(websocket, encoder, {
+            "type": "stream_complete",
+            "message": f"End of historical price stream for {calendar.month_name[month]} {year}",
+            "date_range": {
+                "start": first_day.isoformat(),
+                "end": last_day.isoformat()
+            },
+            "total_dates": len(timeline),
+            "symbols": symbols
+        })
+
     except ValueError:
-        await safe_send_json(websocket, {"error": "Invalid session ID format"})
+        await safe_send_message(websocket, encoder, {"error": "Invalid session ID format"})
     except WebSocketDisconnect:
         print(f"WebSocket disconnected for session {session_id}")
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
-        await safe_send_json(websocket, {"error": f"Unexpected error: {str(e)}"})
+        await safe_send_message(websocket, encoder, {"error": f"Unexpected error: {str(e)}"})
     finally:
         try:
             await websocket.close()
@@ -0,0 +1,110 @@
+"""
+Deterministic, rule-based trading advice.
+
+The LLM advisor can take seconds to answer, or not answer at all. This module
+gives BUY/SELL/HOLD advice for the selected symbols from the month's
+indicators (see ``app.indicators``) and the player's open FIFO lots, in
+microseconds and without I/O. It backs three paths of ``/advise``:
+
+* ``mode=rules`` returns it directly;
+* ``mode=fast`` returns it while the LLM advice is generated in the background,
+  so the next request can be served from the advice cache;
+* in ``mode=llm`` it replaces the blanket HOLD returned after an LLM timeout or
+  failure.
+
+Rules for a symbol the player holds, with ``gain`` the return of the last
+price over the average cost of the open lots:
+
+    gain > TAKE_PROFIT_PCT                              -> SELL (top bonus tier)
+    gain > 0 and momentum is down or RSI overbought     -> SELL (take profit)
+    gain < -STOP_LOSS_PCT and momentum is down          -> SELL (cut the loss)
+    otherwise                                           -> HOLD
+
+and for a symbol the player does not hold:
+
+    RSI oversold                                        -> BUY
+    momentum is up and RSI not overbought               -> BUY
+    otherwise                                           -> HOLD
+
+Momentum is up when the last price is above the 10-day EMA and the 5-day SMA
+is not below the 10-day SMA (where the month has enough days for them).
+"""
+from typing import Dict, List, Optional, Tuple
+
+from app import schemas, scoring
+
+# Matches the highest bonus tier of app.scoring (profit > 20% earns 5 points)
+TAKE_PROFIT_PCT = float(scoring.BONUS_THRESHOLDS[-1])
+STOP_LOSS_PCT = 8.0
+RSI_OVERBOUGHT = 70.0
+RSI_OVERSOLD = 30.0
+
+
+def open_positions(trades: List[dict]) -> Dict[str, Tuple[int, float]]:
+    """Return {symbol: (open quantity, average cost)} of the FIFO lots left open by time-ordered trades."""
+    score = scoring.RunningScore()
+    for trade in trades:
+        score.add(trade["symbol"], trade["action"], trade["qty"], trade["price"])
+    positions: Dict[str, Tuple[int, float]] = {}
+    for symbol, qty, price in score.result().unsold:
+        held, cost = positions.get(symbol, (0, 0.0))
+        positions[symbol] = (held + qty, cost + qty * price)
+    return {symbol: (qty, cost / qty) for symbol, (qty, cost) in positions.items()}
+
+
+def _momentum(indicators: dict) -> Optional[bool]:
+    """True for up, False for down, None when there are too few prices to tell."""
+    last, ema = indicators["last_price"], indicators["ema_10"]
+    if last is None or ema is None or indicators["days"] < 2:
+        return None
+    sma_5, sma_10 = indicators["sma_5"], indicators["sma_10"]
+    crossing = sma_5 >= sma_10 if sma_5 is not None and sma_10 is not None else True
+    return last > ema and crossing
+
+
+def advise_symbol(symbol: str, indicators: dict, position: Optional[Tuple[int, float]]) -> schemas.TradingAdviceItem:
+    """Apply the rules to one symbol."""
+    last, rsi = indicators["last_price"], indicators["rsi_14"]
+    if last is None:
+        return schemas.TradingAdviceItem(symbol=symbol, action="HOLD", reason="No price data for this month yet.")
+
+    momentum = _momentum(indicators)
+    trend = "above" if last > indicators["ema_10"] else "below"
+    overbought = rsi is not None and rsi > RSI_OVERBOUGHT
+    oversold = rsi is not None and rsi < RSI_OVERSOLD
+
+    if position:
+        qty, cost = position
+        gain = (last / cost - 1) * 100 if cost else 0.0
+        held = f"You hold {qty} at an average {cost:.2f}, {gain:+.1f}% at {last:.2f}."
+        if gain > TAKE_PROFIT_PCT:
+            return schemas.TradingAdviceItem(
+                symbol=symbol, action="SELL", reason=f"{held} Lock in the gain while it earns the top bonus.")
+        if gain > 0 and (momentum is False or overbought):
+            why = f"RSI {rsi:.0f} is overbought" if overbought else "momentum turned down"
+            return schemas.TradingAdviceItem(symbol=symbol, action="SELL", reason=f"{held} Take profit: {why}.")
+        if gain < -STOP_LOSS_PCT and momentum is False:
+            return schemas.TradingAdviceItem(
+                symbol=symbol, action="SELL", reason=f"{held} Cut the loss; momentum is still down.")
+        return schemas.TradingAdviceItem(
+            symbol=symbol, action="HOLD", reason=f"{held} Price is {trend} its 10-day EMA; keep the position.")
+
+    month = indicators["return_pct"] or 0.0
+    if oversold:
+        return schemas.TradingAdviceItem(
+            symbol=symbol, action="BUY", reason=f"RSI {rsi:.0f} is oversold at {last:.2f}; a rebound is likely.")
+    if momentum and not overbought:
+        return schemas.TradingAdviceItem(
+            symbol=symbol, action="BUY",
+            reason=f"Uptrend: {last:.2f} is above its 10-day EMA, {month:+.1f}% this month.")
+    why = f"RSI {rsi:.0f} is overbought" if overbought else f"price is {trend} its 10-day EMA"
+    return schemas.TradingAdviceItem(
+        symbol=symbol, action="HOLD", reason=f"No clear entry: {why}, {month:+.1f}% this month.")
+
+
+def advise(symbols: List[str], indicators: Dict[str, dict], trades: List[dict]) -> schemas.TradingAdviceResponse:
+    """Advice for each selected symbol from its indicators and the player's time-ordered trades."""
+    positions = open_positions(trades)
+    return schemas.TradingAdviceResponse(advice=[
+        advise_symbol(symbol, indicators[symbol], positions.get(symbol)) for symbol in symbols
+    ])
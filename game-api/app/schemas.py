@@ -1,5 +1,5 @@
 from datetime import datetime, date
-from typing import List, Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 from enum import Enum
 
@@ -19,6 +19,14 @@ class PlayerCreate(PlayerBase):
     pass
 
 
+class BulkTradeResult(BaseModel):
+    inserted: int = Field(..., example=5000)
+    duplicates: int = Field(0, description="Trades skipped because their client_trade_id was already recorded")
+    method: Optional[str] = Field(None, example="copy")
+    elapsed_ms: float
+    trades_per_second: float
+
+
 class Player(PlayerBase):
     id: int
 
@@ -102,12 +110,27 @@ class TradeBase(ORMModel):
 
 
 class TradeCreate(TradeBase):
+    action: str = Field(..., example="buy", description="buy or sell, in any case")
+    qty: int = Field(..., gt=0)
+    price: float = Field(..., gt=0)
     timestamp: datetime
+    client_trade_id: Optional[str] = Field(
+        None, min_length=1, max_length=64, example="3f1c9a0e-tap-17",
+        description="Idempotency key; posting the same key again for the session returns the recorded trade"
+    )
+
+    @field_validator("action")
+    def normalize_action(cls, v: str) -> str:
+        v = v.lower()
+        if v not in ("buy", "sell"):
+            raise ValueError("action must be buy or sell")
+        return v
 
 
 class Trade(TradeBase):
     trade_id: int
     timestamp: datetime
+    client_trade_id: Optional[str] = None
 
 class Player(PlayerBase):
     id: int
@@ -120,6 +143,23 @@ class StockPrice(BaseModel):
     class Config:
         from_attributes = True
 
+class StockIndicators(BaseModel):
+    symbol: str
+    year: int
+    month: int
+    days: int = Field(..., description="Trading days in the month", example=21)
+    first_date: Optional[date] = None
+    last_date: Optional[date] = None
+    last_price: Optional[float] = None
+    return_pct: Optional[float] = Field(None, description="Return from the first to the last close of the month")
+    last_return_pct: Optional[float] = Field(None, description="Return of the last trading day")
+    sma_5: Optional[float] = None
+    sma_10: Optional[float] = None
+    ema_10: Optional[float] = None
+    rsi_14: Optional[float] = Field(None, description="Wilder's RSI over 14 days")
+    volatility_pct: Optional[float] = Field(None, description="Standard deviation of daily returns")
+    max_drawdown_pct: Optional[float] = Field(None, description="Largest fall from a running high, as a negative number")
+
 class Score(BaseModel):
     session_id: UUID
     player_id: int
@@ -132,6 +172,16 @@ class Score(BaseModel):
         from_attributes = True
 
 
+class LiveScore(BaseModel):
+    session_id: UUID
+    total_trades: int = Field(..., example=10)
+    total_profit: float = Field(..., example=500.0)
+    total_score: float = Field(..., example=1500.0)
+    cash: float = Field(..., example=9500.0)
+    holdings: Dict[str, int] = Field(default_factory=dict, example={"AAPL": 5})
+    market_date: Optional[date] = None
+
+
 # Unsold Shares
 class UnsoldShareBase(ORMModel):
     session_id: UUID
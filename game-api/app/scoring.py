@@ -0,0 +1,157 @@
+"""
+Pure scoring engine for trading sessions.
+
+Trades are passed in as columns (symbol, action, qty, price) ordered by time.
+Buys are matched to sells FIFO per symbol; every trade scores one point and
+every profitable matched lot earns a bonus by profit percentage:
+
+    0% < profit <= 5%   -> 1 point
+    5% < profit <= 10%  -> 2 points
+    10% < profit <= 20% -> 3 points
+    profit > 20%        -> 5 points
+
+The functions here do no I/O, so they can score a single session at the end of
+a game or be mapped over thousands of sessions for batch rescoring.
+``RunningScore`` applies the same rules one trade at a time, for a live score
+that is kept up to date as trades are recorded.
+"""
+import math
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Hashable, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+# Upper bounds (inclusive) of the 1/2/3 point tiers; anything above the last earns 5
+BONUS_THRESHOLDS = np.array([5.0, 10.0, 20.0])
+BONUS_POINTS = np.array([1, 2, 3, 5])
+_THRESHOLDS = BONUS_THRESHOLDS.tolist()
+
+
+class ScoreResult(NamedTuple):
+    total_trades: int
+    total_profit: float
+    total_score: int
+    unsold: List[Tuple[str, int, float]]  # Open lots as (symbol, quantity, purchase_price)
+
+
+def bonus_points(profit_pct: np.ndarray) -> np.ndarray:
+    """Map matched-lot profit percentages to bonus points (0 for non-positive profit)."""
+    profit_pct = np.asarray(profit_pct, dtype=np.float64)
+    tiers = np.searchsorted(BONUS_THRESHOLDS, profit_pct, side="left")
+    return np.where(profit_pct > 0, BONUS_POINTS[tiers], 0)
+
+
+def score_trades(symbols: Sequence[str], actions: Sequence[str],
+                 qtys: Sequence[int], prices: Sequence[float]) -> ScoreResult:
+    """
+    Score one session from time-ordered trade columns.
+    Sells beyond the open quantity of a symbol are ignored, as are unknown actions
+    (which still count as a trade).
+    """
+    symbols = np.asarray(symbols).tolist()
+    actions = np.char.lower(np.asarray(actions, dtype=str)).tolist() if len(actions) else []
+    qtys = np.asarray(qtys, dtype=np.int64).tolist()
+    prices = np.asarray(prices, dtype=np.float64).tolist()
+
+    # FIFO lots per symbol, in order of first appearance; each lot is [qty, price]
+    lots: Dict[str, deque] = {}
+    matched_buy, matched_sell, matched_qty = [], [], []
+
+    for symbol, action, qty, price in zip(symbols, actions, qtys, prices):
+        queue = lots.get(symbol)
+        if queue is None:
+            queue = lots[symbol] = deque()
+        if action == "buy":
+            queue.append([qty, price])
+        elif action == "sell":
+            qty_left = qty
+            while qty_left > 0 and queue:
+                lot = queue[0]
+                matched = min(qty_left, lot[0])
+                matched_buy.append(lot[1])
+                matched_sell.append(price)
+                matched_qty.append(matched)
+                lot[0] -= matched
+                if lot[0] == 0:
+                    queue.popleft()
+                qty_left -= matched
+
+    buy = np.array(matched_buy, dtype=np.float64)
+    sell = np.array(matched_sell, dtype=np.float64)
+    profit_per_share = sell - buy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        profit_pct = (profit_per_share / buy) * 100
+    # Accumulate sequentially (not pairwise) so the float total matches lot-by-lot summation
+    amounts = profit_per_share * np.array(matched_qty, dtype=np.int64)
+    total_profit = float(np.add.accumulate(amounts)[-1]) if len(amounts) else 0.0
+
+    total_trades = len(symbols)
+    total_score = total_trades + int(bonus_points(profit_pct).sum())
+    unsold = [(symbol, lot[0], lot[1]) for symbol, queue in lots.items() for lot in queue if lot[0] > 0]
+    return ScoreResult(total_trades, total_profit, total_score, unsold)
+
+
+def lot_bonus(profit_pct: float) -> int:
+    """Scalar bonus_points for one matched lot."""
+    if not profit_pct > 0:
+        return 0
+    return int(BONUS_POINTS[bisect_left(_THRESHOLDS, profit_pct)])
+
+
+def _profit_pct(profit_per_share: float, buy_price: float) -> float:
+    if buy_price == 0:
+        # As numpy divides: +/-inf, or nan for 0 / 0
+        return math.copysign(math.inf, profit_per_share) if profit_per_share else math.nan
+    return (profit_per_share / buy_price) * 100
+
+
+class RunningScore:
+    """
+    Incremental score_trades: FIFO lots, realized profit and points of one session, updated per trade.
+    Feeding it a session's trades in time order gives exactly the ScoreResult of score_trades.
+    """
+
+    __slots__ = ("total_trades", "total_profit", "total_score", "lots")
+
+    def __init__(self):
+        self.total_trades = 0
+        self.total_profit = 0.0
+        self.total_score = 0
+        self.lots: Dict[str, deque] = {}  # Open lots per symbol, in order of first appearance; [qty, price]
+
+    def add(self, symbol: str, action: str, qty: int, price: float) -> int:
+        """Score one trade and return the quantity it sold out of open lots."""
+        self.total_trades += 1
+        self.total_score += 1
+        queue = self.lots.get(symbol)
+        if queue is None:
+            queue = self.lots[symbol] = deque()
+        action = action.lower()
+        if action == "buy":
+            queue.append([qty, price])
+            return 0
+        if action != "sell":
+            return 0
+
+        qty_left = qty
+        while qty_left > 0 and queue:
+            lot = queue[0]
+            matched = min(qty_left, lot[0])
+            profit_per_share = price - lot[1]
+            self.total_profit += profit_per_share * matched
+            self.total_score += lot_bonus(_profit_pct(profit_per_share, lot[1]))
+            lot[0] -= matched
+            if lot[0] == 0:
+                queue.popleft()
+            qty_left -= matched
+        return qty - qty_left
+
+    def result(self) -> ScoreResult:
+        unsold = [(symbol, lot[0], lot[1]) for symbol, queue in self.lots.items() for lot in queue if lot[0] > 0]
+        return ScoreResult(self.total_trades, self.total_profit, self.total_score, unsold)
+
+
+def score_sessions(trades_by_session: Dict[Hashable, Tuple[Sequence, Sequence, Sequence, Sequence]]) -> Dict[Hashable, ScoreResult]:
+    """Score many sessions given {key: (symbols, actions, qtys, prices)}."""
+    return {key: score_trades(*columns) for key, columns in trades_by_session.items()}
@@ -0,0 +1,220 @@
+"""
+In-memory catalog of stock availability for the roulette.
+
+The stocks table is small and changes only when stocks are added, so it is
+loaded once and the set of playable months -- months where a popular, a
+volatile and a sector stock are all available for the whole month -- is
+precomputed from it. A roulette spin is then a random draw from that list
+instead of a query per candidate month.
+
+Stocks are kept in an interval index: one list per category and per sector,
+sorted by ``available_from``. The stocks that have started by a month's first
+day are a bisected prefix of each list, so building a month's availability
+only checks ``available_to`` on that prefix rather than scanning every stock.
+
+Freshness: ``crud.create_stock`` (used by the single and bulk stock endpoints)
+invalidates the catalog of the worker that handled the write. Every other
+writer -- other uvicorn workers, ``setup_database.py``, the SQL seeds under
+``db/`` and migrations -- is only picked up once the snapshot is older than
+``STOCK_CATALOG_TTL_SECONDS`` (300 s by default). Call ``invalidate()`` after
+any new in-process write path.
+"""
+import asyncio
+import calendar
+from bisect import bisect_right
+import datetime
+import logging
+import random
+import time
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ("popular", "volatile", "sector")
+
+
+class CatalogStock(NamedTuple):
+    symbol: str
+    category: str
+    sector: Optional[str]
+    available_from: Optional[datetime.date]
+    available_to: Optional[datetime.date]
+
+
+class MonthAvailability(NamedTuple):
+    """Symbols available for a whole month, by category; sector stocks grouped by sector"""
+    popular: Tuple[str, ...]
+    volatile: Tuple[str, ...]
+    sectors: Dict[str, Tuple[str, ...]]
+
+    @property
+    def playable(self) -> bool:
+        return bool(self.popular and self.volatile and self.sectors)
+
+
+class IntervalBucket:
+    """Stocks of one category or sector, ordered by available_from."""
+
+    __slots__ = ("starts", "stocks")
+
+    def __init__(self, stocks: List[CatalogStock]):
+        self.stocks = sorted(stocks, key=lambda stock: stock.available_from)
+        self.starts = [stock.available_from for stock in self.stocks]
+
+    def covering(self, start: datetime.date, end: datetime.date) -> Tuple[str, ...]:
+        """Symbols available from on or before `start` until at least `end`."""
+        started = self.stocks[:bisect_right(self.starts, start)]
+        return tuple(
+            stock.symbol for stock in started
+            if stock.available_to is None or stock.available_to >= end
+        )
+
+
+class StockCatalog:
+    """Snapshot of the stocks table with precomputed roulette months."""
+
+    def __init__(self, ttl_seconds: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self._stocks: Optional[List[CatalogStock]] = None
+        self._symbols: FrozenSet[str] = frozenset()
+        self._categories: Dict[str, IntervalBucket] = {}
+        self._sectors: Dict[str, IntervalBucket] = {}
+        self._months: Dict[Tuple[int, int], MonthAvailability] = {}
+        self._eligible: List[Dict[str, int]] = []
+        self._eligible_on: Optional[datetime.date] = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+        self.loads = 0
+
+    async def eligible_months(self, db: AsyncSession) -> List[Dict[str, int]]:
+        """Return every playable month that has started by today, as {"month", "year"} dicts."""
+        await self._ensure_loaded(db)
+        today = datetime.date.today()
+        if self._eligible_on != today:
+            self._eligible = self._compute_eligible(today)
+            self._eligible_on = today
+        return self._eligible
+
+    async def random_eligible_month(self, db: AsyncSession) -> Optional[Dict[str, int]]:
+        """Draw a random playable month, or None if there is none."""
+        eligible = await self.eligible_months(db)
+        return random.choice(eligible) if eligible else None
+
+    async def month(self, db: AsyncSession, month: int, year: int) -> MonthAvailability:
+        """Return the stocks available for the whole of a month."""
+        await self._ensure_loaded(db)
+        return self._availability(month, year)
+
+    async def has_symbol(self, db: AsyncSession, symbol: str) -> bool:
+        """Return whether the stocks table has the symbol."""
+        await self._ensure_loaded(db)
+        return symbol in self._symbols
+
+    def invalidate(self):
+        """Discard the snapshot; the next lookup reloads it."""
+        self._generation += 1
+        self._stocks = None
+        self._months = {}
+        self._eligible_on = None
+
+    def stats(self) -> dict:
+        return {
+            "stocks": len(self._stocks) if self._stocks is not None else None,
+            "months_cached": len(self._months),
+            "eligible_months": len(self._eligible) if self._eligible_on else None,
+            "loads": self.loads,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._stocks is not None else None,
+        }
+
+    def _fresh(self) -> bool:
+        return self._stocks is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    async def _ensure_loaded(self, db: AsyncSession):
+        if self._fresh():
+            return
+        async with self._lock:
+            if self._fresh():
+                return
+            while True:
+                generation = self._generation
+                result = await db.execute(select(
+                    models.Stock.symbol,
+                    models.Stock.category,
+                    models.Stock.sector,
+                    models.Stock.available_from,
+                    models.Stock.available_to
+                ))
+                stocks = [CatalogStock(*row) for row in result.all()]
+                if generation != self._generation:
+                    # Invalidated while loading; the rows may predate the write
+                    logger.debug("Stock catalog invalidated during load, reloading")
+                    continue
+                self._index(stocks)
+                self._months = {}
+                self._eligible_on = None
+                self._stocks = stocks
+                self._symbols = frozenset(stock.symbol for stock in stocks)
+                self._loaded_at = time.monotonic()
+                self.loads += 1
+                logger.info("Loaded stock catalog with %d stocks", len(stocks))
+                return
+
+    def _index(self, stocks: List[CatalogStock]):
+        # Stocks without a start date are never available, so they are left out of the index
+        dated = [stock for stock in stocks if stock.available_from is not None]
+        self._categories = {
+            category: IntervalBucket([stock for stock in dated if stock.category == category])
+            for category in CATEGORIES
+        }
+        by_sector: Dict[str, List[CatalogStock]] = {}
+        for stock in dated:
+            if stock.category == "sector" and stock.sector:
+                by_sector.setdefault(stock.sector, []).append(stock)
+        self._sectors = {sector: IntervalBucket(members) for sector, members in by_sector.items()}
+
+    def _availability(self, month: int, year: int) -> MonthAvailability:
+        key = (year, month)
+        availability = self._months.get(key)
+        if availability is None:
+            availability = self._months[key] = self._build_month(month, year)
+        return availability
+
+    def _build_month(self, month: int, year: int) -> MonthAvailability:
+        # A stock is available in the month if it starts on or before the first day
+        # and ends on or after the last day (or has no end date)
+        month_start = datetime.date(year, month, 1)
+        month_end = datetime.date(year, month, calendar.monthrange(year, month)[1])
+        sectors = {}
+        for sector, bucket in self._sectors.items():
+            symbols = bucket.covering(month_start, month_end)
+            if symbols:
+                sectors[sector] = symbols
+        return MonthAvailability(
+            popular=self._categories["popular"].covering(month_start, month_end),
+            volatile=self._categories["volatile"].covering(month_start, month_end),
+            sectors=sectors,
+        )
+
+    def _compute_eligible(self, today: datetime.date) -> List[Dict[str, int]]:
+        # Candidate months are those in which some stock became available
+        candidates = {
+            (stock.available_from.year, stock.available_from.month)
+            for stock in self._stocks
+            if stock.available_from is not None and stock.available_from <= today
+        }
+        return [
+            {"month": month, "year": year}
+            for year, month in sorted(candidates)
+            if self._availability(month, year).playable
+        ]
+
+
+# Shared instance used by all routers
+stock_catalog = StockCatalog(ttl_seconds=settings.STOCK_CATALOG_TTL_SECONDS)
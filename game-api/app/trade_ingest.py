@@ -0,0 +1,164 @@
+"""
+Write-behind ingestion of posted trades.
+
+Recording a trade used to be an INSERT, a commit and a refresh per request.
+``TradeIngestor`` queues validated trades instead and a single background task
+writes them in multi-row INSERT batches, one commit per batch (group commit):
+a batch closes when it holds ``max_batch`` trades or ``window_seconds`` after
+its first trade, and trades posted while a batch is committing form the next
+one. A request is answered only once its batch has committed, so an
+acknowledged trade is durable; pending trades are written on shutdown.
+
+Every trade carries an idempotency key, ``client_trade_id``, supplied by the
+client or generated here. A retry with a key that is still queued waits for
+the queued trade, and one with a key already recorded gets the stored row back
+from the INSERT ... ON CONFLICT DO NOTHING, so a retried post never records a
+second trade. If a batch fails, its trades are retried one by one so a single
+bad trade (an unknown session or symbol) does not fail the others.
+"""
+import asyncio
+import itertools
+import logging
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from app import crud, schemas
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class TradeIngestor:
+    """Queue of trades waiting to be written, drained in batched transactions by a background task."""
+
+    def __init__(self, session_factory, window_seconds: float = 0.005, max_batch: int = 500):
+        self.session_factory = session_factory
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._pending: Dict[Tuple[uuid.UUID, str], Tuple[dict, asyncio.Future]] = {}
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.rows_written = 0
+        self.largest_batch = 0
+        self.batch_errors = 0
+        self.rejected = 0
+
+    async def submit(self, trade: schemas.TradeCreate) -> dict:
+        """Queue a trade and return the stored row once its batch has committed."""
+        row = trade.model_dump()
+        row["client_trade_id"] = row["client_trade_id"] or uuid.uuid4().hex
+        key = (row["session_id"], row["client_trade_id"])
+
+        queued = self._pending.get(key)
+        if queued is not None:
+            self.coalesced += 1
+            future = queued[1]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = (row, future)
+            self.submitted += 1
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._run())
+
+        # A request that goes away must not cancel the write other retries of it wait for
+        return await asyncio.shield(future)
+
+    async def flush(self):
+        """Write up to max_batch queued trades in one transaction and answer their requests."""
+        if not self._pending:
+            return
+        keys = list(itertools.islice(self._pending, self.max_batch))
+        batch = [self._pending.pop(key) for key in keys]
+        try:
+            stored = await self._write([row for row, _ in batch])
+        except Exception as e:
+            self.batch_errors += 1
+            logger.warning("Failed to write a batch of %d trades, retrying one by one: %s", len(batch), e)
+            await self._write_each(batch)
+            return
+        except BaseException:
+            # Cancelled, e.g. on shutdown: requeue in front of newer trades; keys make a rewrite idempotent
+            self._pending = {**dict(zip(keys, batch)), **self._pending}
+            raise
+
+        self.batches += 1
+        self.rows_written += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, future), row in zip(batch, stored):
+            if not future.done():
+                future.set_result(row)
+
+    async def close(self):
+        """Stop the background writer and write every queued trade, e.g. on shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "mean_batch": round(self.rows_written / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "batch_errors": self.batch_errors,
+            "rejected": self.rejected,
+        }
+
+    async def _write(self, rows: List[dict]) -> List[dict]:
+        async with self.session_factory() as db:
+            return await crud.insert_trades(db, rows)
+
+    async def _write_each(self, batch: List[Tuple[dict, asyncio.Future]]):
+        for position, (row, future) in enumerate(batch):
+            try:
+                stored = await self._write([row])
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    left = {(left_row["session_id"], left_row["client_trade_id"]): (left_row, left_future)
+                            for left_row, left_future in batch[position:]}
+                    self._pending = {**left, **self._pending}
+                    raise
+                self.rejected += 1
+                if not future.done():
+                    future.set_exception(e)
+                    # Retrieved here too, in case every request waiting for it has gone away
+                    future.exception()
+                continue
+            self.batches += 1
+            self.rows_written += 1
+            self.largest_batch = max(self.largest_batch, 1)
+            if not future.done():
+                future.set_result(stored[0])
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            await self.flush()
+
+
+# Shared instance used by the trades router
+trade_ingestor = TradeIngestor(
+    AsyncSessionLocal,
+    window_seconds=settings.TRADE_INGEST_WINDOW_SECONDS,
+    max_batch=settings.TRADE_INGEST_MAX_BATCH
+)
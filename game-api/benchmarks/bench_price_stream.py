@@ -0,0 +1,119 @@
+"""
+Benchmark: price stream encoding cost per connection.
+
+Streams a synthetic month of three symbols to many in-process sockets and
+reports bytes per frame, throughput and CPU time per connection for:
+
+    per-socket   the old pattern: build the frame dict and json-encode it for every socket and tick
+    hub/json     PriceStreamHub with pre-rendered JSON frames (orjson when installed)
+    hub/msgpack  PriceStreamHub with binary MessagePack frames (needs msgpack)
+    <enc>/delta  the same, with the compact protocol: one header, then scaled price deltas per day
+
+Usage:
+    python benchmarks/bench_price_stream.py
+    python benchmarks/bench_price_stream.py --connections 2000 --days 23
+
+Importing the app reads DATABASE_URL and SECRET_KEY from the environment, as the API does.
+"""
+import argparse
+import asyncio
+import calendar
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.price_cache import PriceSeries
+from app.price_stream import ENCODINGS, PROTOCOLS, PriceStreamHub, PriceTimeline
+from app.routers.ws import pump_stream
+
+SYMBOLS = ("AAPL", "TSLA", "XOM")
+
+
+class CountingWebSocket:
+    """Counts what would go on the wire"""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def send_text(self, text):
+        self.frames += 1
+        self.bytes += len(text.encode())
+
+    async def send_bytes(self, data):
+        self.frames += 1
+        self.bytes += len(data)
+
+    async def receive_text(self):
+        await asyncio.Event().wait()
+
+
+def make_timeline(days):
+    start = datetime(2025, 7, 1)
+    timestamps = [start + timedelta(days=i) for i in range(days)]
+    series = {
+        symbol: PriceSeries(symbol, timestamps, [100.0 + 10 * n + i * 0.37 for i in range(days)])
+        for n, symbol in enumerate(SYMBOLS)
+    }
+    return PriceTimeline(7, 2025, SYMBOLS, series)
+
+
+async def per_socket(timeline, sockets):
+    # Mirrors the pre-hub stream_prices loop body and Starlette's send_json encoding
+    for index, day in enumerate(timeline.dates):
+        for n, ws in enumerate(sockets):
+            frame = {
+                "session_id": f"session-{n}",
+                "current_date": day.isoformat(),
+                "prices": [dict(p) for p in timeline.prices[index]],
+                "stream_info": {
+                    "date_index": index + 1,
+                    "total_dates": len(timeline.dates),
+                    "month": calendar.month_name[timeline.month],
+                    "year": timeline.year
+                },
+                "timestamp": datetime.now().isoformat()
+            }
+            await ws.send_text(json.dumps(frame, separators=(",", ":"), ensure_ascii=False))
+
+
+async def hub_stream(timeline, sockets, encoding, protocol):
+    # Fast ticks with room to buffer the whole month, so no socket is dropped as slow
+    hub = PriceStreamHub(tick_seconds=0.001, slots_per_tick=1, max_backlog=len(timeline) + 1)
+    subscriptions = [hub.subscribe(ws, f"session-{n}", timeline, encoding, protocol=protocol)
+                     for n, ws in enumerate(sockets)]
+    await asyncio.gather(*(pump_stream(ws, s) for ws, s in zip(sockets, subscriptions)))
+
+
+async def run(args):
+    variants = [("per-socket", lambda t, s: per_socket(t, s))]
+    for name, encoding in ENCODINGS.items():
+        variants.append((f"hub/{name}", lambda t, s, e=encoding: hub_stream(t, s, e, PROTOCOLS["full"])))
+        variants.append((f"{name}/delta", lambda t, s, e=encoding: hub_stream(t, s, e, PROTOCOLS["delta"])))
+    if "msgpack" not in ENCODINGS:
+        print("msgpack not installed; skipping hub/msgpack")
+
+    for name, stream in variants:
+        timeline = make_timeline(args.days)
+        sockets = [CountingWebSocket() for _ in range(args.connections)]
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        await stream(timeline, sockets)
+        cpu = time.process_time() - cpu_started
+        wall = time.perf_counter() - wall_started
+        frames = sum(ws.frames for ws in sockets)
+        sent = sum(ws.bytes for ws in sockets)
+        assert frames == args.connections * args.days, f"{name} delivered {frames} frames"
+        print(f"{name:>12}: {sent / frames:.0f} bytes/frame, {sent / wall / 1e6:.1f} MB/s, "
+              f"{cpu / args.connections * 1e6:.0f} us CPU/connection-month, "
+              f"{cpu / frames * 1e6:.2f} us CPU/frame")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=22)
+    asyncio.run(run(parser.parse_args()))
@@ -1,9 +1,102 @@
+"""
+Shared test setup: stub settings and a temp-file SQLite database.
+
+app.core.config reads DATABASE_URL and SECRET_KEY from the environment, so it is replaced by a stub before
+any app module is imported. The modules that build shared caches, queues and schedulers from settings are
+imported here as well, so they are built from this stub whichever test module is collected first.
+"""
+import os
+import sys
+import tempfile
+from unittest.mock import MagicMock
+
 import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+
+# Mock settings before importing app modules; values match the defaults of app.core.config.Settings
+mock_settings = MagicMock()
+mock_settings.DATABASE_URL = "sqlite+aiosqlite:///test.db"
+mock_settings.SECRET_KEY = "test-secret-key-for-testing-only"
+mock_settings.DEBUG = True
+mock_settings.ALLOWED_ORIGINS = ["*"]
+mock_settings.OLLAMA_BASE_URL = "http://localhost:11434"
+mock_settings.PRICE_CACHE_MAX_ENTRIES = 1024
+mock_settings.INDICATOR_CACHE_MAX_ENTRIES = 1024
+mock_settings.STOCK_CATALOG_TTL_SECONDS = 300.0
+mock_settings.PRICE_STREAM_TICK_SECONDS = 10.0
+mock_settings.PRICE_STREAM_SLOTS_PER_TICK = 10
+mock_settings.STREAM_CURSOR_FLUSH_SECONDS = 5.0
+mock_settings.TRADE_INGEST_WINDOW_SECONDS = 0.005
+mock_settings.TRADE_INGEST_MAX_BATCH = 500
+mock_settings.PORTFOLIO_MAX_SESSIONS = 4096
+mock_settings.TRADE_BULK_MAX_TRADES = 50000
+mock_settings.ADVICE_CACHE_TTL_SECONDS = 300.0
+mock_settings.ADVICE_CACHE_MAX_ENTRIES = 1024
+mock_settings.ADVICE_TIMEOUT_SECONDS = 13.0
+mock_settings.ADVICE_MAX_CONCURRENCY = 1
+mock_settings.ADVICE_MAX_QUEUE = 32
+mock_settings.RESCORE_CHUNK_SIZE = 5000
+mock_settings.RESCORE_WORKERS = None
+
+sys.modules['app.core.config'] = MagicMock(settings=mock_settings)
+
+# Modules with shared instances built from settings at import time
+import app.advice  # noqa: E402,F401
+import app.advice_scheduler  # noqa: E402,F401
+import app.core.db  # noqa: E402,F401
+import app.indicators  # noqa: E402,F401
+import app.portfolio  # noqa: E402,F401
+import app.price_cache  # noqa: E402,F401
+import app.price_stream  # noqa: E402,F401
+import app.stock_catalog  # noqa: E402,F401
+import app.trade_ingest  # noqa: E402,F401
+from app.models import Base  # noqa: E402
 
-# Minimal conftest.py for basic async testing
-# This avoids importing the full app which has missing dependencies
 
 @pytest.fixture
 def sample_data():
     """Sample data for basic testing"""
     return {"test": "data"}
+
+
+@pytest_asyncio.fixture
+async def db_engine():
+    """
+    Create a temp-file SQLite database with the model schema, foreign keys enforced and WAL journaling
+    (so a job can write while one of its read cursors is open)
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    yield engine
+
+    await engine.dispose()
+    os.close(db_fd)
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        try:
+            os.unlink(path)
+        except (OSError, PermissionError):
+            pass
+
+
+@pytest.fixture
+def db_factory(db_engine):
+    """Session factory bound to the test database"""
+    return async_sessionmaker(bind=db_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+@pytest_asyncio.fixture
+async def async_db_session(db_factory):
+    """Create an async SQLite session"""
+    async with db_factory() as session:
+        yield session
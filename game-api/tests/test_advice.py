@@ -0,0 +1,333 @@
+"""
+Test the LLM advice cache: indicator prompts, digests, TTL and LRU eviction, single-flight generation,
+fallbacks and streaming
+"""
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from app import schemas
+from app.advice import AdviceCache, AdviceItemParser, advice_key, complete_advice, prompt_input
+from app.advice_scheduler import AdviceScheduler
+from app.indicators import compute
+from app.price_cache import PriceSeries
+from app.routers import sessions
+
+SYMBOLS = ["AAPL", "TSLA", "XOM"]
+INDICATORS = compute([
+    PriceSeries("AAPL", [datetime(2025, 7, 1, 16), datetime(2025, 7, 2, 16)], [200.0, 202.5]),
+    PriceSeries("TSLA", [datetime(2025, 7, 1, 16), datetime(2025, 7, 2, 16)], [300.0, 290.0]),
+    PriceSeries("XOM", [datetime(2025, 7, 1, 16)], [110.0]),
+])
+
+
+def make_advice(symbols=SYMBOLS, action="BUY"):
+    return schemas.TradingAdviceResponse(advice=[
+        schemas.TradingAdviceItem(symbol=symbol, action=action, reason="Recent prices are rising.")
+        for symbol in symbols
+    ])
+
+
+class FakeChain:
+    """Stands in for the prompt | LLM chain, counting calls"""
+
+    def __init__(self, result=None, delay=0.0, error=None):
+        self.result = result or make_advice()
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def ainvoke(self, variables):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def make_cache(chain, **kwargs):
+    return AdviceCache(lambda: chain, **kwargs)
+
+
+def variables(trades=()):
+    return prompt_input(SYMBOLS, INDICATORS, list(trades))
+
+
+class TestPromptInput:
+    """Test that prompts are a pure function of indicators and trades"""
+
+    def test_same_inputs_share_a_key(self):
+        trades = [{"symbol": "AAPL", "action": "buy", "qty": 1, "price": 200.0}]
+        assert advice_key(variables(trades)) == advice_key(variables(list(trades)))
+        assert advice_key(variables(trades)) != advice_key(variables())
+
+    def test_prompt_carries_indicators(self):
+        assert variables()["cutoff_date"] == "2025-07-02"
+        assert variables()["symbols"] == "AAPL, TSLA, XOM"
+        stock_data = json.loads(variables()["stock_data"])
+        assert stock_data["AAPL"]["return_pct"] == 1.25
+        assert stock_data["XOM"]["last_date"] == "2025-07-01"
+        assert "year" not in stock_data["AAPL"]
+
+    def test_complete_advice_filters_and_backfills(self):
+        result = schemas.TradingAdviceResponse.model_construct(advice=make_advice(["TSLA", "TSLA", "MSFT"]).advice)
+
+        advice = complete_advice(result, SYMBOLS).advice
+
+        assert [item.symbol for item in advice] == ["TSLA", "AAPL", "XOM"]
+        assert [item.action for item in advice] == [schemas.Action.BUY, schemas.Action.HOLD, schemas.Action.HOLD]
+
+
+class TestAdviceCache:
+    """Test caching, coalescing and fallbacks of generated advice"""
+
+    @pytest.mark.asyncio
+    async def test_repeat_requests_hit_the_cache(self):
+        chain = FakeChain()
+        cache = make_cache(chain)
+
+        first = await cache.advise(SYMBOLS, variables())
+        second = await cache.advise(SYMBOLS, variables())
+
+        assert first is second
+        assert chain.calls == 1
+        stats = cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5
+        assert stats["generations"] == 1 and stats["latency_ms"] is not None
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_generation(self):
+        chain = FakeChain(delay=0.05)
+        cache = make_cache(chain)
+
+        results = await asyncio.gather(*(cache.advise(SYMBOLS, variables()) for _ in range(10)))
+
+        assert chain.calls == 1
+        assert all(result is results[0] for result in results)
+        assert cache.stats()["coalesced"] == 9
+        assert cache.stats()["inflight"] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_generation(self):
+        chain = FakeChain(delay=0.05)
+        cache = make_cache(chain)
+        impatient = asyncio.create_task(cache.advise(SYMBOLS, variables()))
+        patient = asyncio.create_task(cache.advise(SYMBOLS, variables()))
+        await asyncio.sleep(0.01)
+
+        impatient.cancel()
+
+        assert (await patient).advice[0].action == schemas.Action.BUY
+        assert chain.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_different_trades_generate_again(self):
+        chain = FakeChain()
+        cache = make_cache(chain)
+
+        await cache.advise(SYMBOLS, variables())
+        await cache.advise(SYMBOLS, variables([{"symbol": "AAPL", "action": "buy", "qty": 1, "price": 200.0}]))
+
+        assert chain.calls == 2
+
+    @pytest.mark.asyncio
+    async def test_expired_advice_is_regenerated(self):
+        chain = FakeChain()
+        cache = make_cache(chain, ttl_seconds=0)
+
+        await cache.advise(SYMBOLS, variables())
+        await cache.advise(SYMBOLS, variables())
+
+        assert chain.calls == 2
+        assert cache.stats()["expired"] == 1
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_advice_is_evicted(self):
+        chain = FakeChain()
+        cache = make_cache(chain, max_entries=2)
+        keys = [variables([{"symbol": "AAPL", "action": "buy", "qty": n, "price": 200.0}]) for n in range(1, 4)]
+
+        for key in keys:
+            await cache.advise(SYMBOLS, key)
+        await cache.advise(SYMBOLS, keys[0])
+
+        assert cache.stats()["entries"] == 2
+        assert chain.calls == 4
+
+    @pytest.mark.asyncio
+    async def test_failures_fall_back_and_are_not_cached(self):
+        chain = FakeChain(error=ValueError("unparseable output"))
+        cache = make_cache(chain)
+
+        first = await cache.advise(SYMBOLS, variables())
+        await cache.advise(SYMBOLS, variables())
+
+        assert [item.action for item in first.advice] == [schemas.Action.HOLD] * 3
+        assert chain.calls == 2
+        assert cache.stats()["failures"] == 2 and cache.stats()["entries"] == 0
+
+    @pytest.mark.asyncio
+    async def test_timeouts_fall_back(self):
+        chain = FakeChain(delay=1.0)
+        cache = make_cache(chain, timeout_seconds=0.01)
+
+        result = await cache.advise(SYMBOLS, variables())
+
+        assert "timeout" in result.advice[0].reason
+        assert cache.stats()["timeouts"] == 1 and cache.stats()["entries"] == 0
+
+    @pytest.mark.asyncio
+    async def test_chain_is_built_once(self):
+        built = []
+        cache = AdviceCache(lambda: built.append(1) or FakeChain())
+
+        cache.start()
+        await cache.advise(SYMBOLS, variables())
+        await cache.advise(SYMBOLS, variables([{"symbol": "XOM", "action": "buy", "qty": 1, "price": 110.0}]))
+
+        assert len(built) == 1
+
+    @pytest.mark.asyncio
+    async def test_failures_return_the_given_fallback(self):
+        cache = make_cache(FakeChain(error=ValueError("unparseable output")))
+        fallback = make_advice(action="SELL")
+
+        assert await cache.advise(SYMBOLS, variables(), fallback=fallback) is fallback
+
+    @pytest.mark.asyncio
+    async def test_prefetch_generates_in_the_background(self):
+        chain = FakeChain(delay=0.05)
+        cache = make_cache(chain)
+
+        assert cache.prefetch(SYMBOLS, variables()) is None
+        assert cache.prefetch(SYMBOLS, variables()) is None
+        assert cache.stats()["inflight"] == 1
+        await asyncio.sleep(0.1)
+
+        assert cache.prefetch(SYMBOLS, variables()).advice[0].action == schemas.Action.BUY
+        assert chain.calls == 1
+
+
+class Chunk:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeStreamChain:
+    """Stands in for the streaming prompt | LLM chain, yielding the document in small chunks"""
+
+    def __init__(self, document, size=7, delay=0.0, stall_after=None):
+        self.document = document
+        self.size = size
+        self.delay = delay
+        self.stall_after = stall_after
+        self.sent = 0
+
+    async def astream(self, variables):
+        for start in range(0, len(self.document), self.size):
+            if self.stall_after is not None and start >= self.stall_after:
+                await asyncio.sleep(10)
+            await asyncio.sleep(self.delay)
+            self.sent = start + self.size
+            yield Chunk(self.document[start:start + self.size])
+
+
+def make_stream_cache(stream_chain, **kwargs):
+    return AdviceCache(lambda: FakeChain(), build_stream_chain=lambda: stream_chain, **kwargs)
+
+
+DOCUMENT = json.dumps({"advice": [
+    {"symbol": "TSLA", "action": "SELL", "reason": "Fell 3% with \"heavy\" volume {sic}."},
+    {"symbol": "MSFT", "action": "BUY", "reason": "Not one of the selected symbols."},
+    {"symbol": "AAPL", "action": "BUY", "reason": "Above its 10-day EMA."},
+]})
+
+
+class TestAdviceStream:
+    """Test incremental parsing and streaming of advice items"""
+
+    def test_parser_emits_items_as_they_complete(self):
+        parser = AdviceItemParser()
+        emitted = [parser.feed(DOCUMENT[i:i + 5]) for i in range(0, len(DOCUMENT), 5)]
+
+        items = [item for chunk in emitted for item in chunk]
+        assert [item["symbol"] for item in items] == ["TSLA", "MSFT", "AAPL"]
+        assert items[0]["reason"] == 'Fell 3% with "heavy" volume {sic}.'
+        # The first item is complete long before the document is
+        first = next(n for n, chunk in enumerate(emitted) if chunk)
+        assert first < len(emitted) // 2
+
+    def test_parser_reads_bare_arrays_and_skips_nested_objects(self):
+        parser = AdviceItemParser()
+        items = parser.feed('[{"symbol": "AAPL", "meta": {"tags": [{"a": 1}]}}, {"symbol": "XOM"}]')
+
+        assert [item["symbol"] for item in items] == ["AAPL", "XOM"]
+
+    @pytest.mark.asyncio
+    async def test_items_stream_before_generation_ends(self):
+        chain = FakeStreamChain(DOCUMENT)
+        cache = make_stream_cache(chain)
+        sent_at_first_item = None
+
+        items = []
+        async for item in cache.stream(SYMBOLS, variables()):
+            if sent_at_first_item is None:
+                sent_at_first_item = chain.sent
+            items.append(item)
+
+        assert sent_at_first_item < len(DOCUMENT) // 2
+        assert [(item.symbol, item.action.value) for item in items] == [
+            ("TSLA", "SELL"), ("AAPL", "BUY"), ("XOM", "HOLD")]
+        assert cache.stats()["streams"] == 1 and cache.stats()["stream_first_item_ms"] is not None
+
+    @pytest.mark.asyncio
+    async def test_complete_stream_is_cached(self):
+        chain = FakeStreamChain(DOCUMENT)
+        cache = make_stream_cache(chain)
+
+        streamed = [item async for item in cache.stream(SYMBOLS, variables())]
+        replayed = [item async for item in cache.stream(SYMBOLS, variables())]
+        answered = await cache.advise(SYMBOLS, variables())
+
+        assert replayed == streamed == answered.advice
+        assert cache.stats()["streams"] == 1 and cache.stats()["hits"] == 2
+
+    @pytest.mark.asyncio
+    async def test_timed_out_stream_falls_back_for_missing_symbols(self):
+        stalled = FakeStreamChain(DOCUMENT, stall_after=DOCUMENT.index("MSFT"))
+        cache = make_stream_cache(stalled, timeout_seconds=0.1)
+        fallback = make_advice(action="SELL")
+
+        items = [item async for item in cache.stream(SYMBOLS, variables(), fallback=fallback)]
+
+        assert [(item.symbol, item.action.value) for item in items] == [
+            ("TSLA", "SELL"), ("AAPL", "SELL"), ("XOM", "SELL")]
+        assert items[1] is fallback.advice[0]
+        assert cache.stats()["timeouts"] == 1 and cache.stats()["entries"] == 0
+
+    @pytest.mark.asyncio
+    async def test_rejected_stream_records_no_latency(self):
+        scheduler = AdviceScheduler(max_concurrency=1, max_queue=0)
+        cache = make_stream_cache(FakeStreamChain(DOCUMENT), scheduler=scheduler)
+
+        async with scheduler.slot(asyncio.get_running_loop().time() + 5):
+            items = [item async for item in cache.stream(SYMBOLS, variables())]
+
+        assert [item.action.value for item in items] == ["HOLD"] * 3
+        assert cache.stats()["rejected"] == 1 and cache.stats()["latency_ms"] is None
+
+    @pytest.mark.asyncio
+    async def test_server_sent_events(self):
+        async def items():
+            for item in make_advice().advice:
+                yield item
+
+        events = [event async for event in sessions._advice_events(items())]
+
+        assert len(events) == 4
+        assert events[0].startswith("event: advice\ndata: ") and events[0].endswith("\n\n")
+        assert json.loads(events[0].split("data: ", 1)[1])["symbol"] == "AAPL"
+        assert events[-1].startswith("event: done\n")
+        assert len(json.loads(events[-1].split("data: ", 1)[1])["advice"]) == 3
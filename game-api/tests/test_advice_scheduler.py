@@ -0,0 +1,173 @@
+"""
+Test the bounded LLM advice scheduler: concurrency cap, priorities, admission and per-session deduplication
+"""
+import asyncio
+
+import pytest
+
+from app import schemas
+from app.advice import AdviceCache
+from app.advice_scheduler import BACKGROUND, INTERACTIVE, AdviceRejected, AdviceScheduler
+
+SYMBOLS = ["AAPL", "TSLA", "XOM"]
+
+
+def deadline(seconds=5.0):
+    return asyncio.get_running_loop().time() + seconds
+
+
+async def hold(scheduler, seconds, log=None, name=None, **kwargs):
+    async with scheduler.slot(kwargs.pop("deadline", None) or deadline(), **kwargs):
+        if log is not None:
+            log.append(name)
+        await asyncio.sleep(seconds)
+
+
+class TestAdviceScheduler:
+    """Test slots, queue order and admission"""
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_capped(self):
+        scheduler = AdviceScheduler(max_concurrency=2)
+        running, peak = 0, 0
+
+        async def generate():
+            nonlocal running, peak
+            async with scheduler.slot(deadline()):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.02)
+                running -= 1
+
+        await asyncio.gather(*(generate() for _ in range(6)))
+
+        assert peak == 2
+        stats = scheduler.stats()
+        assert (stats["admitted"], stats["running"], stats["queued"]) == (6, 0, 0)
+        assert stats["wait_ms"]["max"] >= 20
+
+    @pytest.mark.asyncio
+    async def test_interactive_requests_go_first(self):
+        scheduler = AdviceScheduler(max_concurrency=1)
+        order = []
+        first = asyncio.create_task(hold(scheduler, 0.02, order, "first"))
+        await asyncio.sleep(0)
+        background = asyncio.create_task(hold(scheduler, 0, order, "background", priority=BACKGROUND))
+        interactive = asyncio.create_task(hold(scheduler, 0, order, "interactive", priority=INTERACTIVE))
+
+        await asyncio.gather(first, background, interactive)
+
+        assert order == ["first", "interactive", "background"]
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_predicted_wait_passes_deadline(self):
+        scheduler = AdviceScheduler(max_concurrency=1)
+        await hold(scheduler, 0.05)
+        running = asyncio.create_task(hold(scheduler, 0.05))
+        await asyncio.sleep(0)
+
+        assert scheduler.predicted_wait() >= 0.04
+        with pytest.raises(AdviceRejected):
+            await hold(scheduler, 0, deadline=deadline(0.06))
+        # Enough time for the running generation and this one
+        await hold(scheduler, 0, deadline=deadline(1.0))
+
+        await running
+        assert scheduler.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_queue_is_full(self):
+        scheduler = AdviceScheduler(max_concurrency=1, max_queue=1)
+        running = asyncio.create_task(hold(scheduler, 0.02))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold(scheduler, 0))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdviceRejected, match="full"):
+            await hold(scheduler, 0)
+        await asyncio.gather(running, queued)
+
+    @pytest.mark.asyncio
+    async def test_newer_request_supersedes_queued_one_of_same_session(self):
+        scheduler = AdviceScheduler(max_concurrency=1)
+        order = []
+        running = asyncio.create_task(hold(scheduler, 0.02, order, "running", owner="other"))
+        await asyncio.sleep(0)
+        older = asyncio.create_task(hold(scheduler, 0, order, "older", owner="session"))
+        await asyncio.sleep(0)
+        newer = asyncio.create_task(hold(scheduler, 0, order, "newer", owner="session"))
+
+        results = await asyncio.gather(running, older, newer, return_exceptions=True)
+
+        assert isinstance(results[1], AdviceRejected)
+        assert order == ["running", "newer"]
+        assert scheduler.stats()["superseded"] == 1
+
+    @pytest.mark.asyncio
+    async def test_deadline_passing_in_queue_frees_the_place(self):
+        scheduler = AdviceScheduler(max_concurrency=1)
+        order = []
+        running = asyncio.create_task(hold(scheduler, 0.05, order, "running"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await hold(scheduler, 0, order, "expired", deadline=deadline(0.01))
+        await hold(scheduler, 0, order, "next")
+
+        await running
+        assert order == ["running", "next"]
+        assert scheduler.stats()["expired"] == 1
+        assert scheduler.stats()["running"] == 0
+
+
+class TestScheduledAdvice:
+    """Test the advice cache generating through the scheduler"""
+
+    class SlowChain:
+        def __init__(self, delay):
+            self.delay = delay
+            self.running = 0
+            self.peak = 0
+
+        async def ainvoke(self, variables):
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            await asyncio.sleep(self.delay)
+            self.running -= 1
+            return schemas.TradingAdviceResponse(advice=[
+                schemas.TradingAdviceItem(symbol=symbol, action="BUY", reason="Momentum is up.") for symbol in SYMBOLS
+            ])
+
+    @staticmethod
+    def variables(n):
+        return {"symbols": ", ".join(SYMBOLS), "cutoff_date": "2025-07-02", "stock_data": "{}", "trades_data": str(n)}
+
+    @pytest.mark.asyncio
+    async def test_burst_is_served_one_at_a_time(self):
+        chain = self.SlowChain(0.01)
+        cache = AdviceCache(lambda: chain, scheduler=AdviceScheduler(max_concurrency=1))
+
+        results = await asyncio.gather(*(cache.advise(SYMBOLS, self.variables(n), owner=n) for n in range(5)))
+
+        assert chain.peak == 1
+        assert all(result.advice[0].action == schemas.Action.BUY for result in results)
+
+    @pytest.mark.asyncio
+    async def test_overload_falls_back_early(self):
+        chain = self.SlowChain(0.05)
+        scheduler = AdviceScheduler(max_concurrency=1)
+        cache = AdviceCache(lambda: chain, timeout_seconds=0.08, scheduler=scheduler)
+        fallback = schemas.TradingAdviceResponse(advice=[
+            schemas.TradingAdviceItem(symbol=symbol, action="HOLD", reason="Rule-based advice.") for symbol in SYMBOLS
+        ])
+        await cache.advise(SYMBOLS, self.variables(0))
+        busy = asyncio.create_task(cache.advise(SYMBOLS, self.variables(1)))
+        await asyncio.sleep(0)
+
+        started = asyncio.get_running_loop().time()
+        result = await cache.advise(SYMBOLS, self.variables(2), fallback=fallback)
+
+        assert result is fallback
+        assert asyncio.get_running_loop().time() - started < 0.04
+        assert cache.stats()["rejected"] == 1 and scheduler.stats()["rejected"] == 1
+        assert (await busy).advice[0].action == schemas.Action.BUY
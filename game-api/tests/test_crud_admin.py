@@ -0,0 +1,178 @@
+"""
+Test admin CRUD queries
+"""
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import crud
+from app.models import AdminAuditLog, Player, Score, Session as GameSession, Stock
+
+
+class StatementCounter:
+    """Count the SQL statements sent to the database while active"""
+
+    def __init__(self, async_engine):
+        self.engine = async_engine.sync_engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+
+class TestAdminSessionListing:
+    """Test crud.get_sessions_with_filters"""
+
+    async def _seed_sessions(self, db, count):
+        player = Player(nickname="TestPlayer")
+        db.add(player)
+        await db.flush()
+
+        started = datetime(2025, 7, 1, 12, 0)
+        sessions = []
+        for i in range(count):
+            session = GameSession(
+                session_id=uuid.uuid4(),
+                player_id=player.id,
+                started_at=started + timedelta(minutes=i),
+                status="ended",
+                balance=10000.0
+            )
+            db.add(session)
+            sessions.append(session)
+        await db.flush()
+
+        for i, session in enumerate(sessions):
+            db.add(Score(session_id=session.session_id, player_id=player.id,
+                         total_trades=i, total_profit=float(i), total_score=float(i * 10)))
+        await db.commit()
+        return player, sessions
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("page_size", [5, 50])
+    async def test_page_costs_one_statement(self, async_db_session, page_size):
+        await self._seed_sessions(async_db_session, 60)
+
+        with StatementCounter(async_db_session.bind) as counter:
+            sessions = await crud.get_sessions_with_filters(async_db_session, limit=page_size)
+
+        assert len(sessions) == page_size
+        assert len(counter.statements) == 1
+
+    @pytest.mark.asyncio
+    async def test_reports_score_and_nickname(self, async_db_session):
+        _, seeded = await self._seed_sessions(async_db_session, 3)
+
+        sessions = await crud.get_sessions_with_filters(async_db_session)
+
+        # Newest first
+        assert [s["session_id"] for s in sessions] == [str(s.session_id) for s in reversed(seeded)]
+        assert sessions[0]["player_nickname"] == "TestPlayer"
+        assert sessions[0]["total_score"] == 20.0
+        assert sessions[0]["total_profit"] == 2.0
+        assert sessions[0]["total_trades"] == 2
+
+    @pytest.mark.asyncio
+    async def test_session_without_score(self, async_db_session):
+        player = Player(nickname="NoScore")
+        async_db_session.add(player)
+        await async_db_session.flush()
+        async_db_session.add(GameSession(session_id=uuid.uuid4(), player_id=player.id,
+                                         started_at=datetime(2025, 7, 1), status="active", balance=10000.0))
+        await async_db_session.commit()
+
+        sessions = await crud.get_sessions_with_filters(async_db_session, status="active")
+
+        assert len(sessions) == 1
+        assert sessions[0]["total_score"] == 0
+        assert sessions[0]["total_profit"] == 0.0
+        assert sessions[0]["total_trades"] == 0
+
+    @pytest.mark.asyncio
+    async def test_date_filters(self, async_db_session):
+        await self._seed_sessions(async_db_session, 3)
+
+        assert len(await crud.get_sessions_with_filters(async_db_session, end_date=date(2025, 7, 1))) == 3
+        assert await crud.get_sessions_with_filters(async_db_session, start_date=date(2025, 7, 2)) == []
+
+
+class TestKeysetPagination:
+    """Test cursor-based pagination of admin and listing queries"""
+
+    async def _walk(self, fetch, make_cursor, page_size):
+        pages, cursor = [], None
+        while True:
+            page = await fetch(limit=page_size, cursor=cursor)
+            pages.extend(page)
+            if len(page) < page_size:
+                return pages
+            cursor = make_cursor(page[-1])
+
+    @pytest.mark.asyncio
+    async def test_sessions_cursor_matches_offset_order(self, async_db_session):
+        player = Player(nickname="Pager")
+        async_db_session.add(player)
+        await async_db_session.flush()
+        # Several sessions share a start time so the session_id tiebreaker matters
+        for i in range(7):
+            async_db_session.add(GameSession(session_id=uuid.uuid4(), player_id=player.id,
+                                             started_at=datetime(2025, 7, 1 + i // 3), status="ended", balance=0.0))
+        await async_db_session.commit()
+
+        expected = await crud.get_sessions_with_filters(async_db_session, limit=100)
+        walked = await self._walk(
+            lambda **kw: crud.get_sessions_with_filters(async_db_session, **kw),
+            lambda last: crud.encode_cursor(last["started_at"], last["session_id"]),
+            page_size=3,
+        )
+        assert [s["session_id"] for s in walked] == [s["session_id"] for s in expected]
+
+    @pytest.mark.asyncio
+    async def test_players_and_stocks_cursor(self, async_db_session):
+        async_db_session.add_all([Player(nickname=f"P{i}") for i in range(5)])
+        async_db_session.add_all([Stock(symbol=s, company_name=s, category="popular") for s in "EDCBA"])
+        await async_db_session.commit()
+
+        players = await self._walk(
+            lambda **kw: crud.get_players(async_db_session, **kw),
+            lambda last: crud.encode_cursor(last.id),
+            page_size=2,
+        )
+        assert [p.nickname for p in players] == ["P0", "P1", "P2", "P3", "P4"]
+
+        stocks = await self._walk(
+            lambda **kw: crud.get_stocks(async_db_session, **kw),
+            lambda last: crud.encode_cursor(last.symbol),
+            page_size=2,
+        )
+        assert [s.symbol for s in stocks] == ["A", "B", "C", "D", "E"]
+
+    @pytest.mark.asyncio
+    async def test_audit_logs_cursor(self, async_db_session):
+        for i in range(5):
+            async_db_session.add(AdminAuditLog(admin_login="admin", action="login",
+                                               timestamp=datetime(2025, 7, 1) + timedelta(hours=i // 2)))
+        await async_db_session.commit()
+
+        logs = await self._walk(
+            lambda **kw: crud.get_audit_logs(async_db_session, **kw),
+            lambda last: crud.encode_cursor(last.timestamp, last.id),
+            page_size=2,
+        )
+        assert [log.id for log in logs] == [5, 4, 3, 2, 1]
+
+    @pytest.mark.asyncio
+    async def test_invalid_cursor(self, async_db_session):
+        with pytest.raises(ValueError):
+            await crud.get_players(async_db_session, limit=2, cursor="not-a-cursor")
+        with pytest.raises(ValueError):
+            await crud.get_sessions_with_filters(async_db_session, cursor=crud.encode_cursor(1))
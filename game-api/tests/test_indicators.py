@@ -0,0 +1,176 @@
+"""
+Test the vectorized technical indicators and their per-month cache
+"""
+import statistics
+from datetime import date, datetime, timedelta
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from sqlalchemy import event
+
+from app import indicators
+from app.core.db import get_db
+from app.indicators import IndicatorCache, compute
+from app.models import Stock, StockPrice
+from app.price_cache import PriceCache, PriceSeries
+from app.routers import stocks
+from app.stock_catalog import StockCatalog
+
+PRICES = [100.0, 102.0, 101.0, 105.0, 103.0, 99.0, 98.0, 104.0, 108.0, 107.0,
+          110.0, 109.0, 111.0, 106.0, 112.0, 115.0, 113.0, 116.0, 114.0, 118.0]
+
+
+def make_series(symbol, prices, start=datetime(2025, 7, 1, 16)):
+    return PriceSeries(symbol, [start + timedelta(days=n) for n in range(len(prices))], prices)
+
+
+def reference(prices):
+    """Straightforward per-series implementation of the same indicators"""
+    returns = [b / a - 1 for a, b in zip(prices, prices[1:])]
+    ema = prices[0]
+    for price in prices[1:]:
+        ema += 2 / 11 * (price - ema)
+    changes = [b - a for a, b in zip(prices, prices[1:])]
+    gain, loss = max(changes[0], 0), max(-changes[0], 0)
+    for change in changes[1:]:
+        gain += (max(change, 0) - gain) / 14
+        loss += (max(-change, 0) - loss) / 14
+    peak, drawdown = prices[0], 0.0
+    for price in prices:
+        peak = max(peak, price)
+        drawdown = min(drawdown, price / peak - 1)
+    return {
+        "last_price": prices[-1],
+        "return_pct": (prices[-1] / prices[0] - 1) * 100,
+        "last_return_pct": returns[-1] * 100,
+        "sma_5": sum(prices[-5:]) / 5,
+        "sma_10": sum(prices[-10:]) / 10,
+        "ema_10": ema,
+        "rsi_14": 100 * gain / (gain + loss),
+        "volatility_pct": statistics.stdev(returns) * 100,
+        "max_drawdown_pct": drawdown * 100,
+    }
+
+
+class TestCompute:
+    """Test indicator values against a per-series reference"""
+
+    def test_matches_reference(self):
+        result = compute([make_series("AAPL", PRICES)])["AAPL"]
+
+        assert result["days"] == 20
+        assert result["first_date"] == date(2025, 7, 1)
+        assert result["last_date"] == date(2025, 7, 20)
+        for name, expected in reference(PRICES).items():
+            assert result[name] == pytest.approx(expected, abs=1e-4), name
+
+    def test_series_of_different_lengths_in_one_pass(self):
+        short = PRICES[:12]
+        results = compute([make_series("AAPL", PRICES), make_series("TSLA", short), make_series("XOM", [50.0])])
+
+        assert results["AAPL"] == compute([make_series("AAPL", PRICES)])["AAPL"]
+        tsla = results["TSLA"]
+        for name in ("last_price", "return_pct", "sma_5", "sma_10", "ema_10", "volatility_pct", "max_drawdown_pct"):
+            assert tsla[name] == pytest.approx(reference(short)[name], abs=1e-4), name
+        # Fewer than 14 daily changes
+        assert tsla["rsi_14"] is None
+
+        xom = results["XOM"]
+        assert (xom["last_price"], xom["return_pct"], xom["max_drawdown_pct"]) == (50.0, 0.0, 0.0)
+        assert xom["last_return_pct"] is None and xom["volatility_pct"] is None and xom["sma_5"] is None
+
+    def test_empty_series(self):
+        result = compute([make_series("AAPL", []), make_series("TSLA", [10.0, 11.0])])["AAPL"]
+
+        assert result["days"] == 0 and result["last_date"] is None
+        assert all(result[name] is None for name in ("last_price", "return_pct", "ema_10", "max_drawdown_pct"))
+
+    def test_flat_prices_have_neutral_rsi(self):
+        assert compute([make_series("AAPL", [10.0] * 20)])["AAPL"]["rsi_14"] == 50.0
+
+
+class TestIndicatorEndpoint:
+    """Test GET /api/stocks/indicators/{symbol} and the per-month cache behind it"""
+
+    @pytest_asyncio.fixture
+    async def client(self, db_engine, db_factory, monkeypatch):
+        async with db_factory() as db:
+            db.add_all([Stock(symbol="AAPL", company_name="Apple Inc.", category="popular"),
+                        Stock(symbol="TSLA", company_name="Tesla Inc.", category="volatile")])
+            db.add_all([StockPrice(symbol="AAPL", date=datetime(2025, 7, 1 + n), price=price)
+                        for n, price in enumerate(PRICES)])
+            db.add_all([StockPrice(symbol="TSLA", date=datetime(2025, 7, 1 + n), price=price)
+                        for n, price in enumerate(PRICES[:5])])
+            await db.commit()
+
+        statements = []
+        event.listen(db_engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *rest: statements.append(statement))
+
+        cache = IndicatorCache(max_entries=8)
+        monkeypatch.setattr(indicators, "price_cache", PriceCache(max_entries=8))
+        monkeypatch.setattr(stocks, "indicator_cache", cache)
+        monkeypatch.setattr(stocks, "stock_catalog", StockCatalog())
+
+        async def override_get_db():
+            async with db_factory() as session:
+                yield session
+
+        app = FastAPI()
+        app.include_router(stocks.router, prefix="/api/stocks")
+        app.dependency_overrides[get_db] = override_get_db
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            yield client, cache, db_factory, statements
+
+    @pytest.mark.asyncio
+    async def test_indicators_are_cached_per_month(self, client):
+        client, cache, _, statements = client
+
+        first = await client.get("/api/stocks/indicators/AAPL", params={"year": 2025, "month": 7})
+        queries = len(statements)
+        second = await client.get("/api/stocks/indicators/AAPL", params={"year": 2025, "month": 7})
+
+        assert first.status_code == second.status_code == 200
+        body = first.json()
+        assert (body["symbol"], body["year"], body["month"], body["days"]) == ("AAPL", 2025, 7, 20)
+        assert body["sma_5"] == pytest.approx(reference(PRICES)["sma_5"])
+        assert second.json() == body
+        assert len(statements) == queries
+        assert cache.stats()["hits"] == 1 and cache.stats()["computations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_symbols_are_computed_together(self, client):
+        _, cache, factory, statements = client
+
+        async with factory() as db:
+            results = await cache.get_months(db, ["AAPL", "TSLA"], 2025, 7)
+
+        assert results["TSLA"]["days"] == 5 and results["TSLA"]["sma_10"] is None
+        assert len([s for s in statements if "stock_prices" in s]) == 1
+        assert cache.stats()["computations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_month_without_prices(self, client):
+        client, cache, _, _ = client
+
+        response = await client.get("/api/stocks/indicators/AAPL", params={"year": 2025, "month": 8})
+
+        assert response.status_code == 404
+        assert cache.stats()["entries"] == 0
+
+    @pytest.mark.parametrize("symbol, params, status", [
+        ("AAPL", {"year": 2025, "month": 13}, 422),
+        ("AAPL", {"year": 0, "month": 7}, 422),
+        ("AAPL", {"year": 10000, "month": 7}, 422),
+        ("NOPE", {"year": 2025, "month": 7}, 404),
+    ])
+    @pytest.mark.asyncio
+    async def test_invalid_requests_are_not_cached(self, client, symbol, params, status):
+        client, cache, _, _ = client
+
+        response = await client.get(f"/api/stocks/indicators/{symbol}", params=params)
+
+        assert response.status_code == status
+        assert cache.stats()["entries"] == 0
@@ -0,0 +1,167 @@
+"""
+Test the incrementally maintained leaderboard aggregate
+"""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+
+from app import crud
+from app.models import Player, PlayerStats, Score, Session as GameSession, Stock, Trade
+
+
+@pytest_asyncio.fixture
+async def async_db_session(db_factory):
+    """Create an async SQLite session with one stock"""
+    async with db_factory() as session:
+        session.add(Stock(symbol="AAPL", company_name="Apple Inc.", category="popular"))
+        await session.commit()
+        yield session
+
+
+async def play_session(db, player, trades):
+    """Create a session with the given (action, qty, price) trades"""
+    session = GameSession(session_id=uuid.uuid4(), player_id=player.id,
+                          started_at=datetime(2025, 7, 1), status="active", balance=10000.0)
+    db.add(session)
+    for i, (action, qty, price) in enumerate(trades):
+        db.add(Trade(session_id=session.session_id, timestamp=datetime(2025, 7, 1) + timedelta(minutes=i),
+                     symbol="AAPL", action=action, qty=qty, price=price))
+    await db.commit()
+    return session
+
+
+async def aggregate_from_scores(db):
+    result = await db.execute(select(
+        Score.player_id, func.sum(Score.total_score), func.sum(Score.total_profit), func.sum(Score.total_trades)
+    ).group_by(Score.player_id))
+    return {row[0]: (row[1], row[2], row[3]) for row in result.all()}
+
+
+class TestLeaderboard:
+    """Test that player_stats tracks the scores table"""
+
+    @pytest.mark.asyncio
+    async def test_calculate_score_updates_aggregate(self, async_db_session):
+        alice, bob = Player(nickname="Alice"), Player(nickname="Bob")
+        async_db_session.add_all([alice, bob])
+        await async_db_session.commit()
+
+        s1 = await play_session(async_db_session, alice, [("buy", 10, 100.0), ("sell", 10, 110.0)])
+        s2 = await play_session(async_db_session, alice, [("buy", 5, 100.0)])
+        s3 = await play_session(async_db_session, bob, [("buy", 1, 100.0), ("sell", 1, 150.0)])
+        for session in (s1, s2, s3):
+            await crud.calculate_score(async_db_session, session.session_id)
+
+        stats = await async_db_session.get(PlayerStats, alice.id)
+        assert stats.score_count == 2
+        assert stats.total_trades == 3
+        assert (stats.total_score, stats.total_profit, stats.total_trades) == \
+            (await aggregate_from_scores(async_db_session))[alice.id]
+
+        leaderboard = await crud.get_leaderboard(async_db_session, top_n=10)
+        assert [p["nickname"] for p in leaderboard] == ["Bob", "Alice"]
+        assert leaderboard[0]["rank"] == 1
+        assert leaderboard[1]["total_profit"] == 100.0
+
+        by_profit = await crud.get_leaderboard(async_db_session, top_n=1, sort_by="total_profit")
+        assert [p["nickname"] for p in by_profit] == ["Alice"]
+
+    @pytest.mark.asyncio
+    async def test_delete_session_updates_aggregate(self, async_db_session):
+        alice = Player(nickname="Alice")
+        async_db_session.add(alice)
+        await async_db_session.commit()
+
+        s1 = await play_session(async_db_session, alice, [("buy", 10, 100.0), ("sell", 10, 110.0)])
+        s2 = await play_session(async_db_session, alice, [("buy", 1, 10.0), ("sell", 1, 11.0)])
+        await crud.calculate_score(async_db_session, s1.session_id)
+        await crud.calculate_score(async_db_session, s2.session_id)
+
+        assert await crud.delete_session(async_db_session, s1.session_id) is True
+        assert await crud.get_session(async_db_session, s1.session_id) is None
+
+        stats = await async_db_session.get(PlayerStats, alice.id)
+        await async_db_session.refresh(stats)
+        assert stats.score_count == 1
+        assert stats.total_trades == 2
+        assert stats.total_profit == pytest.approx(1.0)
+
+        await crud.delete_session(async_db_session, s2.session_id)
+        assert await crud.get_leaderboard(async_db_session) == []
+
+    @pytest.mark.asyncio
+    async def test_delete_missing_session(self, async_db_session):
+        assert await crud.delete_session(async_db_session, uuid.uuid4()) is False
+
+    @pytest.mark.asyncio
+    async def test_repeated_end_is_idempotent(self, async_db_session):
+        alice = Player(nickname="Alice")
+        async_db_session.add(alice)
+        await async_db_session.commit()
+
+        session = await play_session(async_db_session, alice, [("buy", 10, 100.0), ("sell", 4, 110.0)])
+        first = await crud.calculate_score(async_db_session, session.session_id)
+        for _ in range(3):
+            again = await crud.calculate_score(async_db_session, session.session_id)
+
+        assert again.id == first.id
+        assert await async_db_session.scalar(select(func.count(Score.id))) == 1
+        unsold = await crud.get_unsold_shares(async_db_session, session.session_id)
+        assert [(u.symbol, u.quantity) for u in unsold] == [("AAPL", 6)]
+
+        stats = await async_db_session.get(PlayerStats, alice.id)
+        await async_db_session.refresh(stats)
+        assert (stats.score_count, stats.total_trades, stats.total_profit) == (1, 2, 40.0)
+
+    @pytest.mark.asyncio
+    async def test_rescore_after_new_trades_moves_aggregate_by_difference(self, async_db_session):
+        alice = Player(nickname="Alice")
+        async_db_session.add(alice)
+        await async_db_session.commit()
+
+        session = await play_session(async_db_session, alice, [("buy", 10, 100.0)])
+        await crud.calculate_score(async_db_session, session.session_id)
+        async_db_session.add(Trade(session_id=session.session_id, timestamp=datetime(2025, 7, 2),
+                                   symbol="AAPL", action="sell", qty=10, price=120.0))
+        await async_db_session.commit()
+        score = await crud.calculate_score(async_db_session, session.session_id)
+
+        assert (score.total_trades, score.total_profit) == (2, 200.0)
+        assert await crud.get_unsold_shares(async_db_session, session.session_id) == []
+        stats = await async_db_session.get(PlayerStats, alice.id)
+        await async_db_session.refresh(stats)
+        assert (stats.score_count, stats.total_trades, stats.total_score, stats.total_profit) == \
+            (1, 2, score.total_score, 200.0)
+
+    @pytest.mark.asyncio
+    async def test_end_marks_session_ended_once(self, async_db_session):
+        alice = Player(nickname="Alice")
+        async_db_session.add(alice)
+        await async_db_session.commit()
+
+        session = await play_session(async_db_session, alice, [("buy", 1, 10.0)])
+        await crud.calculate_score(async_db_session, session.session_id, mark_ended=True)
+        await async_db_session.refresh(session)
+        assert session.status == "ended"
+        ended_at = session.ended_at
+        assert ended_at is not None
+
+        await crud.calculate_score(async_db_session, session.session_id, mark_ended=True)
+        await async_db_session.refresh(session)
+        assert session.ended_at == ended_at
+
+    @pytest.mark.asyncio
+    async def test_reset_all_session_data_clears_aggregate(self, async_db_session):
+        alice = Player(nickname="Alice")
+        async_db_session.add(alice)
+        await async_db_session.commit()
+        session = await play_session(async_db_session, alice, [("buy", 1, 10.0), ("sell", 1, 12.0)])
+        await crud.calculate_score(async_db_session, session.session_id)
+
+        await async_db_session.run_sync(crud.reset_all_session_data)
+
+        assert await async_db_session.scalar(select(func.count()).select_from(PlayerStats)) == 0
+        assert await crud.get_leaderboard(async_db_session) == []
@@ -0,0 +1,394 @@
+"""
+Test trade validation and pricing against in-memory session portfolios
+"""
+import asyncio
+import json
+import uuid
+from datetime import date, datetime, timedelta
+
+import httpx
+import numpy as np
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI, HTTPException
+from sqlalchemy import event, select
+
+from app import schemas
+from app.core.db import get_db
+from app.models import Player, Session as SessionModel, SessionSelection, Stock, StockPrice, Trade
+from app.portfolio import PortfolioBook, TradeRejected, running_totals
+from app.price_cache import price_cache
+from app.routers import sessions, trades
+from app.trade_ingest import TradeIngestor
+
+SESSION_ID = uuid.uuid4()
+
+
+def make_trade(action="buy", qty=1, symbol="AAPL", price=999.0, client_trade_id=None):
+    return schemas.TradeCreate(session_id=SESSION_ID, timestamp=datetime(2025, 8, 1, 10), symbol=symbol,
+                               action=action, qty=qty, price=price, client_trade_id=client_trade_id)
+
+
+class RecordingSubmit:
+    """Stands in for the ingestor: stores trades in a list and returns them as rows"""
+
+    def __init__(self):
+        self.rows = []
+
+    async def __call__(self, trade):
+        row = {**trade.model_dump(), "trade_id": len(self.rows) + 1}
+        row["client_trade_id"] = row["client_trade_id"] or f"generated-{row['trade_id']}"
+        self.rows.append(row)
+        return row
+
+
+@pytest_asyncio.fixture
+async def database(db_engine, db_factory):
+    """Seed a session that bought 5 AAPL and sold 2; record the statements sent after seeding"""
+    async with db_factory() as db:
+        db.add(Player(id=1, nickname="trader"))
+        db.add_all([Stock(symbol=symbol, company_name=symbol, category="popular")
+                    for symbol in ("AAPL", "TSLA", "MSFT")])
+        db.add_all([
+            StockPrice(symbol="AAPL", date=datetime(2025, 7, 1), price=101.0),
+            StockPrice(symbol="AAPL", date=datetime(2025, 7, 2), price=102.0),
+            StockPrice(symbol="AAPL", date=datetime(2025, 7, 3), price=103.0),
+            StockPrice(symbol="TSLA", date=datetime(2025, 7, 2), price=201.0),
+            StockPrice(symbol="MSFT", date=datetime(2025, 7, 1), price=301.0),
+        ])
+        db.add(SessionModel(session_id=SESSION_ID, player_id=1, started_at=datetime(2025, 8, 1),
+                            status="active", balance=1000.0))
+        await db.flush()
+        db.add(SessionSelection(session_id=SESSION_ID, popular_symbol="AAPL", volatile_symbol="TSLA",
+                                sector_symbol="MSFT", month=7, year=2025))
+        db.add(Trade(session_id=SESSION_ID, timestamp=datetime(2025, 8, 1, 9), symbol="AAPL", action="buy",
+                     qty=5, price=100.0, client_trade_id="old-buy"))
+        db.add(Trade(session_id=SESSION_ID, timestamp=datetime(2025, 8, 1, 9, 5), symbol="AAPL", action="sell",
+                     qty=2, price=110.0))
+        await db.commit()
+
+    statements = []
+    event.listen(db_engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *rest: statements.append(statement))
+    price_cache.invalidate()
+
+    yield db_factory, statements
+
+    price_cache.invalidate()
+
+
+class TestPortfolioBook:
+    """Test hydration, validation and pricing of trades"""
+
+    @pytest.mark.asyncio
+    async def test_hydrated_once_from_recorded_trades(self, database):
+        factory, statements = database
+        book = PortfolioBook(factory)
+
+        portfolio = await book.get(SESSION_ID)
+        assert portfolio.holdings == {"AAPL": 3, "TSLA": 0, "MSFT": 0}
+        assert portfolio.cash == pytest.approx(1000.0 - 500.0 + 220.0)
+        assert [list(lot) for lot in portfolio.score.lots["AAPL"]] == [[3, 100.0]]
+
+        statements.clear()
+        submit = RecordingSubmit()
+        for _ in range(3):
+            await book.record(make_trade("sell", 1), submit)
+        assert statements == []
+        assert portfolio.holdings["AAPL"] == 0
+        assert book.stats()["hydrations"] == 1 and book.stats()["accepted"] == 3
+
+    @pytest.mark.asyncio
+    async def test_concurrent_first_trades_share_hydration(self, database):
+        factory, _ = database
+        book = PortfolioBook(factory)
+        first, second = await asyncio.gather(book.get(SESSION_ID), book.get(SESSION_ID))
+        assert first is second
+        assert book.stats()["hydrations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_priced_at_the_market_date(self, database):
+        factory, _ = database
+        book = PortfolioBook(factory)
+        submit = RecordingSubmit()
+
+        # Before the stream has delivered a date, trades are priced at the first trading day
+        assert (await book.record(make_trade(), submit))["price"] == 101.0
+        book.advance(SESSION_ID, date(2025, 7, 2))
+        assert (await book.record(make_trade(), submit))["price"] == 102.0
+        # MSFT has no close on 2025-07-02, so its last close before it is used
+        assert (await book.record(make_trade(symbol="MSFT"), submit))["price"] == 301.0
+
+        portfolio = await book.get(SESSION_ID)
+        assert portfolio.cash == pytest.approx(720.0 - 101.0 - 102.0 - 301.0)
+
+    @pytest.mark.parametrize("trade, market_date, message", [
+        (make_trade("sell", 4), None, "only 3 held"),
+        (make_trade("buy", 8), None, "Insufficient cash"),
+        (make_trade(symbol="NVDA"), None, "not one of this session's stocks"),
+        (make_trade(symbol="TSLA"), date(2025, 7, 1), "No price for TSLA"),
+    ])
+    @pytest.mark.asyncio
+    async def test_invalid_trades_rejected(self, database, trade, market_date, message):
+        factory, _ = database
+        book = PortfolioBook(factory)
+        submit = RecordingSubmit()
+        (await book.get(SESSION_ID)).market_date = market_date
+
+        with pytest.raises(TradeRejected, match=message):
+            await book.record(trade, submit)
+        assert submit.rows == []
+        assert book.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrent_sells_cannot_spend_the_same_shares(self, database):
+        factory, _ = database
+        book = PortfolioBook(factory)
+        submit = RecordingSubmit()
+
+        results = await asyncio.gather(book.record(make_trade("sell", 3), submit),
+                                       book.record(make_trade("sell", 3), submit),
+                                       return_exceptions=True)
+
+        assert sum(isinstance(result, TradeRejected) for result in results) == 1
+        assert len(submit.rows) == 1
+
+    @pytest.mark.asyncio
+    async def test_retries_are_not_applied_twice(self, database):
+        factory, _ = database
+        book = PortfolioBook(factory)
+        submit = RecordingSubmit()
+
+        await book.record(make_trade("sell", 3, client_trade_id="tap-1"), submit)
+        # Neither a retry of it nor one of a trade recorded before hydration is checked or applied again
+        await book.record(make_trade("sell", 3, client_trade_id="tap-1"), submit)
+        await book.record(make_trade("buy", 5, client_trade_id="old-buy"), submit)
+
+        portfolio = await book.get(SESSION_ID)
+        assert portfolio.holdings["AAPL"] == 0
+        assert portfolio.cash == pytest.approx(720.0 + 3 * 101.0)
+
+    @pytest.mark.asyncio
+    async def test_ended_sessions_rejected(self, database):
+        factory, _ = database
+        book = PortfolioBook(factory)
+        (await book.get(SESSION_ID)).status = "ended"
+        with pytest.raises(TradeRejected, match="Session has ended"):
+            await book.record(make_trade(), RecordingSubmit())
+
+    @pytest.mark.asyncio
+    async def test_unknown_session(self, database):
+        factory, _ = database
+        with pytest.raises(LookupError):
+            await PortfolioBook(factory).get(uuid.uuid4())
+
+
+class TestPostTrade:
+    """Test POST /api/trades/ through the portfolio and the ingestor"""
+
+    @pytest.mark.asyncio
+    async def test_errors_map_to_status_codes(self, database, monkeypatch):
+        factory, _ = database
+        monkeypatch.setattr(trades, "portfolios", PortfolioBook(factory))
+        monkeypatch.setattr(trades, "trade_ingestor", TradeIngestor(factory, window_seconds=0.001))
+
+        stored = await trades.post_trade(make_trade("sell", 1, client_trade_id="tap-2"))
+        assert stored["client_trade_id"] == "tap-2"
+        assert stored["price"] == 101.0
+
+        async with factory() as db:
+            recorded = (await db.execute(select(Trade).filter(Trade.client_trade_id == "tap-2"))).scalar_one()
+        assert recorded.price == 101.0
+
+        with pytest.raises(HTTPException) as error:
+            await trades.post_trade(make_trade("sell", 5))
+        assert error.value.status_code == 400
+        assert "only 2 held" in error.value.detail
+
+        with pytest.raises(HTTPException) as error:
+            await trades.post_trade(make_trade().model_copy(update={"session_id": uuid.uuid4()}))
+        assert error.value.status_code == 404
+
+
+class TestLiveScore:
+    """Test the live score endpoint and finalizing it when the session ends"""
+
+    @pytest_asyncio.fixture
+    async def routed(self, database, monkeypatch):
+        factory, statements = database
+        book = PortfolioBook(factory)
+        monkeypatch.setattr(trades, "portfolios", book)
+        monkeypatch.setattr(sessions, "portfolios", book)
+        monkeypatch.setattr(trades, "trade_ingestor", TradeIngestor(factory, window_seconds=0.001))
+        return factory, statements, book
+
+    @pytest.mark.asyncio
+    async def test_live_score_follows_trades(self, routed):
+        factory, _, book = routed
+        live = await sessions.get_live_score(SESSION_ID)
+        assert (live["total_trades"], live["total_profit"], live["total_score"]) == (2, 20.0, 4)
+        assert live["holdings"] == {"AAPL": 3}
+
+        book.advance(SESSION_ID, date(2025, 7, 3))
+        await trades.post_trade(make_trade("sell", 3))
+        live = await sessions.get_live_score(SESSION_ID)
+        # 3 more shares bought at 100 sold at 103: +9.0 and one bonus point
+        assert (live["total_trades"], live["total_profit"], live["total_score"]) == (3, 29.0, 6)
+        assert live["holdings"] == {}
+        assert live["cash"] == pytest.approx(720.0 + 309.0)
+
+        with pytest.raises(HTTPException) as error:
+            await sessions.get_live_score(uuid.uuid4())
+        assert error.value.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_end_finalizes_the_live_score(self, routed):
+        factory, statements, book = routed
+        await trades.post_trade(make_trade("buy", 2))
+        expected = (await book.get(SESSION_ID)).score.result()
+
+        statements.clear()
+        async with factory() as db:
+            score = await sessions.end_session(SESSION_ID, db)
+
+        assert (score.total_trades, score.total_profit, score.total_score) == expected[:3]
+        # Only counted, not read back and scored again
+        assert not any("trades.action" in statement for statement in statements)
+        assert book.peek(SESSION_ID) is None
+
+    @pytest.mark.asyncio
+    async def test_end_rescores_a_stale_live_score(self, routed):
+        factory, statements, book = routed
+        portfolio = await book.get(SESSION_ID)
+        async with factory() as db:
+            # Recorded behind this worker's back, e.g. by another worker
+            db.add(Trade(session_id=SESSION_ID, timestamp=datetime(2025, 8, 1, 11), symbol="AAPL", action="sell",
+                         qty=3, price=130.0))
+            await db.commit()
+
+        statements.clear()
+        async with factory() as db:
+            score = await sessions.end_session(SESSION_ID, db)
+
+        assert score.total_trades == 3
+        assert score.total_trades != portfolio.score.total_trades
+        assert any("trades.action" in statement for statement in statements)
+
+
+class TestBulkTrades:
+    """Test POST /api/trades/bulk and the vectorized portfolio checks"""
+
+    @pytest_asyncio.fixture
+    async def client(self, database, monkeypatch):
+        factory, statements = database
+        book = PortfolioBook(factory)
+        monkeypatch.setattr(trades, "portfolios", book)
+        monkeypatch.setattr(trades.settings, "TRADE_BULK_MAX_TRADES", 1000)
+
+        async def override_get_db():
+            async with factory() as session:
+                yield session
+
+        app = FastAPI()
+        app.include_router(trades.router, prefix="/api")
+        app.dependency_overrides[get_db] = override_get_db
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            yield client, factory, book
+
+    @staticmethod
+    def bulk(*trades_in, minute=10):
+        start = datetime(2025, 8, 1, 10)
+        return [{"session_id": str(SESSION_ID), "timestamp": (start + timedelta(minutes=minute + n)).isoformat(),
+                 "symbol": symbol, "action": action, "qty": qty, "price": price}
+                for n, (symbol, action, qty, price) in enumerate(trades_in)]
+
+    def test_running_totals(self):
+        values = np.array([1, 2, 3, 4, 5, 6])
+        groups = np.array([0, 1, 0, 2, 1, 0])
+        assert running_totals(values, groups).tolist() == [1, 2, 4, 4, 7, 10]
+
+    @pytest.mark.asyncio
+    async def test_json_array(self, client):
+        client, factory, book = client
+        payload = self.bulk(("AAPL", "sell", 3, 105.0), ("MSFT", "buy", 2, 300.0), ("MSFT", "sell", 1, 310.0))
+        response = await client.post("/api/trades/bulk", json=payload)
+
+        assert response.status_code == 200
+        body = response.json()
+        assert (body["inserted"], body["duplicates"], body["method"]) == (3, 0, "insert")
+        assert body["trades_per_second"] > 0
+        portfolio = book.peek(SESSION_ID)
+        assert portfolio.holdings == {"AAPL": 0, "TSLA": 0, "MSFT": 1}
+        # Priced at the first trading day's closes, not the posted prices
+        assert portfolio.cash == pytest.approx(720.0 + 303.0 - 602.0 + 301.0)
+        async with factory() as db:
+            recorded = (await db.execute(select(Trade).order_by(Trade.timestamp))).scalars().all()
+        assert [trade.price for trade in recorded] == [100.0, 110.0, 101.0, 301.0, 301.0]
+
+    @pytest.mark.asyncio
+    async def test_client_prices_cannot_inflate_the_score(self, client):
+        client, _, book = client
+        payload = self.bulk(("MSFT", "buy", 1, 0.01), ("MSFT", "sell", 1, 10000.0))
+        response = await client.post("/api/trades/bulk", json=payload)
+
+        assert response.status_code == 200, response.text
+        portfolio = book.peek(SESSION_ID)
+        assert portfolio.cash == pytest.approx(720.0)
+        assert portfolio.score.total_profit == pytest.approx(20.0)  # Only the recorded AAPL sell
+
+    @pytest.mark.asyncio
+    async def test_ndjson_out_of_order_with_duplicates(self, client):
+        client, _, book = client
+        # The sell comes first in the body but after the buy in time
+        payload = self.bulk(("MSFT", "buy", 1, 300.0), ("MSFT", "sell", 1, 310.0))[::-1]
+        payload[0]["client_trade_id"] = payload[1]["client_trade_id"] = "line"  # Same key: the first in time wins
+        payload.append({**payload[1], "client_trade_id": "old-buy"})  # Recorded before the import
+        body = "\n".join(json.dumps(row) for row in payload) + "\n"
+
+        response = await client.post("/api/trades/bulk", content=body,
+                                     headers={"content-type": "application/x-ndjson"})
+
+        assert response.status_code == 200, response.text
+        assert (response.json()["inserted"], response.json()["duplicates"]) == (1, 2)
+        assert book.peek(SESSION_ID).holdings["MSFT"] == 1
+
+    @pytest.mark.parametrize("payload, message", [
+        (bulk.__func__(("AAPL", "sell", 2, 105.0), ("AAPL", "sell", 2, 105.0)), "Trade 1: Cannot sell 2 AAPL: only 1 held"),
+        (bulk.__func__(("MSFT", "buy", 2, 300.0), ("TSLA", "buy", 1, 200.0)), "Trade 1: Insufficient cash"),
+        (bulk.__func__(("NVDA", "buy", 1, 10.0)), "Trade 0: NVDA is not one of this session's stocks"),
+        (bulk.__func__(("AAPL", "buy", 1, 10.0), minute=-120), "Trade 0: Timestamp is before"),
+    ])
+    @pytest.mark.asyncio
+    async def test_rejected_batches_record_nothing(self, client, payload, message):
+        client, factory, book = client
+        response = await client.post("/api/trades/bulk", json=payload)
+
+        assert response.status_code == 400
+        assert response.json()["detail"].startswith(message)
+        assert book.peek(SESSION_ID).holdings["AAPL"] == 3
+        async with factory() as db:
+            assert len((await db.execute(select(Trade))).scalars().all()) == 2
+
+    @pytest.mark.asyncio
+    async def test_invalid_and_oversized_requests(self, client):
+        client, _, _ = client
+        payload = self.bulk(("AAPL", "sell", 1, 105.0))
+        payload[0]["qty"] = 0
+        response = await client.post("/api/trades/bulk", json=payload)
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == [0, "qty"]
+
+        response = await client.post("/api/trades/bulk", json=self.bulk(("AAPL", "buy", 1, 1.0)) * 1001)
+        assert response.status_code == 413
+        # Counted before validation: invalid lines beyond the limit are not reported one by one
+        response = await client.post("/api/trades/bulk", content=b"{}\n" * 1001,
+                                     headers={"content-type": "application/x-ndjson"})
+        assert response.status_code == 413
+        # Rejected on Content-Length alone
+        padded = json.dumps(self.bulk(("AAPL", "buy", 1, 1.0))) + " " * 1000 * 1024
+        assert (await client.post("/api/trades/bulk", content=padded,
+                                  headers={"content-type": "application/json"})).status_code == 413
+
+        unknown = self.bulk(("AAPL", "buy", 1, 1.0))
+        unknown[0]["session_id"] = str(uuid.uuid4())
+        assert (await client.post("/api/trades/bulk", json=unknown)).status_code == 404
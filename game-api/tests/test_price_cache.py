@@ -0,0 +1,182 @@
+"""
+Test the shared month-price cache
+"""
+import asyncio
+from datetime import date, datetime
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+
+from app import crud
+from app.models import Stock, StockPrice
+from app.price_cache import PriceCache, month_bounds
+
+
+class TestPriceCache:
+    """Test the (symbol, year, month) price series cache"""
+
+    @pytest_asyncio.fixture
+    async def async_db_session(self, db_factory):
+        """Create an async SQLite session seeded with a few prices"""
+        async with db_factory() as session:
+            session.add_all([
+                Stock(symbol="AAPL", company_name="Apple Inc.", category="popular"),
+                Stock(symbol="TSLA", company_name="Tesla Inc.", category="volatile"),
+            ])
+            session.add_all([
+                StockPrice(symbol="AAPL", date=datetime(2025, 7, 3), price=103.0),
+                StockPrice(symbol="AAPL", date=datetime(2025, 7, 1), price=101.0),
+                StockPrice(symbol="AAPL", date=datetime(2025, 7, 2), price=102.0),
+                StockPrice(symbol="AAPL", date=datetime(2025, 8, 1), price=110.0),
+                StockPrice(symbol="TSLA", date=datetime(2025, 7, 1), price=250.0),
+            ])
+            await session.commit()
+            yield session
+
+    def test_month_bounds(self):
+        assert month_bounds(2024, 2) == (date(2024, 2, 1), date(2024, 2, 29))
+        assert month_bounds(2025, 12) == (date(2025, 12, 1), date(2025, 12, 31))
+
+    @pytest.mark.asyncio
+    async def test_miss_then_hit(self, async_db_session):
+        cache = PriceCache(max_entries=8)
+
+        series = await cache.get_month(async_db_session, "AAPL", 2025, 7)
+        assert series.dates == (date(2025, 7, 1), date(2025, 7, 2), date(2025, 7, 3))
+        assert list(series.prices) == [101.0, 102.0, 103.0]
+        assert series.position(date(2025, 7, 2)) == 1
+        assert series.position(date(2025, 7, 4)) is None
+
+        again = await cache.get_month(async_db_session, "AAPL", 2025, 7)
+        assert again is series
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["entries"] == 1
+
+    @pytest.mark.asyncio
+    async def test_empty_months_are_not_cached(self, async_db_session):
+        cache = PriceCache(max_entries=8)
+
+        assert len(await cache.get_month(async_db_session, "NOPE", 2025, 7)) == 0
+        assert len(await cache.get_month(async_db_session, "AAPL", 2030, 1)) == 0
+        assert cache.stats()["entries"] == 0
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self, async_db_session):
+        cache = PriceCache(max_entries=2)
+
+        await cache.get_month(async_db_session, "AAPL", 2025, 7)
+        await cache.get_month(async_db_session, "TSLA", 2025, 7)
+        await cache.get_month(async_db_session, "AAPL", 2025, 7)  # refresh AAPL
+        await cache.get_month(async_db_session, "AAPL", 2025, 8)  # evicts TSLA
+
+        assert len(cache) == 2
+        assert cache.evictions == 1
+        await cache.get_month(async_db_session, "AAPL", 2025, 7)
+        assert cache.misses == 3
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_share_one_load(self, async_db_session):
+        cache = PriceCache(max_entries=8)
+
+        first, second = await asyncio.gather(
+            cache.get_month(async_db_session, "AAPL", 2025, 7),
+            cache.get_month(async_db_session, "AAPL", 2025, 7),
+        )
+        assert first is second
+        assert cache.misses == 1
+
+    @pytest.mark.asyncio
+    async def test_cancelled_load_does_not_strand_waiters(self, async_db_session, monkeypatch):
+        cache = PriceCache(max_entries=8)
+        started = asyncio.Event()
+        real_load = crud.get_stock_prices_many
+
+        async def slow_load(*args):
+            if not started.is_set():
+                started.set()
+                await asyncio.sleep(3600)
+            return await real_load(*args)
+
+        monkeypatch.setattr(crud, "get_stock_prices_many", slow_load)
+        owner = asyncio.create_task(cache.get_month(async_db_session, "AAPL", 2025, 7))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_month(async_db_session, "AAPL", 2025, 7))
+        await asyncio.sleep(0)
+        owner.cancel()
+
+        series = await asyncio.wait_for(waiter, timeout=5)
+        assert list(series.prices) == [101.0, 102.0, 103.0]
+        assert owner.cancelled()
+        assert not cache._loading
+
+    @pytest.mark.asyncio
+    async def test_get_range_within_month_is_cached(self, async_db_session):
+        cache = PriceCache(max_entries=8)
+
+        prices = await cache.get_range(async_db_session, "AAPL", date(2025, 7, 2), date(2025, 7, 31))
+        assert [p["price"] for p in prices] == [102.0, 103.0]
+        assert prices[0]["date"] == datetime(2025, 7, 2)
+        assert len(cache) == 1
+
+    @pytest.mark.asyncio
+    async def test_wide_range_bypasses_cache(self, async_db_session):
+        cache = PriceCache(max_entries=8)
+        statements = []
+        engine = async_db_session.bind.sync_engine
+        record = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            prices = await cache.get_range(async_db_session, "AAPL", date(1990, 1, 1), date(9999, 12, 31))
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        assert [p["price"] for p in prices] == [101.0, 102.0, 103.0, 110.0]
+        assert prices[0] == {"symbol": "AAPL", "price": 101.0, "date": datetime(2025, 7, 1)}
+        assert len(statements) == 1
+        assert len(cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_get_stock_prices_many_is_columnar(self, async_db_session):
+        series = await crud.get_stock_prices_many(
+            async_db_session, ["AAPL", "TSLA", "NONE"], date(2025, 7, 1), date(2025, 7, 31)
+        )
+        assert series["AAPL"]["prices"] == [101.0, 102.0, 103.0]
+        assert series["AAPL"]["dates"][0] == datetime(2025, 7, 1)
+        assert series["TSLA"]["prices"] == [250.0]
+        assert series["NONE"] == {"dates": [], "prices": []}
+
+    @pytest.mark.asyncio
+    async def test_get_months_loads_misses_in_one_query(self, async_db_session):
+        cache = PriceCache(max_entries=8)
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = async_db_session.bind.sync_engine
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            month = await cache.get_months(async_db_session, ["AAPL", "TSLA", "MSFT"], 2025, 7)
+            assert len(statements) == 1
+            await cache.get_months(async_db_session, ["AAPL", "TSLA", "MSFT"], 2025, 7)
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+
+        # MSFT has no prices, so only its empty month is read again
+        assert len(statements) == 2
+        assert cache.stats()["hits"] == 2
+        assert len(month["AAPL"]) == 3
+        assert len(month["MSFT"]) == 0
+
+    @pytest.mark.asyncio
+    async def test_invalidate_symbol(self, async_db_session):
+        cache = PriceCache(max_entries=8)
+
+        await cache.get_months(async_db_session, ["AAPL", "TSLA"], 2025, 7)
+        cache.invalidate("AAPL")
+        assert len(cache) == 1
+        cache.invalidate()
+        assert len(cache) == 0
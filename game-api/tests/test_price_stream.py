@@ -0,0 +1,511 @@
+"""
+Test the broadcast hub behind the price WebSocket stream
+"""
+import asyncio
+import json
+import uuid
+from datetime import date, datetime
+
+import pytest
+import pytest_asyncio
+from fastapi import WebSocketDisconnect
+from sqlalchemy import event, select
+
+from app import crud, price_stream
+from app.price_cache import PriceSeries
+from app.models import Player, Session as SessionModel, SessionSelection, Stock
+from app.price_stream import (ENCODINGS, PROTOCOLS, CursorCheckpointer, MsgpackEncoding, PriceStreamHub,
+                              PriceTimeline)
+from app.routers import ws as ws_router
+from app.routers.ws import pump_stream
+
+
+class FakeWebSocket:
+    """Collects sent frames; receive blocks until disconnect() is called"""
+
+    def __init__(self, fail_sends=False):
+        self.sent = []
+        self.fail_sends = fail_sends
+        self.closed = asyncio.Event()
+        self.incoming = asyncio.Queue()
+
+    async def send_text(self, text):
+        if self.fail_sends:
+            raise RuntimeError("socket closed")
+        self.sent.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        import msgpack
+        self.sent.append(msgpack.unpackb(data))
+
+    async def receive_text(self):
+        closed = asyncio.ensure_future(self.closed.wait())
+        message = asyncio.ensure_future(self.incoming.get())
+        await asyncio.wait({closed, message}, return_when=asyncio.FIRST_COMPLETED)
+        closed.cancel()
+        if message.done():
+            return message.result()
+        message.cancel()
+        raise WebSocketDisconnect(1000)
+
+    def disconnect(self):
+        self.closed.set()
+
+    async def accept(self):
+        pass
+
+    async def close(self):
+        self.closed.set()
+
+
+def make_timeline():
+    series = {
+        "AAPL": PriceSeries("AAPL", [datetime(2025, 7, 1), datetime(2025, 7, 2), datetime(2025, 7, 3)],
+                            [101.0, 102.0, 103.0]),
+        "TSLA": PriceSeries("TSLA", [datetime(2025, 7, 2), datetime(2025, 7, 3)], [201.0, 202.0]),
+        "MSFT": PriceSeries("MSFT", [], []),
+    }
+    return PriceTimeline(7, 2025, ("AAPL", "TSLA", "MSFT"), series)
+
+
+class TestPriceStreamHub:
+    """Test timelines, grouping and fan-out"""
+
+    def test_timeline(self):
+        timeline = make_timeline()
+        assert timeline.dates == [date(2025, 7, 1), date(2025, 7, 2), date(2025, 7, 3)]
+        assert [p["symbol"] for p in timeline.prices[0]] == ["AAPL"]
+        assert [p["price"] for p in timeline.prices[1]] == [102.0, 201.0]
+
+    def test_json_frames_are_spliced(self):
+        timeline = make_timeline()
+        encoding = ENCODINGS["json"]
+        bodies = timeline.bodies(encoding)
+        assert timeline.bodies(encoding) is bodies
+
+        frame = json.loads(encoding.prefix("abc") + bodies[2] + encoding.suffix("2025-08-01T10:00:00"))
+        assert frame == {
+            "session_id": "abc",
+            "current_date": "2025-07-03",
+            "prices": [
+                {"symbol": "AAPL", "price": 103.0, "date": "2025-07-03", "timestamp": "2025-07-03T00:00:00"},
+                {"symbol": "TSLA", "price": 202.0, "date": "2025-07-03", "timestamp": "2025-07-03T00:00:00"},
+            ],
+            "stream_info": {"date_index": 3, "total_dates": 3, "month": "July", "year": 2025},
+            "timestamp": "2025-08-01T10:00:00",
+        }
+
+    def test_stdlib_json_fallback(self, monkeypatch):
+        timeline = make_timeline()
+        expected = PriceTimeline(7, 2025, timeline.symbols, timeline.series).bodies(ENCODINGS["json"])
+        monkeypatch.setattr(price_stream, "orjson", None)
+        assert [json.loads("{" + body[:-1] + "}") for body in timeline.bodies(ENCODINGS["json"])] == \
+            [json.loads("{" + body[:-1] + "}") for body in expected]
+
+    def test_msgpack_frames_are_spliced(self):
+        msgpack = pytest.importorskip("msgpack")
+        timeline = make_timeline()
+        encoding = MsgpackEncoding()
+        json_frame = json.loads(ENCODINGS["json"].prefix("abc") + timeline.bodies(ENCODINGS["json"])[0]
+                                + ENCODINGS["json"].suffix("now"))
+
+        frame = msgpack.unpackb(encoding.prefix("abc") + timeline.bodies(encoding)[0] + encoding.suffix("now"))
+        assert frame == json_frame
+
+    def test_timelines_are_shared_until_series_change(self):
+        hub = PriceStreamHub()
+        series = {"AAPL": PriceSeries("AAPL", [datetime(2025, 7, 1)], [101.0])}
+        timeline = hub.timeline(7, 2025, ("AAPL",), series)
+        assert hub.timeline(7, 2025, ("AAPL",), dict(series)) is timeline
+
+        reloaded = {"AAPL": PriceSeries("AAPL", [datetime(2025, 7, 1)], [101.0])}
+        assert hub.timeline(7, 2025, ("AAPL",), reloaded) is not timeline
+        assert hub.timelines_built == 2
+
+    @pytest.mark.asyncio
+    async def test_subscribers_share_rendered_frames(self):
+        hub = PriceStreamHub(tick_seconds=0.05, slots_per_tick=5)
+        timeline = make_timeline()
+        sockets = [FakeWebSocket() for _ in range(3)]
+        subscriptions = [hub.subscribe(ws, f"session-{i}", timeline) for i, ws in enumerate(sockets)]
+
+        assert hub.stats()["groups"] == 1
+        results = await asyncio.wait_for(
+            asyncio.gather(*(pump_stream(ws, s) for ws, s in zip(sockets, subscriptions))), timeout=5)
+        assert results == [None, None, None]
+
+        for i, ws in enumerate(sockets):
+            assert [frame["session_id"] for frame in ws.sent] == [f"session-{i}"] * 3
+            assert [frame["stream_info"]["date_index"] for frame in ws.sent] == [1, 2, 3]
+        assert len(timeline.bodies(ENCODINGS["json"])) == 3
+        assert hub.frames_queued == 9
+        assert hub.stats()["groups"] == 0
+
+    @pytest.mark.asyncio
+    async def test_late_subscriber_gets_its_own_phase(self):
+        hub = PriceStreamHub(tick_seconds=0.05, slots_per_tick=5)
+        timeline = make_timeline()
+        first_ws = FakeWebSocket()
+        first = hub.subscribe(first_ws, "first", timeline)
+        first_pump = asyncio.ensure_future(pump_stream(first_ws, first))
+        await asyncio.sleep(0.03)
+        late_ws = FakeWebSocket()
+        late = hub.subscribe(late_ws, "late", timeline)
+
+        assert hub.stats()["groups"] == 2
+        await asyncio.wait_for(asyncio.gather(first_pump, pump_stream(late_ws, late)), timeout=5)
+        # The late subscriber still receives the month from the first day
+        assert [frame["current_date"] for frame in late_ws.sent] == ["2025-07-01", "2025-07-02", "2025-07-03"]
+
+    @pytest.mark.asyncio
+    async def test_failed_send_ends_only_that_stream(self):
+        hub = PriceStreamHub(tick_seconds=0.05, slots_per_tick=5)
+        timeline = make_timeline()
+        healthy, broken = FakeWebSocket(), FakeWebSocket(fail_sends=True)
+        good = hub.subscribe(healthy, "good", timeline)
+        bad = hub.subscribe(broken, "bad", timeline)
+
+        assert isinstance(await asyncio.wait_for(pump_stream(broken, bad), timeout=5), RuntimeError)
+        hub.unsubscribe(bad)
+        assert await asyncio.wait_for(pump_stream(healthy, good), timeout=5) is None
+        assert len(healthy.sent) == 3
+
+    @pytest.mark.asyncio
+    async def test_slow_subscriber_is_dropped(self):
+        hub = PriceStreamHub(tick_seconds=0.02, slots_per_tick=1, max_backlog=1)
+        slow = hub.subscribe(FakeWebSocket(), "slow", make_timeline())
+
+        # Nobody drains the socket, so the second tick finds the first frame still queued
+        while not slow.complete:
+            await asyncio.sleep(0.01)
+        assert isinstance(slow.error, RuntimeError)
+        assert hub.dropped_subscribers == 1
+        assert hub.stats()["groups"] == 0
+
+    @pytest.mark.asyncio
+    async def test_disconnect_unsubscribes(self):
+        hub = PriceStreamHub(tick_seconds=10.0, slots_per_tick=10)
+        ws = FakeWebSocket()
+        subscription = hub.subscribe(ws, "gone", make_timeline())
+
+        ws.disconnect()
+        with pytest.raises(WebSocketDisconnect):
+            await asyncio.wait_for(pump_stream(ws, subscription), timeout=5)
+        hub.unsubscribe(subscription)
+
+        assert hub.stats()["groups"] == 0
+        await asyncio.wait_for(hub._task, timeout=5)
+
+    @pytest.mark.asyncio
+    async def test_encodings_stream_in_separate_groups(self):
+        pytest.importorskip("msgpack")
+        hub = PriceStreamHub(tick_seconds=0.05, slots_per_tick=5)
+        timeline = make_timeline()
+        text_ws, binary_ws = FakeWebSocket(), FakeWebSocket()
+        text = hub.subscribe(text_ws, "text", timeline)
+        binary = hub.subscribe(binary_ws, "binary", timeline, ENCODINGS["msgpack"])
+
+        assert hub.stats()["groups"] == 2
+        await asyncio.wait_for(asyncio.gather(pump_stream(text_ws, text), pump_stream(binary_ws, binary)), timeout=5)
+        assert [f["prices"] for f in text_ws.sent] == [f["prices"] for f in binary_ws.sent]
+
+
+def decode_deltas(header, frames):
+    """Rebuild {date: {symbol: price}} from delta protocol frames the way a client would"""
+    scale, symbols = header["scale"], header["symbols"]
+    current, previous, decoded = None, [None] * len(symbols), {}
+    for frame in frames:
+        if "p" in frame:
+            current = frame["p"]
+        else:
+            current = [change if change is None or before is None else before + change
+                       for change, before in zip(frame["d"], previous)]
+        decoded[header["dates"][frame["i"]]] = {
+            symbol: value / scale for symbol, value in zip(symbols, current) if value is not None
+        }
+        previous = current
+    return decoded
+
+
+class TestDeltaProtocol:
+    """Test the compact header + delta frame protocol"""
+
+    EXPECTED = {
+        "2025-07-01": {"AAPL": 101.0},
+        "2025-07-02": {"AAPL": 102.0, "TSLA": 201.0},
+        "2025-07-03": {"AAPL": 103.0, "TSLA": 202.0},
+    }
+
+    def test_delta_bodies(self):
+        timeline = make_timeline()
+        encoding = ENCODINGS["json"]
+        assert [json.loads(body) for body in timeline.delta_bodies(encoding, key=False)] == [
+            {"i": 0, "d": [1010000, None, None]},
+            {"i": 1, "d": [10000, 2010000, None]},
+            {"i": 2, "d": [10000, 10000, None]},
+        ]
+        assert json.loads(timeline.delta_bodies(encoding, key=True)[2]) == {"i": 2, "p": [1030000, 2020000, None]}
+
+    def test_header(self):
+        header = PROTOCOLS["delta"].header(make_timeline(), "abc")
+        assert header["dates"] == ["2025-07-01", "2025-07-02", "2025-07-03"]
+        assert header["symbols"] == ["AAPL", "TSLA", "MSFT"]
+        assert header["month"] == "July" and header["total_dates"] == 3
+
+    @pytest.mark.asyncio
+    async def test_stream_decodes_to_prices(self):
+        hub = PriceStreamHub(tick_seconds=0.05, slots_per_tick=5)
+        timeline = make_timeline()
+        ws = FakeWebSocket()
+        subscription = hub.subscribe(ws, "mobile", timeline, protocol=PROTOCOLS["delta"])
+
+        assert await asyncio.wait_for(pump_stream(ws, subscription), timeout=5) is None
+        # The first frame has no predecessor, so it is a key frame
+        assert "p" in ws.sent[0] and all("d" in frame for frame in ws.sent[1:])
+        assert decode_deltas(PROTOCOLS["delta"].header(timeline, "mobile"), ws.sent) == self.EXPECTED
+
+    @pytest.mark.asyncio
+    async def test_key_frame_after_seek_and_resume(self):
+        hub = PriceStreamHub(tick_seconds=10.0, slots_per_tick=10)
+        timeline = make_timeline()
+        header = PROTOCOLS["delta"].header(timeline, "resumed")
+        ws = FakeWebSocket()
+        subscription = hub.subscribe(ws, "resumed", timeline, start_index=1, protocol=PROTOCOLS["delta"])
+
+        hub.control(subscription, {"action": "burst"})
+        assert await asyncio.wait_for(pump_stream(ws, subscription), timeout=1) is None
+        assert ["p" in frame for frame in ws.sent] == [True, False]
+        assert decode_deltas(header, ws.sent) == {day: self.EXPECTED[day] for day in ("2025-07-02", "2025-07-03")}
+
+    def test_payload_is_an_order_of_magnitude_smaller(self):
+        timeline = make_timeline()
+        encoding = ENCODINGS["json"]
+        full = len(encoding.prefix(str(uuid.uuid4()))) + len(timeline.bodies(encoding)[2]) + \
+            len(encoding.suffix(datetime.now().isoformat()))
+        assert len(timeline.delta_bodies(encoding, key=False)[2]) * 10 < full
+
+
+class TestReplayControl:
+    """Test speed, pause, seek and burst controls on the replay clock"""
+
+    @pytest.mark.asyncio
+    async def test_burst_sends_remaining_frames(self):
+        hub = PriceStreamHub(tick_seconds=10.0, slots_per_tick=10)
+        ws = FakeWebSocket()
+        subscription = hub.subscribe(ws, "bot", make_timeline())
+
+        assert hub.control(subscription, {"action": "burst"}) == \
+            {"action": "burst", "date_index": 4, "speed": 1.0, "paused": False}
+        assert await asyncio.wait_for(pump_stream(ws, subscription), timeout=1) is None
+        assert [frame["stream_info"]["date_index"] for frame in ws.sent] == [1, 2, 3]
+
+    @pytest.mark.asyncio
+    async def test_seek_and_speed(self):
+        hub = PriceStreamHub(tick_seconds=1.0, slots_per_tick=20)
+        ws = FakeWebSocket()
+        subscription = hub.subscribe(ws, "seeker", make_timeline())
+
+        assert hub.control(subscription, {"action": "seek", "date": "2025-07-02"})["date_index"] == 2
+        assert hub.control(subscription, {"action": "speed", "speed": 20})["speed"] == 20.0
+        # At 20x a 1 s tick becomes one 50 ms slot, so the two remaining days arrive quickly
+        assert await asyncio.wait_for(pump_stream(ws, subscription), timeout=1) is None
+        assert [frame["current_date"] for frame in ws.sent] == ["2025-07-02", "2025-07-03"]
+
+    @pytest.mark.asyncio
+    async def test_pause_and_resume(self):
+        hub = PriceStreamHub(tick_seconds=0.05, slots_per_tick=5)
+        ws = FakeWebSocket()
+        subscription = hub.subscribe(ws, "pauser", make_timeline())
+
+        assert hub.control(subscription, {"action": "pause"})["paused"] is True
+        await asyncio.sleep(0.2)
+        assert not subscription.frames
+
+        hub.control(subscription, {"action": "resume"})
+        assert await asyncio.wait_for(pump_stream(ws, subscription), timeout=5) is None
+        assert len(ws.sent) == 3
+
+    @pytest.mark.asyncio
+    async def test_control_detaches_from_shared_group(self):
+        hub = PriceStreamHub(tick_seconds=10.0, slots_per_tick=10)
+        timeline = make_timeline()
+        steady_ws, bot_ws = FakeWebSocket(), FakeWebSocket()
+        steady = hub.subscribe(steady_ws, "steady", timeline)
+        bot = hub.subscribe(bot_ws, "bot", timeline)
+        shared = steady.group
+
+        hub.control(bot, {"action": "burst"})
+        assert bot.group is not shared
+        assert steady.group is shared and shared.subscribers == {steady}
+        assert not steady.frames and shared.clock.index == 0
+
+        hub.unsubscribe(steady)
+        hub.unsubscribe(bot)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("message, error", [
+        ({"action": "rewind"}, "Unknown action"),
+        ({"action": "speed", "speed": 0}, "speed must be"),
+        ({"action": "speed", "speed": "fast"}, "speed must be"),
+        ({"action": "seek", "date": "July"}, "ISO date"),
+        ({"action": "seek", "date": "2025-07-04"}, "after the last trading day"),
+    ])
+    async def test_invalid_controls(self, message, error):
+        hub = PriceStreamHub(tick_seconds=10.0, slots_per_tick=10)
+        subscription = hub.subscribe(FakeWebSocket(), "bad", make_timeline())
+
+        with pytest.raises(ValueError, match=error):
+            hub.control(subscription, message)
+        assert hub.controls == 0
+        hub.unsubscribe(subscription)
+
+    @pytest.mark.asyncio
+    async def test_control_messages_reach_the_hub(self):
+        hub = PriceStreamHub(tick_seconds=10.0, slots_per_tick=10)
+        ws = FakeWebSocket()
+        subscription = hub.subscribe(ws, "bot", make_timeline())
+        replies = []
+
+        async def on_message(text):
+            replies.append(hub.control(subscription, json.loads(text)))
+
+        ws.incoming.put_nowait('{"action": "burst"}')
+        assert await asyncio.wait_for(pump_stream(ws, subscription, on_message), timeout=1) is None
+        assert replies[0]["action"] == "burst"
+        assert len(ws.sent) == 3
+
+
+class TestStreamCursors:
+    """Test resuming from a start index and the write-behind cursor checkpoints"""
+
+    @pytest_asyncio.fixture
+    async def session_factory(self, db_factory):
+        """Seed two sessions that have selections"""
+        async with db_factory() as db:
+            db.add(Player(id=1, nickname="streamer"))
+            db.add_all([Stock(symbol=symbol, company_name=symbol, category="popular")
+                        for symbol in ("AAPL", "TSLA", "MSFT")])
+            db.add_all([SessionModel(session_id=session_id, player_id=1, started_at=datetime(2025, 8, 1),
+                                     status="active") for session_id in self.SESSION_IDS])
+            await db.flush()
+            db.add_all([SessionSelection(session_id=session_id, popular_symbol="AAPL", volatile_symbol="TSLA",
+                                         sector_symbol="MSFT", month=7, year=2025)
+                        for session_id in self.SESSION_IDS])
+            await db.commit()
+        return db_factory
+
+    SESSION_IDS = (uuid.uuid4(), uuid.uuid4())
+
+    async def cursors(self, factory):
+        async with factory() as db:
+            rows = await db.execute(select(SessionSelection.session_id, SessionSelection.current_date))
+            return dict(rows.all())
+
+    @pytest.mark.asyncio
+    async def test_subscribe_from_start_index(self):
+        hub = PriceStreamHub(tick_seconds=10.0, slots_per_tick=10)
+        ws = FakeWebSocket()
+        subscription = hub.subscribe(ws, "resumed", make_timeline(), start_index=1)
+        sent = []
+
+        hub.control(subscription, {"action": "burst"})
+        assert await asyncio.wait_for(pump_stream(ws, subscription, on_sent=sent.append), timeout=1) is None
+        assert [frame["current_date"] for frame in ws.sent] == ["2025-07-02", "2025-07-03"]
+        assert sent == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_cursors_written_in_one_batch(self, session_factory):
+        first, second = self.SESSION_IDS
+        checkpointer = CursorCheckpointer(session_factory, flush_seconds=60)
+        for day in (1, 2, 3):
+            checkpointer.record(first, date(2025, 7, day))
+        checkpointer.record(second, date(2025, 7, 2))
+        assert checkpointer.cursor(first) == date(2025, 7, 3)
+
+        statements = []
+        engine = session_factory.kw["bind"].sync_engine
+        record = lambda conn, cursor, statement, *rest: statements.append(statement)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            await checkpointer.close()
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        assert len(statements) == 1 and statements[0].startswith("UPDATE session_selections")
+        assert await self.cursors(session_factory) == {
+            first: datetime(2025, 7, 3),
+            second: datetime(2025, 7, 2),
+        }
+        assert checkpointer.cursor(first) is None
+        assert checkpointer.stats() == {"pending": 0, "flushes": 1, "rows_written": 2, "flush_errors": 0}
+
+    @pytest.mark.asyncio
+    async def test_background_flush(self, session_factory):
+        first, _ = self.SESSION_IDS
+        checkpointer = CursorCheckpointer(session_factory, flush_seconds=0.01)
+        checkpointer.record(first, date(2025, 7, 2))
+
+        await asyncio.wait_for(checkpointer._task, timeout=5)
+        assert (await self.cursors(session_factory))[first] == datetime(2025, 7, 2)
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_newer_cursor(self, session_factory, monkeypatch):
+        first, _ = self.SESSION_IDS
+        checkpointer = CursorCheckpointer(session_factory, flush_seconds=60)
+        checkpointer.record(first, date(2025, 7, 1))
+
+        async def failing(db, cursors):
+            checkpointer.record(first, date(2025, 7, 3))
+            raise RuntimeError("database is down")
+
+        monkeypatch.setattr(crud, "update_selection_cursors", failing)
+        await checkpointer.flush()
+        assert checkpointer.cursor(first) == date(2025, 7, 3)
+        assert checkpointer.flush_errors == 1
+
+        monkeypatch.undo()
+        await checkpointer.close()
+        assert (await self.cursors(session_factory))[first] == datetime(2025, 7, 3)
+
+
+class TestStreamPrices:
+    """Test the messages /ws/prices sends around the hub"""
+
+    SESSION_ID = uuid.uuid4()
+
+    @pytest_asyncio.fixture
+    async def stream(self, db_factory, monkeypatch):
+        async with db_factory() as db:
+            db.add(Player(id=1, nickname="streamer"))
+            db.add_all([Stock(symbol=symbol, company_name=symbol, category="popular")
+                        for symbol in ("AAPL", "TSLA", "MSFT")])
+            db.add(SessionModel(session_id=self.SESSION_ID, player_id=1, started_at=datetime(2025, 8, 1),
+                                status="active"))
+            await db.flush()
+            db.add(SessionSelection(session_id=self.SESSION_ID, popular_symbol="AAPL", volatile_symbol="TSLA",
+                                    sector_symbol="MSFT", month=7, year=2025))
+            await db.commit()
+
+        async def get_months(db, symbols, year, month):
+            return {symbol: make_timeline().series[symbol] for symbol in symbols}
+
+        monkeypatch.setattr(ws_router, "AsyncSessionLocal", db_factory)
+        monkeypatch.setattr(ws_router.price_cache, "get_months", get_months)
+
+        async def stream():
+            socket = FakeWebSocket()
+            await asyncio.wait_for(ws_router.stream_prices(socket, str(self.SESSION_ID)), timeout=1)
+            return socket.sent
+
+        return stream
+
+    @pytest.mark.asyncio
+    async def test_streaming_error_is_reported(self, stream, monkeypatch):
+        async def failing(*args):
+            return RuntimeError("hub stopped")
+
+        monkeypatch.setattr(ws_router, "run_subscription", failing)
+        sent = await stream()
+
+        assert sent[0]["message"].startswith("Starting historical price stream")
+        assert sent[-1] == {"error": "Error during streaming: hub stopped"}
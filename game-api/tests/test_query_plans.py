@@ -0,0 +1,150 @@
+"""
+Check that crud queries on hot lookup columns are served by an index.
+
+Each test runs a crud function against SQLite, captures the SQL it sends and
+asserts on the EXPLAIN QUERY PLAN output: the filtered table must be searched
+through the expected index rather than scanned, and index-ordered queries must
+not need a temporary sort.
+"""
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+
+
+class PlanHarness:
+    """Capture statements run by crud functions and explain them"""
+
+    def __init__(self, sync_engine, async_engine):
+        self.sync_engine = sync_engine
+        self.async_engine = async_engine
+
+    @contextmanager
+    def capture(self, engine):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT"):
+                statements.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+    def explain(self, statement, parameters):
+        with self.sync_engine.connect() as conn:
+            rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, tuple(parameters)).all()
+        return [row[3] for row in rows]
+
+    def assert_uses_index(self, statements, table, index, ordered=False):
+        """Assert that some captured statement reads `table` through `index`"""
+        assert statements, "No SELECT statements captured"
+        plans = [self.explain(statement, parameters) for statement, parameters in statements]
+        for plan in plans:
+            if any(line.startswith(f"SEARCH {table} ") or line.startswith(f"SCAN {table} ") for line in plan):
+                steps = [line for line in plan if f" {table} " in f" {line} "]
+                assert any(f"INDEX {index} " in f"{line} " for line in steps), plan
+                if ordered:
+                    assert not any("TEMP B-TREE" in line for line in plan), plan
+                return plan
+        raise AssertionError(f"No captured statement reads {table}: {plans}")
+
+
+@pytest.fixture
+def harness(db_engine):
+    """Reach the shared SQLite database through its async engine and a sync engine on the same file"""
+    sync_engine = create_engine(f"sqlite:///{db_engine.url.database}")
+    yield PlanHarness(sync_engine, db_engine)
+    sync_engine.dispose()
+
+
+async def run_async(harness, fn, *args, **kwargs):
+    factory = async_sessionmaker(bind=harness.async_engine, class_=AsyncSession, expire_on_commit=False)
+    with harness.capture(harness.async_engine.sync_engine) as statements:
+        async with factory() as db:
+            await fn(db, *args, **kwargs)
+    return statements
+
+
+def run_sync(harness, fn, *args, **kwargs):
+    with harness.capture(harness.sync_engine) as statements:
+        with sessionmaker(bind=harness.sync_engine)() as db:
+            fn(db, *args, **kwargs)
+    return statements
+
+
+SESSION_ID = uuid.uuid4()
+
+
+class TestQueryPlans:
+    """EXPLAIN QUERY PLAN assertions for crud lookups"""
+
+    @pytest.mark.asyncio
+    async def test_trade_columns_read_in_index_order(self, harness):
+        statements = await run_async(harness, crud.get_trade_columns, SESSION_ID)
+        harness.assert_uses_index(statements, "trades", "ix_trades_session_id_timestamp", ordered=True)
+
+    @pytest.mark.asyncio
+    async def test_trades(self, harness):
+        statements = await run_async(harness, crud.get_trades, SESSION_ID)
+        harness.assert_uses_index(statements, "trades", "ix_trades_session_id_timestamp")
+
+    @pytest.mark.asyncio
+    async def test_selection(self, harness):
+        statements = await run_async(harness, crud.get_selection, SESSION_ID)
+        harness.assert_uses_index(statements, "session_selections", "ix_session_selections_session_id")
+
+    @pytest.mark.asyncio
+    async def test_unsold_shares(self, harness):
+        statements = await run_async(harness, crud.get_unsold_shares, SESSION_ID)
+        harness.assert_uses_index(statements, "unsold_shares", "ix_unsold_shares_session_id")
+
+    @pytest.mark.asyncio
+    async def test_admin_sessions_newest_first(self, harness):
+        statements = await run_async(harness, crud.get_sessions_with_filters, limit=50)
+        harness.assert_uses_index(statements, "sessions", "ix_sessions_started_at_session_id", ordered=True)
+
+    @pytest.mark.asyncio
+    async def test_admin_sessions_cursor_page(self, harness):
+        cursor = crud.encode_cursor(datetime(2025, 7, 1), SESSION_ID)
+        statements = await run_async(harness, crud.get_sessions_with_filters, limit=50, cursor=cursor)
+        harness.assert_uses_index(statements, "sessions", "ix_sessions_started_at_session_id", ordered=True)
+
+    @pytest.mark.asyncio
+    async def test_admin_sessions_by_player(self, harness):
+        statements = await run_async(harness, crud.get_sessions_with_filters, player_id=1,
+                                     start_date=date(2025, 7, 1))
+        harness.assert_uses_index(statements, "sessions", "ix_sessions_player_id_started_at", ordered=True)
+
+    @pytest.mark.asyncio
+    async def test_admin_sessions_by_status(self, harness):
+        statements = await run_async(harness, crud.get_sessions_with_filters, status="ended")
+        harness.assert_uses_index(statements, "sessions", "ix_sessions_status_started_at", ordered=True)
+
+    @pytest.mark.asyncio
+    async def test_admin_sessions_score_join(self, harness):
+        statements = await run_async(harness, crud.get_sessions_with_filters, limit=50)
+        harness.assert_uses_index(statements, "scores", "ix_scores_session_id")
+
+    @pytest.mark.asyncio
+    async def test_audit_logs_newest_first(self, harness):
+        statements = await run_async(harness, crud.get_audit_logs, limit=100)
+        harness.assert_uses_index(statements, "admin_audit_log", "ix_admin_audit_log_timestamp_id", ordered=True)
+
+    def test_agent_interactions(self, harness):
+        statements = run_sync(harness, crud.get_agent_interactions, session_id=SESSION_ID)
+        harness.assert_uses_index(statements, "agent_interactions",
+                                  "ix_agent_interactions_session_id_timestamp", ordered=True)
+
+    def test_session_chat_log(self, harness):
+        statements = run_sync(harness, crud.get_session_chat_log, SESSION_ID)
+        harness.assert_uses_index(statements, "agent_interactions",
+                                  "ix_agent_interactions_session_id_timestamp", ordered=True)
@@ -0,0 +1,171 @@
+"""
+Test the batch rescoring job
+"""
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, event, func, select, update
+
+from app import crud, rescoring
+from app.models import Player, PlayerStats, Score, Session as GameSession, Stock, Trade, UnsoldShare
+from app.rescoring import RescoreJob, run_rescore_job
+
+
+@pytest_asyncio.fixture
+async def session_factory(db_factory):
+    """Seed one stock; the shared database uses WAL, so the job can write while its read cursor is open"""
+    async with db_factory() as session:
+        session.add(Stock(symbol="AAPL", company_name="Apple Inc.", category="popular"))
+        await session.commit()
+    return db_factory
+
+
+async def seed(db, player, trades, status="ended"):
+    session = GameSession(session_id=uuid.uuid4(), player_id=player.id,
+                          started_at=datetime(2025, 7, 1), status=status, balance=10000.0)
+    db.add(session)
+    for i, (action, qty, price) in enumerate(trades):
+        db.add(Trade(session_id=session.session_id, timestamp=datetime(2025, 7, 1) + timedelta(minutes=i),
+                     symbol="AAPL", action=action, qty=qty, price=price))
+    await db.commit()
+    return session
+
+
+async def snapshot(db):
+    scores = (await db.execute(select(
+        Score.session_id, Score.player_id, Score.total_trades, Score.total_profit, Score.total_score
+    ).order_by(Score.session_id))).all()
+    unsold = (await db.execute(select(
+        UnsoldShare.session_id, UnsoldShare.symbol, UnsoldShare.quantity, UnsoldShare.purchase_price
+    ).order_by(UnsoldShare.session_id, UnsoldShare.id))).all()
+    stats = (await db.execute(select(
+        PlayerStats.player_id, PlayerStats.total_score, PlayerStats.total_profit,
+        PlayerStats.total_trades, PlayerStats.score_count
+    ).order_by(PlayerStats.player_id))).all()
+    return scores, unsold, stats
+
+
+class TestRescoreJob:
+    """Test rescoring.run_rescore_job"""
+
+    async def _seed_game(self, factory):
+        async with factory() as db:
+            alice, bob = Player(nickname="Alice"), Player(nickname="Bob")
+            db.add_all([alice, bob])
+            await db.commit()
+            sessions = [
+                await seed(db, alice, [("buy", 10, 100.0), ("sell", 4, 110.0), ("sell", 2, 130.0)]),
+                await seed(db, alice, []),
+                await seed(db, bob, [("buy", 3, 50.0), ("buy", 2, 60.0), ("sell", 4, 55.0)] * 3),
+                await seed(db, bob, [("buy", 1, 10.0), ("sell", 1, 12.0)]),
+            ]
+            for session in sessions:
+                await crud.calculate_score(db, session.session_id)
+                session.status = "ended"
+            await db.commit()
+            # Active sessions are not scored
+            await seed(db, bob, [("buy", 1, 10.0)], status="active")
+            return await snapshot(db)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("chunk_size", [1, 4, 1000])
+    async def test_matches_per_session_scoring(self, session_factory, chunk_size):
+        expected = await self._seed_game(session_factory)
+        # Stale scores and unsold shares are replaced
+        async with session_factory() as db:
+            await db.execute(update(Score).values(total_score=0.0, total_profit=0.0))
+            await db.execute(delete(UnsoldShare))
+            await db.commit()
+
+        job = RescoreJob()
+        await run_rescore_job(job, session_factory, chunk_size=chunk_size, max_workers=0)
+
+        assert job.status == "completed", job.error
+        progress = job.progress()
+        assert progress["sessions_total"] == progress["sessions_done"] == 4
+        assert progress["trades_processed"] == 3 + 9 + 2
+        assert progress["percent_complete"] == 100.0
+        async with session_factory() as db:
+            assert await snapshot(db) == expected
+
+    @pytest.mark.asyncio
+    async def test_process_pool(self, session_factory):
+        expected = await self._seed_game(session_factory)
+
+        job = RescoreJob()
+        await run_rescore_job(job, session_factory, chunk_size=2, max_workers=1)
+
+        assert job.status == "completed", job.error
+        async with session_factory() as db:
+            assert await snapshot(db) == expected
+            assert await db.scalar(select(func.count(Score.id))) == 4
+
+    @pytest.mark.asyncio
+    async def test_failure_is_reported(self):
+        def broken_factory():
+            raise RuntimeError("database unavailable")
+
+        job = RescoreJob()
+        await run_rescore_job(job, broken_factory, max_workers=0)
+
+        assert job.status == "failed"
+        assert job.error == "database unavailable"
+        assert job.progress()["finished_at"] is not None
+
+    @pytest.mark.asyncio
+    async def test_session_ending_mid_job_is_scored(self, session_factory):
+        await self._seed_game(session_factory)
+        db_path = session_factory.kw["bind"].url.database
+        engine = session_factory.kw["bind"].sync_engine
+
+        # End the active session right after the ended-session snapshot is read
+        done = []
+
+        def end_active_session(conn, cursor, statement, parameters, context, executemany):
+            if not done and "FROM sessions" in statement and "trades" not in statement:
+                with sqlite3.connect(db_path) as other:
+                    other.execute("UPDATE sessions SET status = 'ended' WHERE status = 'active'")
+                done.append(True)
+
+        event.listen(engine, "after_cursor_execute", end_active_session)
+        job = RescoreJob()
+        try:
+            await run_rescore_job(job, session_factory, chunk_size=2, max_workers=0)
+        finally:
+            event.remove(engine, "after_cursor_execute", end_active_session)
+
+        assert job.status == "completed", job.error
+        assert job.progress()["sessions_done"] == job.progress()["sessions_total"] == 5
+        async with session_factory() as db:
+            assert await db.scalar(select(func.count(Score.id))) == 5
+
+    @pytest.mark.asyncio
+    async def test_failed_job_rebuilds_player_stats(self, session_factory, monkeypatch):
+        await self._seed_game(session_factory)
+        async with session_factory() as db:
+            await db.execute(update(Score).values(total_score=0.0))
+            await db.commit()
+
+        original = rescoring._write_scores
+        calls = []
+
+        async def failing_write(db, outcomes, players):
+            calls.append(len(outcomes))
+            if len(calls) == 2:
+                raise RuntimeError("disk full")
+            await original(db, outcomes, players)
+
+        monkeypatch.setattr(rescoring, "_write_scores", failing_write)
+        job = RescoreJob()
+        await run_rescore_job(job, session_factory, chunk_size=1, max_workers=0)
+
+        assert job.status == "failed"
+        async with session_factory() as db:
+            totals = dict((await db.execute(
+                select(Score.player_id, func.sum(Score.total_score)).group_by(Score.player_id))).all())
+            stats = dict((await db.execute(select(PlayerStats.player_id, PlayerStats.total_score))).all())
+            assert stats == totals
+            assert any(total > 0 for total in totals.values())
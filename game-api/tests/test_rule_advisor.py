@@ -0,0 +1,73 @@
+"""
+Test the rule-based advisor
+"""
+import pytest
+
+from app import rule_advisor, schemas
+
+
+def indicators(last=100.0, ema=98.0, sma_5=99.0, sma_10=97.0, rsi=55.0, days=20, return_pct=4.0):
+    return {"days": days, "last_price": last, "ema_10": ema, "sma_5": sma_5, "sma_10": sma_10, "rsi_14": rsi,
+            "return_pct": return_pct}
+
+
+def buy(symbol, qty, price):
+    return {"symbol": symbol, "action": "buy", "qty": qty, "price": price}
+
+
+def sell(symbol, qty, price):
+    return {"symbol": symbol, "action": "sell", "qty": qty, "price": price}
+
+
+class TestOpenPositions:
+    """Test FIFO open lots of a trade history"""
+
+    def test_average_cost_of_open_lots(self):
+        trades = [buy("AAPL", 10, 100.0), buy("AAPL", 10, 110.0), sell("AAPL", 15, 120.0), buy("TSLA", 2, 50.0),
+                  sell("TSLA", 2, 55.0)]
+
+        # The first lot and half of the second were sold
+        assert rule_advisor.open_positions(trades) == {"AAPL": (5, 110.0)}
+
+    def test_no_trades(self):
+        assert rule_advisor.open_positions([]) == {}
+
+
+class TestRules:
+    """Test the advice rules for held and unheld symbols"""
+
+    @pytest.mark.parametrize("values, action", [
+        (indicators(), "BUY"),                                    # uptrend
+        (indicators(rsi=75.0), "HOLD"),                           # uptrend but overbought
+        (indicators(last=95.0, rsi=25.0), "BUY"),                 # oversold
+        (indicators(last=95.0, rsi=45.0), "HOLD"),                # below the EMA
+        (indicators(sma_5=96.0), "HOLD"),                         # short average below the long one
+        (indicators(sma_10=None, rsi=None, days=6), "BUY"),       # short month, EMA only
+        (indicators(last=None, ema=None, days=0), "HOLD"),        # no prices
+    ])
+    def test_unheld(self, values, action):
+        item = rule_advisor.advise_symbol("AAPL", values, None)
+        assert item.action == schemas.Action(action)
+
+    @pytest.mark.parametrize("values, cost, action", [
+        (indicators(last=125.0), 100.0, "SELL"),                  # above the top bonus tier
+        (indicators(last=105.0), 100.0, "HOLD"),                  # profitable and still rising
+        (indicators(last=105.0, rsi=80.0), 100.0, "SELL"),        # take profit, overbought
+        (indicators(last=95.0, ema=98.0), 90.0, "SELL"),          # take profit, momentum down
+        (indicators(last=90.0, ema=98.0), 100.0, "SELL"),         # stop loss
+        (indicators(last=96.0, ema=98.0), 100.0, "HOLD"),         # small loss
+        (indicators(last=90.0, ema=88.0), 100.0, "HOLD"),         # loss but momentum up
+    ])
+    def test_held(self, values, cost, action):
+        item = rule_advisor.advise_symbol("AAPL", values, (10, cost))
+        assert item.action == schemas.Action(action)
+        assert "You hold 10" in item.reason
+
+    def test_advise_covers_each_symbol(self):
+        data = {"AAPL": indicators(last=125.0), "TSLA": indicators(), "XOM": indicators(last=95.0, rsi=45.0)}
+
+        response = rule_advisor.advise(["AAPL", "TSLA", "XOM"], data, [buy("AAPL", 4, 100.0)])
+
+        assert isinstance(response, schemas.TradingAdviceResponse)
+        assert [(item.symbol, item.action.value) for item in response.advice] == [
+            ("AAPL", "SELL"), ("TSLA", "BUY"), ("XOM", "HOLD")]
@@ -0,0 +1,127 @@
+"""
+Test the columnar scoring engine against the original trade-by-trade rules
+"""
+import random
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from app.scoring import RunningScore, bonus_points, score_sessions, score_trades
+
+
+def legacy_score(trades):
+    """Reference implementation: the original calculate_score loop"""
+    buy_stack = defaultdict(list)
+    total_score = 0
+    total_profit = 0.0
+    for symbol, action, qty, price in trades:
+        action = action.lower()
+        total_score += 1
+        if action == 'buy':
+            buy_stack[symbol].append({'qty': qty, 'price': price})
+        elif action == 'sell':
+            qty_left = qty
+            while qty_left > 0 and buy_stack[symbol]:
+                buy = buy_stack[symbol][0]
+                matched_qty = min(qty_left, buy['qty'])
+                profit_per_share = price - buy['price']
+                profit_amount = profit_per_share * matched_qty
+                profit_pct = (profit_per_share / buy['price']) * 100
+                total_profit += profit_amount
+                if profit_pct > 0:
+                    if profit_pct <= 5:
+                        total_score += 1
+                    elif profit_pct <= 10:
+                        total_score += 2
+                    elif profit_pct <= 20:
+                        total_score += 3
+                    else:
+                        total_score += 5
+                buy['qty'] -= matched_qty
+                if buy['qty'] == 0:
+                    buy_stack[symbol].pop(0)
+                qty_left -= matched_qty
+    unsold = [(symbol, b['qty'], b['price']) for symbol, buys in buy_stack.items() for b in buys if b['qty'] > 0]
+    return len(trades), total_profit, total_score, unsold
+
+
+def columns(trades):
+    return [list(column) for column in zip(*trades)] if trades else ([], [], [], [])
+
+
+class TestScoringEngine:
+    """Test scoring.score_trades"""
+
+    def test_bonus_tiers(self):
+        pct = np.array([-3.0, 0.0, 0.1, 5.0, 5.01, 10.0, 10.5, 20.0, 20.01, 300.0])
+        assert bonus_points(pct).tolist() == [0, 0, 1, 1, 2, 2, 3, 3, 5, 5]
+
+    def test_empty_session(self):
+        result = score_trades([], [], [], [])
+        assert result.total_trades == 0
+        assert result.total_profit == 0.0
+        assert result.total_score == 0
+        assert result.unsold == []
+
+    def test_fifo_matching_and_unsold(self):
+        trades = [
+            ("AAPL", "buy", 10, 100.0),
+            ("AAPL", "BUY", 10, 120.0),
+            ("AAPL", "sell", 15, 110.0),   # 10 @ +10% and 5 @ -8.3%
+            ("TSLA", "sell", 5, 50.0),     # Nothing to match
+            ("TSLA", "buy", 3, 40.0),
+        ]
+        result = score_trades(*columns(trades))
+        assert result.total_trades == 5
+        assert result.total_profit == 10 * 10.0 + 5 * -10.0
+        assert result.total_score == 5 + 2
+        assert result.unsold == [("AAPL", 5, 120.0), ("TSLA", 3, 40.0)]
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_matches_legacy_rules_bit_for_bit(self, seed):
+        rng = random.Random(seed)
+        trades = [
+            (rng.choice(["AAPL", "TSLA", "MSFT"]), rng.choice(["buy", "sell", "Buy"]),
+             rng.randint(1, 50), round(rng.uniform(1, 500), rng.randint(0, 6)))
+            for _ in range(rng.randint(1, 400))
+        ]
+        expected = legacy_score(trades)
+        result = score_trades(*columns(trades))
+        assert result.total_trades == expected[0]
+        assert result.total_profit == expected[1]  # Exact equality, not approx
+        assert result.total_score == expected[2]
+        assert result.unsold == expected[3]
+
+    def test_score_sessions_batch(self):
+        sessions = {
+            "a": columns([("AAPL", "buy", 1, 100.0), ("AAPL", "sell", 1, 130.0)]),
+            "b": columns([]),
+        }
+        results = score_sessions(sessions)
+        assert results["a"].total_score == 7
+        assert results["b"].total_trades == 0
+
+
+class TestRunningScore:
+    """Test scoring.RunningScore against score_trades"""
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_matches_score_trades_bit_for_bit(self, seed):
+        rng = random.Random(seed)
+        trades = [
+            (rng.choice(["AAPL", "TSLA", "MSFT"]), rng.choice(["buy", "sell", "Buy", "hold"]),
+             rng.randint(1, 50), rng.choice([0.0, round(rng.uniform(1, 500), rng.randint(0, 6))]))
+            for _ in range(rng.randint(1, 400))
+        ]
+        running = RunningScore()
+        for trade in trades:
+            running.add(*trade)
+        assert running.result() == score_trades(*columns(trades))
+
+    def test_add_returns_sold_quantity(self):
+        running = RunningScore()
+        assert running.add("AAPL", "buy", 10, 100.0) == 0
+        assert running.add("AAPL", "sell", 15, 130.0) == 10
+        assert running.add("TSLA", "sell", 5, 50.0) == 0
+        assert (running.total_trades, running.total_profit, running.total_score) == (3, 300.0, 8)
@@ -0,0 +1,154 @@
+"""
+Test the in-memory stock availability catalog
+"""
+from datetime import date
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+
+from app import crud, schemas
+from app.models import Stock
+from app.stock_catalog import StockCatalog, stock_catalog
+
+
+class TestStockCatalog:
+    """Test precomputed roulette months and month availability"""
+
+    @pytest_asyncio.fixture
+    async def async_db_session(self, db_factory):
+        """Create an async SQLite session seeded with stocks of every category"""
+        async with db_factory() as session:
+            session.add_all([
+                Stock(symbol="AAPL", company_name="Apple", category="popular", available_from=date(2024, 1, 1)),
+                Stock(symbol="TSLA", company_name="Tesla", category="volatile",
+                      available_from=date(2024, 3, 1), available_to=date(2024, 6, 15)),
+                Stock(symbol="GME", company_name="GameStop", category="volatile", available_from=date(2024, 9, 1)),
+                Stock(symbol="JPM", company_name="JPMorgan", category="sector", sector="Finance",
+                      available_from=date(2024, 1, 1)),
+                Stock(symbol="XOM", company_name="Exxon", category="sector", sector="Energy",
+                      available_from=date(2024, 4, 10)),
+                Stock(symbol="NOSEC", company_name="No sector", category="sector", available_from=date(2024, 1, 1)),
+                Stock(symbol="UNDATED", company_name="Undated", category="popular"),
+            ])
+            await session.commit()
+            yield session
+
+    @pytest.mark.asyncio
+    async def test_eligible_months(self, async_db_session):
+        catalog = StockCatalog()
+
+        # Candidates are the months stocks became available: Jan, Mar, Apr and Sep 2024.
+        # January has no volatile stock yet; UNDATED and NOSEC never count.
+        assert await catalog.eligible_months(async_db_session) == [
+            {"month": 3, "year": 2024},
+            {"month": 4, "year": 2024},
+            {"month": 9, "year": 2024},
+        ]
+
+    @pytest.mark.asyncio
+    async def test_month_availability(self, async_db_session):
+        catalog = StockCatalog()
+
+        may = await catalog.month(async_db_session, 5, 2024)
+        assert may.popular == ("AAPL",)
+        assert may.volatile == ("TSLA",)
+        assert may.sectors == {"Finance": ("JPM",), "Energy": ("XOM",)}
+        assert may.playable
+
+        june = await catalog.month(async_db_session, 6, 2024)
+        assert june.volatile == ()
+        assert not june.playable
+
+    @pytest.mark.asyncio
+    async def test_spins_do_not_query(self, async_db_session):
+        catalog = StockCatalog()
+        statements = []
+        engine = async_db_session.bind.sync_engine
+        record = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            for _ in range(50):
+                assert (await catalog.random_eligible_month(async_db_session))["month"] in (3, 4, 9)
+                await catalog.month(async_db_session, 3, 2024)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        assert len(statements) == 1
+        assert catalog.loads == 1
+
+    @pytest.mark.asyncio
+    async def test_invalidate_and_ttl_reload(self, async_db_session):
+        catalog = StockCatalog()
+        assert {"month": 1, "year": 2024} not in await catalog.eligible_months(async_db_session)
+
+        async_db_session.add(Stock(symbol="AMC", company_name="AMC", category="volatile",
+                                   available_from=date(2023, 12, 1)))
+        await async_db_session.commit()
+        catalog.invalidate()
+        assert {"month": 1, "year": 2024} in await catalog.eligible_months(async_db_session)
+        assert catalog.loads == 2
+
+        expiring = StockCatalog(ttl_seconds=0)
+        await expiring.eligible_months(async_db_session)
+        await expiring.eligible_months(async_db_session)
+        assert expiring.loads == 2
+
+    @pytest.mark.asyncio
+    async def test_has_symbol(self, async_db_session):
+        catalog = StockCatalog()
+
+        # Undated stocks are never playable but still exist
+        assert await catalog.has_symbol(async_db_session, "UNDATED")
+        assert not await catalog.has_symbol(async_db_session, "AMC")
+        assert catalog.loads == 1
+
+    @pytest.mark.asyncio
+    async def test_no_stocks(self, async_db_session):
+        await async_db_session.execute(Stock.__table__.delete())
+        await async_db_session.commit()
+
+        catalog = StockCatalog()
+        assert await catalog.eligible_months(async_db_session) == []
+        assert await catalog.random_eligible_month(async_db_session) is None
+
+    @pytest.mark.asyncio
+    async def test_create_stock_invalidates_shared_catalog(self, async_db_session):
+        stock_catalog._stocks = []
+        await crud.create_stock(async_db_session, schemas.StockCreate(
+            symbol="NVDA", company_name="Nvidia", category="popular"))
+        assert stock_catalog._stocks is None
+
+    @pytest.mark.asyncio
+    async def test_roulette_selection_served_from_catalog(self, async_db_session, monkeypatch):
+        monkeypatch.setattr(stock_catalog, "_stocks", None)
+        await crud.get_roulette_selection(async_db_session, 5, 2024)
+
+        statements = []
+        engine = async_db_session.bind.sync_engine
+        record = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            for _ in range(20):
+                selection = await crud.get_roulette_selection(async_db_session, 5, 2024)
+                assert (selection.popular_symbol, selection.volatile_symbol) == ("AAPL", "TSLA")
+                assert selection.sector_symbol in ("JPM", "XOM")
+                assert (selection.month, selection.year) == (5, 2024)
+            assert await crud.get_roulette_selection(async_db_session, 6, 2024) is None
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        assert statements == []
+
+    @pytest.mark.asyncio
+    async def test_interval_boundaries(self, async_db_session):
+        catalog = StockCatalog()
+
+        # XOM starts on 10 April, so April is not covered but May is
+        april = await catalog.month(async_db_session, 4, 2024)
+        assert "Energy" not in april.sectors
+        # TSLA ends on 15 June: covers May, not June
+        assert (await catalog.month(async_db_session, 5, 2024)).volatile == ("TSLA",)
+        assert (await catalog.month(async_db_session, 6, 2024)).volatile == ()
+        # Before any stock starts nothing is available
+        assert not (await catalog.month(async_db_session, 12, 2023)).playable
@@ -0,0 +1,144 @@
+"""
+Test the write-behind trade ingestor and its batched, idempotent inserts
+"""
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from pydantic import ValidationError
+from sqlalchemy import event, func, select
+
+from app import schemas
+from app.models import Player, Session as SessionModel, Stock, Trade
+from app.trade_ingest import TradeIngestor
+
+SESSION_ID = uuid.uuid4()
+
+
+def make_trade(symbol="AAPL", client_trade_id=None, qty=1):
+    return schemas.TradeCreate(
+        session_id=SESSION_ID,
+        timestamp=datetime(2025, 7, 1, 10, 30),
+        symbol=symbol,
+        action="buy",
+        qty=qty,
+        price=100.0,
+        client_trade_id=client_trade_id
+    )
+
+
+@pytest_asyncio.fixture
+async def database(db_engine, db_factory):
+    """Seed one session and one stock; record the INSERT statements sent after seeding"""
+    async with db_factory() as db:
+        db.add(Player(id=1, nickname="trader"))
+        db.add(Stock(symbol="AAPL", company_name="Apple Inc.", category="popular"))
+        db.add(SessionModel(session_id=SESSION_ID, player_id=1, started_at=datetime(2025, 8, 1), status="active"))
+        await db.commit()
+
+    inserts = []
+    event.listen(db_engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *rest:
+                 inserts.append(statement) if statement.startswith("INSERT") else None)
+
+    return db_factory, inserts
+
+
+async def count_trades(factory):
+    async with factory() as db:
+        return (await db.execute(select(func.count()).select_from(Trade))).scalar()
+
+
+class TestTradeIngestor:
+    """Test group commit, idempotency keys and shutdown flushing"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_trades_share_one_insert(self, database):
+        factory, inserts = database
+        ingestor = TradeIngestor(factory, window_seconds=0.05)
+
+        stored = await asyncio.gather(*(ingestor.submit(make_trade(qty=n + 1)) for n in range(50)))
+
+        assert [row["qty"] for row in stored] == list(range(1, 51))
+        assert len({row["trade_id"] for row in stored}) == 50
+        assert all(row["client_trade_id"] for row in stored)
+        assert len(inserts) == 1
+        assert await count_trades(factory) == 50
+        assert ingestor.stats()["batches"] == 1 and ingestor.stats()["largest_batch"] == 50
+
+    @pytest.mark.asyncio
+    async def test_batches_are_capped(self, database):
+        factory, inserts = database
+        ingestor = TradeIngestor(factory, window_seconds=60, max_batch=10)
+
+        # Full batches are written without waiting for the window
+        stored = await asyncio.wait_for(asyncio.gather(*(ingestor.submit(make_trade()) for _ in range(20))), 5)
+
+        assert len(stored) == 20
+        assert len(inserts) == 2
+        assert ingestor.stats()["largest_batch"] == 10
+
+    @pytest.mark.asyncio
+    async def test_retries_return_the_recorded_trade(self, database):
+        factory, _ = database
+        ingestor = TradeIngestor(factory, window_seconds=0.01)
+
+        # A retry while the trade is still queued waits for the same write
+        first, retry = await asyncio.gather(ingestor.submit(make_trade(client_trade_id="tap-1")),
+                                            ingestor.submit(make_trade(client_trade_id="tap-1")))
+        # A retry after it was recorded gets the stored row back
+        later = await ingestor.submit(make_trade(client_trade_id="tap-1", qty=99))
+
+        assert first["trade_id"] == retry["trade_id"] == later["trade_id"]
+        assert later["qty"] == 1
+        assert await count_trades(factory) == 1
+        assert ingestor.stats()["coalesced"] == 1
+
+    @pytest.mark.asyncio
+    async def test_bad_trade_does_not_fail_its_batch(self, database):
+        factory, _ = database
+        ingestor = TradeIngestor(factory, window_seconds=0.01)
+
+        results = await asyncio.gather(ingestor.submit(make_trade()),
+                                       ingestor.submit(make_trade(symbol="NOPE")),
+                                       ingestor.submit(make_trade()),
+                                       return_exceptions=True)
+
+        assert results[0]["symbol"] == results[2]["symbol"] == "AAPL"
+        assert isinstance(results[1], Exception)
+        assert await count_trades(factory) == 2
+        assert ingestor.stats()["batch_errors"] == 1
+        assert ingestor.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_close_writes_queued_trades(self, database):
+        factory, _ = database
+        ingestor = TradeIngestor(factory, window_seconds=60)
+        requests = [asyncio.create_task(ingestor.submit(make_trade())) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert ingestor.stats()["pending"] == 3
+
+        await ingestor.close()
+
+        assert len(await asyncio.wait_for(asyncio.gather(*requests), 1)) == 3
+        assert await count_trades(factory) == 3
+
+
+class TestTradeValidation:
+    """Test request validation of POST /api/trades/"""
+
+    @pytest.mark.parametrize("field, value", [("qty", 0), ("qty", -5), ("price", 0.0), ("action", "hold"),
+                                              ("client_trade_id", "")])
+    def test_invalid_trades_rejected(self, field, value):
+        data = make_trade().model_dump()
+        data[field] = value
+        with pytest.raises(ValidationError):
+            schemas.TradeCreate(**data)
+
+    @pytest.mark.parametrize("action, expected", [("BUY", "buy"), ("Sell", "sell"), ("buy", "buy")])
+    def test_action_case_is_normalized(self, action, expected):
+        data = make_trade().model_dump()
+        data["action"] = action
+        assert schemas.TradeCreate(**data).action == expected